@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""Benchmark fragmented (HLS) download throughput for download tuning settings.
+
+Serves a synthetic HLS stream from a local HTTP server, with per-request
+latency and a per-connection bandwidth cap like a CDN, and downloads it
+with yt-dlp using the options from YouTubeDownloader.get_tuning_options()
+for several concurrent fragment counts.
+
+Usage: python benchmarks/fragment_bench.py [--fragments 40] [--fragment-kb 512]
+                                           [--latency 0.05] [--rate-kb 2048] [--concurrency 1,2,4,8]
+"""
+
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import threading
+from pathlib import Path
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import yt_dlp
+
+from youtube_downloader import downloader
+
+# MPEG-TS packets are 188 bytes and start with a sync byte
+TS_PACKET = b"\x47" + b"\x00" * 187
+
+def make_handler(fragments: int, fragment_size: int, latency: float, rate: int):
+    """Request handler serving playlist.m3u8 and seg<N>.ts"""
+    payload = TS_PACKET * (fragment_size // len(TS_PACKET))
+    playlist = "\n".join(
+        ["#EXTM3U", "#EXT-X-VERSION:3", "#EXT-X-TARGETDURATION:4", "#EXT-X-MEDIA-SEQUENCE:0"]
+        + [f"#EXTINF:4.0,\nseg{i}.ts" for i in range(fragments)]
+        + ["#EXT-X-ENDLIST", ""]
+    ).encode()
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self):
+            time.sleep(latency)
+            if self.path.endswith("playlist.m3u8"):
+                body, content_type = playlist, "application/vnd.apple.mpegurl"
+            elif self.path.startswith("/seg") and self.path.endswith(".ts"):
+                body, content_type = payload, "video/mp2t"
+            else:
+                self.send_error(404)
+                return
+
+            self.send_response(200)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self._write_throttled(body)
+
+        def _write_throttled(self, body: bytes):
+            """Write body at no more than rate bytes/s"""
+            chunk = max(1, rate // 20)
+            started = time.monotonic()
+            for offset in range(0, len(body), chunk):
+                self.wfile.write(body[offset:offset + chunk])
+                ahead = (offset + chunk) / rate - (time.monotonic() - started)
+                if ahead > 0:
+                    time.sleep(ahead)
+
+        def log_message(self, *args):
+            pass
+
+    return Handler
+
+def run_download(url: str, directory: str, concurrency: int) -> float:
+    """Download stream once, return seconds"""
+    options = {
+        **downloader.get_tuning_options("mp4", "best"),
+        'concurrent_fragment_downloads': concurrency,
+        'outtmpl': os.path.join(directory, f"bench-{concurrency}.%(ext)s"),
+        'hls_prefer_native': True,
+        'fixup': 'never',
+        'quiet': True,
+        'no_warnings': True,
+        'noprogress': True,
+    }
+    started = time.perf_counter()
+    with yt_dlp.YoutubeDL(options) as ydl:
+        ydl.download([url])
+    return time.perf_counter() - started
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--fragments", type=int, default=40)
+    parser.add_argument("--fragment-kb", type=int, default=512)
+    parser.add_argument("--latency", type=float, default=0.05, help="seconds per request")
+    parser.add_argument("--rate-kb", type=int, default=2048, help="per-connection KB/s")
+    parser.add_argument("--concurrency", default="1,2,4,8")
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer(
+        ("127.0.0.1", 0),
+        make_handler(args.fragments, args.fragment_kb * 1024, args.latency, args.rate_kb * 1024)
+    )
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}/playlist.m3u8"
+    total_mb = args.fragments * args.fragment_kb / 1024
+
+    print(f"{args.fragments} fragments x {args.fragment_kb} KB, latency {args.latency * 1000:.0f} ms, "
+          f"{args.rate_kb} KB/s per connection")
+    directory = tempfile.mkdtemp(prefix="fragment_bench_")
+    try:
+        for concurrency in [int(value) for value in args.concurrency.split(",")]:
+            seconds = run_download(url, directory, concurrency)
+            print(f"concurrent_fragments={concurrency:<3} {seconds:6.2f}s  {total_mb / seconds:7.2f} MB/s")
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+        server.shutdown()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+"""Check and benchmark S3 uploads of StorageManager.
+
+First checks that upload_file and upload_fileobj round-trip a file through
+a multipart upload: the object has the expected parts, size and content,
+and the storage index records it. Then uploads a synthetic video file with
+boto3 defaults and with the tuned TransferConfig for several part sizes and
+concurrency levels, from a path and as a stream (upload_fileobj). Also runs
+several uploads at once through the storage I/O pool.
+
+Runs against --endpoint-url (MinIO, real S3) or, by default, a local
+moto server (pip install "moto[server]"). Against the in-process stand-in
+the numbers are only good for comparing settings with each other.
+
+The storage index is kept in a temporary SQLite database, not DATABASE_URL.
+
+Usage: python benchmarks/s3_upload_bench.py [--size-mb 64] [--part-mb 8,16] [--concurrency 1,4,8]
+                                            [--parallel-uploads 4] [--endpoint-url URL] [--check-only]
+"""
+
+import io
+import os
+import sys
+import time
+import shutil
+import asyncio
+import logging
+import argparse
+import tempfile
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+# Index rows of benchmark uploads stay out of the bot database
+WORK_DIR = tempfile.mkdtemp(prefix="s3_upload_bench_")
+os.environ["DATABASE_URL"] = f"sqlite:///{WORK_DIR}/bench.db"
+os.environ.setdefault("DEBUG", "False")  # no SQL echo between results
+
+from boto3.s3.transfer import TransferConfig
+
+from config import Config
+
+BUCKET = "youtube-bot-bench"
+
+def start_stand_in() -> tuple:
+    """Start local moto S3 server, return (server, endpoint url)"""
+    from moto.server import ThreadedMotoServer
+
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+    server = ThreadedMotoServer(ip_address="127.0.0.1", port=0)
+    server.start()
+    host, port = server.get_host_and_port()
+    return server, f"http://{host}:{port}"
+
+def make_storage(endpoint_url: str, bucket: str):
+    """StorageManager pointed at the benchmark endpoint"""
+    Config.STORAGE_TYPE = "s3"
+    Config.AWS_S3_ENDPOINT_URL = endpoint_url
+    Config.AWS_S3_BUCKET = bucket
+    Config.AWS_ACCESS_KEY_ID = Config.AWS_ACCESS_KEY_ID or "bench"
+    Config.AWS_SECRET_ACCESS_KEY = Config.AWS_SECRET_ACCESS_KEY or "bench"
+
+    from database import init_database
+    from storage import StorageManager
+    init_database()
+    manager = StorageManager()
+    try:
+        manager.s3_client.create_bucket(Bucket=bucket)
+    except manager.s3_client.exceptions.BucketAlreadyOwnedByYou:
+        pass
+    return manager
+
+def check_roundtrip(manager, size_mb: int = 12, part_mb: int = 5):
+    """Assert that both upload paths store the exact bytes in a multipart upload"""
+    tuned = manager.transfer_config
+    manager.transfer_config = TransferConfig(
+        multipart_threshold=part_mb * 1024 * 1024,
+        multipart_chunksize=part_mb * 1024 * 1024,
+        max_concurrency=4
+    )
+    data = os.urandom(size_mb * 1024 * 1024)
+    parts = -(-len(data) // (part_mb * 1024 * 1024))
+    path = os.path.join(WORK_DIR, "check.mp4")
+    with open(path, "wb") as f:
+        f.write(data)
+
+    try:
+        uploads = {
+            "check/file.mp4": lambda: manager.upload_file(path, "check/file.mp4"),
+            "check/stream.mp4": lambda: manager.upload_fileobj(io.BytesIO(data), "check/stream.mp4"),
+        }
+        for key, upload in uploads.items():
+            ok, url = upload()
+            assert ok and url, f"{key}: upload failed"
+            head = manager.s3_client.head_object(Bucket=manager.bucket_name, Key=key)
+            assert head["ContentLength"] == len(data), f"{key}: size {head['ContentLength']} != {len(data)}"
+            assert head["ETag"].strip('"').endswith(f"-{parts}"), f"{key}: not a {parts}-part upload ({head['ETag']})"
+            assert head["ContentType"] == "video/mp4", f"{key}: content type {head['ContentType']}"
+            body = manager.s3_client.get_object(Bucket=manager.bucket_name, Key=key)["Body"].read()
+            assert body == data, f"{key}: content differs"
+            assert key in manager.list_files("check/"), f"{key}: missing from storage index"
+            print(f"check {key:<18} ok: {parts} parts, {len(data)} bytes")
+
+        assert manager.delete_file("check/file.mp4")
+        assert "check/file.mp4" not in manager.list_files("check/"), "deleted key still indexed"
+        totals = manager.get_storage_stats()
+        assert totals["file_count"] == 1 and totals["total_size"] == len(data), f"index totals {totals}"
+        manager.delete_file("check/stream.mp4")
+        print("check storage index      ok")
+    finally:
+        os.remove(path)
+        manager.transfer_config = tuned
+
+def timed(label: str, size_mb: float, upload) -> float:
+    """Run upload once and print throughput"""
+    started = time.perf_counter()
+    ok, _ = upload()
+    seconds = time.perf_counter() - started
+    status = "" if ok else "  FAILED"
+    print(f"{label:<42} {seconds:6.2f}s  {size_mb / seconds:7.1f} MB/s{status}")
+    return seconds
+
+async def parallel_uploads(manager, path: str, count: int) -> float:
+    """Upload count copies at once through the storage I/O pool"""
+    started = time.perf_counter()
+    results = await asyncio.gather(*(
+        manager.upload_file_async(path, f"bench/parallel-{i}.mp4") for i in range(count)
+    ))
+    if not all(ok for ok, _ in results):
+        print("  some parallel uploads FAILED")
+    return time.perf_counter() - started
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size-mb", type=int, default=64)
+    parser.add_argument("--part-mb", default="8,16")
+    parser.add_argument("--concurrency", default="1,4,8")
+    parser.add_argument("--parallel-uploads", type=int, default=4)
+    parser.add_argument("--endpoint-url", help="S3 endpoint, local moto server if omitted")
+    parser.add_argument("--bucket", default=BUCKET)
+    parser.add_argument("--check-only", action="store_true", help="run the round-trip check and exit")
+    args = parser.parse_args()
+
+    server = None
+    endpoint_url = args.endpoint_url
+    if not endpoint_url:
+        server, endpoint_url = start_stand_in()
+        print(f"Local S3 stand-in at {endpoint_url}")
+
+    manager = make_storage(endpoint_url, args.bucket)
+    tuned = manager.transfer_config
+    path = os.path.join(WORK_DIR, "bench.mp4")
+
+    try:
+        check_roundtrip(manager)
+        if args.check_only:
+            return
+
+        with open(path, "wb") as f:
+            f.write(os.urandom(args.size_mb * 1024 * 1024))
+
+        manager.transfer_config = TransferConfig()
+        timed("boto3 defaults (8 MB parts, 10 threads)", args.size_mb,
+              lambda: manager.upload_file(path, "bench/default.mp4"))
+
+        for part_mb in [int(value) for value in args.part_mb.split(",")]:
+            for concurrency in [int(value) for value in args.concurrency.split(",")]:
+                manager.transfer_config = TransferConfig(
+                    multipart_threshold=tuned.multipart_threshold,
+                    multipart_chunksize=part_mb * 1024 * 1024,
+                    max_concurrency=concurrency
+                )
+                timed(f"upload_file    part {part_mb:>3} MB x {concurrency:<2} threads", args.size_mb,
+                      lambda: manager.upload_file(path, "bench/tuned.mp4"))
+
+        manager.transfer_config = tuned
+        with open(path, "rb") as fileobj:
+            timed(f"upload_fileobj part {tuned.multipart_chunksize // (1024 * 1024):>3} MB "
+                  f"x {tuned.max_concurrency:<2} threads", args.size_mb,
+                  lambda: manager.upload_fileobj(fileobj, "bench/stream.mp4"))
+
+        seconds = asyncio.run(parallel_uploads(manager, path, args.parallel_uploads))
+        total_mb = args.size_mb * args.parallel_uploads
+        print(f"{args.parallel_uploads} parallel uploads via I/O pool ({Config.STORAGE_IO_WORKERS} workers)"
+              f"   {seconds:6.2f}s  {total_mb / seconds:7.1f} MB/s")
+    finally:
+        shutil.rmtree(WORK_DIR, ignore_errors=True)
+        manager.shutdown()
+        if server:
+            server.stop()
+
+if __name__ == "__main__":
+    main()
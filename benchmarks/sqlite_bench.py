@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+"""Benchmark SQLite read/write throughput under concurrent handlers.
+
+Compares the old single shared connection (StaticPool, rollback journal,
+serialized because sqlite3 connections are not thread-safe) with the WAL
+modes from database.py, for executor threads and for async handlers on
+one event loop.
+
+Usage: python benchmarks/sqlite_bench.py [--workers 16] [--duration 5] [--write-ratio 0.2]
+"""
+
+import sys
+import time
+import random
+import asyncio
+import argparse
+import tempfile
+import threading
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from sqlalchemy import create_engine, select, insert
+from sqlalchemy.pool import StaticPool, AsyncAdaptedQueuePool
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from config import Config
+from models import Base, User, DownloadRequest
+from database import create_sqlite_engine, configure_sqlite
+
+USERS = 1000
+
+def seed(url: str):
+    """Create schema and users"""
+    engine = create_engine(url)
+    Base.metadata.create_all(engine)
+    with engine.begin() as conn:
+        conn.execute(insert(User), [{'telegram_id': i, 'username': f"user{i}"} for i in range(USERS)])
+    engine.dispose()
+
+def handler_sync(conn, write_ratio: float):
+    """One handler-like unit of work"""
+    telegram_id = random.randrange(USERS)
+    user_id = conn.execute(select(User.id).where(User.telegram_id == telegram_id)).scalar()
+    if random.random() < write_ratio:
+        conn.execute(insert(DownloadRequest).values(
+            user_id=user_id, youtube_url="https://youtu.be/x", status="completed", file_size=1024
+        ))
+        conn.commit()
+        return "write"
+    conn.execute(
+        select(DownloadRequest).where(DownloadRequest.user_id == user_id)
+        .order_by(DownloadRequest.created_at.desc()).limit(5)
+    ).all()
+    conn.rollback()
+    return "read"
+
+def run_threads(engine, workers: int, duration: float, write_ratio: float, serialize: bool = False) -> dict:
+    """Run handlers from many threads against one engine"""
+    counts = {'read': 0, 'write': 0, 'errors': 0}
+    lock = threading.Lock()
+    # A single shared sqlite3 connection is only safe when used by one thread at a time
+    connection_lock = threading.Lock() if serialize else None
+    deadline = time.monotonic() + duration
+
+    def worker():
+        local = {'read': 0, 'write': 0, 'errors': 0}
+        while time.monotonic() < deadline:
+            try:
+                if connection_lock:
+                    connection_lock.acquire()
+                try:
+                    with engine.connect() as conn:
+                        local[handler_sync(conn, write_ratio)] += 1
+                finally:
+                    if connection_lock:
+                        connection_lock.release()
+            except Exception:
+                local['errors'] += 1
+        with lock:
+            for key, value in local.items():
+                counts[key] += value
+
+    threads = [threading.Thread(target=worker) for _ in range(workers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return counts
+
+async def handler_async(conn, write_ratio: float) -> str:
+    """Async handler-like unit of work"""
+    telegram_id = random.randrange(USERS)
+    user_id = await conn.scalar(select(User.id).where(User.telegram_id == telegram_id))
+    if random.random() < write_ratio:
+        await conn.execute(insert(DownloadRequest).values(
+            user_id=user_id, youtube_url="https://youtu.be/x", status="completed", file_size=1024
+        ))
+        await conn.commit()
+        return "write"
+    await conn.execute(
+        select(DownloadRequest).where(DownloadRequest.user_id == user_id)
+        .order_by(DownloadRequest.created_at.desc()).limit(5)
+    )
+    await conn.rollback()
+    return "read"
+
+async def run_tasks(engine, workers: int, duration: float, write_ratio: float) -> dict:
+    """Run handlers as concurrent tasks on one event loop"""
+    counts = {'read': 0, 'write': 0, 'errors': 0}
+    deadline = time.monotonic() + duration
+
+    async def worker():
+        while time.monotonic() < deadline:
+            try:
+                async with engine.connect() as conn:
+                    counts[await handler_async(conn, write_ratio)] += 1
+            except Exception:
+                counts['errors'] += 1
+
+    await asyncio.gather(*(worker() for _ in range(workers)))
+    await engine.dispose()
+    return counts
+
+def report(name: str, counts: dict, duration: float):
+    """Print one result line"""
+    total = counts['read'] + counts['write']
+    print(f"{name:<28} {total / duration:>10.0f} ops/s {counts['read'] / duration:>10.0f} reads/s "
+          f"{counts['write'] / duration:>9.0f} writes/s {counts['errors']:>7} errors")
+
+def main():
+    parser = argparse.ArgumentParser(description="SQLite concurrency benchmark")
+    parser.add_argument("--workers", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=5.0)
+    parser.add_argument("--write-ratio", type=float, default=0.2)
+    args = parser.parse_args()
+
+    Config.DEBUG = False
+    print(f"workers={args.workers} duration={args.duration}s write_ratio={args.write_ratio}")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        def fresh_url(name: str) -> str:
+            url = f"sqlite:///{tmp}/{name}.db"
+            seed(url)
+            return url
+
+        # Executor threads
+        url = fresh_url("static")
+        engine = create_engine(url, connect_args={"check_same_thread": False}, poolclass=StaticPool)
+        report("threads: StaticPool", run_threads(engine, args.workers, args.duration, args.write_ratio,
+                                                  serialize=True), args.duration)
+        engine.dispose()
+
+        engine = create_sqlite_engine(fresh_url("wal"))
+        report("threads: WAL + queue pool", run_threads(engine, args.workers, args.duration, args.write_ratio), args.duration)
+        engine.dispose()
+
+        # Async handlers
+        url = fresh_url("async_default").replace("sqlite://", "sqlite+aiosqlite://", 1)
+        engine = create_async_engine(url)
+        report("async: default", asyncio.run(run_tasks(engine, args.workers, args.duration, args.write_ratio)), args.duration)
+
+        url = fresh_url("async_wal").replace("sqlite://", "sqlite+aiosqlite://", 1)
+        engine = create_async_engine(
+            url, connect_args={"timeout": Config.SQLITE_BUSY_TIMEOUT / 1000},
+            poolclass=AsyncAdaptedQueuePool, pool_size=Config.SQLITE_POOL_SIZE, max_overflow=0
+        )
+        configure_sqlite(engine.sync_engine)
+        report("async: WAL + queue pool", asyncio.run(run_tasks(engine, args.workers, args.duration, args.write_ratio)), args.duration)
+
+if __name__ == "__main__":
+    main()
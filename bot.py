@@ -1,22 +1,39 @@
 import logging
 import re
 import os
-from typing import Optional, Dict
+from typing import Optional, Dict, List, Tuple
 from aiogram import Bot, Dispatcher, types, Router
 from aiogram.filters import Command
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
-from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
-from sqlalchemy.sql import func
+from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, FSInputFile
+from aiogram.exceptions import TelegramBadRequest
+from sqlalchemy import select
 import asyncio
 import os
+import uuid
+from datetime import datetime
 
 from config import Config
-from database import db
+from database import async_db
 from models import User, DownloadRequest
 from youtube_downloader import downloader
-from storage import storage
-from utils import validate_youtube_url, format_file_size, format_duration
+from storage import storage, storage_manager
+from media_cache import media_cache
+from file_cache import file_id_cache
+from user_stats import get_user_stats
+from write_buffer import write_buffer
+from user_cache import user_cache
+from metadata import metadata_service
+from job_queue import job_queue
+from rate_limiter import RateLimitResult, rate_limiter, format_retry_after
+from worker import DownloadWorker
+from format_selector import select_format, get_format
+from streaming import StreamingInputFile, is_streamable, stream_headers
+from transcoder import transcoder
+from metrics import stage_timer
+from progress import ProgressMessage
+from utils import validate_youtube_url, extract_video_id, format_file_size, format_duration
 
 # Configure logging
 logging.basicConfig(level=getattr(logging, Config.LOG_LEVEL))
@@ -36,6 +53,9 @@ bot = Bot(token=Config.TELEGRAM_BOT_TOKEN)
 dp = Dispatcher(storage=storage)
 router = Router()
 
+# Downloads running in this process: download id -> (telegram user id, task)
+active_downloads: Dict[str, Tuple[int, asyncio.Task]] = {}
+
 # States for FSM
 class DownloadStates(StatesGroup):
     waiting_for_url = State()
@@ -69,6 +89,23 @@ def get_quality_keyboard():
     ])
     return keyboard
 
+def get_cancel_download_keyboard(download_id: str):
+    keyboard = InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="❌ Отменить загрузку", callback_data=f"cancel_dl:{download_id}")]
+    ])
+    return keyboard
+
+def get_alternatives_keyboard(format_types):
+    """Keyboard with format types that fit into the size limit"""
+    buttons = {
+        'mp3': InlineKeyboardButton(text="🎵 MP3 Audio", callback_data="format_mp3"),
+    }
+    keyboard = InlineKeyboardMarkup(inline_keyboard=[
+        [buttons[format_type] for format_type in format_types if format_type in buttons],
+        [InlineKeyboardButton(text="❌ Отмена", callback_data="cancel")]
+    ])
+    return keyboard
+
 # Command handlers
 @router.message(Command("start"))
 async def cmd_start(message: types.Message):
@@ -80,20 +117,8 @@ async def cmd_start(message: types.Message):
     
     # Save user to database
     try:
-        with db.get_session() as session:
-            db_user = session.query(User).filter(User.telegram_id == user.id).first()
-            if not db_user:
-                db_user = User(
-                    telegram_id=user.id,
-                    username=user.username,
-                    first_name=user.first_name,
-                    last_name=user.last_name
-                )
-                session.add(db_user)
-                session.commit()
-            else:
-                db_user.last_activity = func.now()
-                session.commit()
+        await user_cache.get_user_id(user)
+        write_buffer.touch_user(user.id)
     except Exception as e:
         logger.error(f"Database error: {e}")
         # Continue without database if there's an error
@@ -152,21 +177,23 @@ async def cmd_stats(message: types.Message):
         return
     
     try:
-        with db.get_session() as session:
-            db_user = session.query(User).filter(User.telegram_id == user.id).first()
-            if not db_user:
-                await message.answer("❌ Пользователь не найден")
-                return
+        user_id = await user_cache.get_user_id(user, create=False)
+        if not user_id:
+            await message.answer("❌ Пользователь не найден")
+            return
+        
+        async with async_db.get_session() as session:
+            db_user = await session.get(User, user_id)
             
             # Get user statistics
-            total_downloads = session.query(DownloadRequest).filter(
-                DownloadRequest.user_id == db_user.id,
-                DownloadRequest.status == "completed"
-            ).count()
+            user_stats = await get_user_stats(session, user_id)
+            total_downloads = user_stats.total_downloads if user_stats else 0
             
-            recent_downloads = session.query(DownloadRequest).filter(
-                DownloadRequest.user_id == db_user.id
-            ).order_by(DownloadRequest.created_at.desc()).limit(5).all()
+            recent_downloads = (await session.scalars(
+                select(DownloadRequest).where(
+                    DownloadRequest.user_id == user_id
+                ).order_by(DownloadRequest.created_at.desc()).limit(5)
+            )).all()
         
         stats_text = f"""
 📊 Статистика пользователя {user.first_name}:
@@ -201,17 +228,19 @@ async def cmd_status(message: types.Message):
         return
     
     try:
-        with db.get_session() as session:
-            db_user = session.query(User).filter(User.telegram_id == user.id).first()
-            if not db_user:
-                await message.answer("❌ Пользователь не найден")
-                return
-            
+        user_id = await user_cache.get_user_id(user, create=False)
+        if not user_id:
+            await message.answer("❌ Пользователь не найден")
+            return
+        
+        async with async_db.get_session() as session:
             # Get active downloads
-            active_downloads = session.query(DownloadRequest).filter(
-                DownloadRequest.user_id == db_user.id,
-                DownloadRequest.status.in_(["pending", "processing"])
-            ).all()
+            active_downloads = (await session.scalars(
+                select(DownloadRequest).where(
+                    DownloadRequest.user_id == user_id,
+                    DownloadRequest.status.in_(["pending", "processing"])
+                )
+            )).all()
         
         if not active_downloads:
             await message.answer("✅ Нет активных загрузок")
@@ -265,8 +294,11 @@ async def handle_youtube_url(message: types.Message, url: str, state: FSMContext
         return
     
     # Check rate limiting
-    if not await check_rate_limit(user.id):
-        await message.answer("⚠️ Слишком много запросов. Попробуй через минуту.")
+    limit = await check_rate_limit(user.id)
+    if not limit.allowed:
+        await message.answer(
+            f"⚠️ Слишком много запросов. Попробуй через {format_retry_after(limit.retry_after)} сек."
+        )
         return
     
     # Get video info
@@ -275,7 +307,7 @@ async def handle_youtube_url(message: types.Message, url: str, state: FSMContext
     
     # Get video information
     try:
-        video_info = downloader.get_video_info(url)
+        video_info = await metadata_service.get_video_info(url)
         if not video_info:
             # Временная заглушка для тестирования
             video_info = {
@@ -298,8 +330,12 @@ async def handle_youtube_url(message: types.Message, url: str, state: FSMContext
     
     logger.info(f"Video info received: {video_info['title']}")
     
-    # Save URL to state
-    await state.update_data(url=url, video_info=video_info)
+    # Save URL to state, keeping only fields the next steps need
+    await state.update_data(url=url, video_info={
+        'title': video_info['title'],
+        'duration': video_info['duration'],
+        'uploader': video_info['uploader']
+    })
     
     # Show format selection
     await message.answer(
@@ -331,6 +367,251 @@ async def handle_format_selection(callback: types.CallbackQuery, state: FSMConte
     await state.set_state(DownloadStates.waiting_for_quality)
     await callback.answer()
 
+def get_sent_file_id(sent: types.Message) -> Optional[str]:
+    """Get file_id of the media attached to a sent message"""
+    media = sent.video or sent.audio or sent.document
+    return media.file_id if media else None
+
+async def send_media(chat_id: int, media, format_type: str, quality: str,
+                     video_info: Dict, file_size: Optional[int] = None,
+                     part: Optional[Tuple[int, int]] = None,
+                     request_timeout: Optional[int] = None) -> types.Message:
+    """Send downloaded media (file or cached file_id) to chat, part is (number, total)"""
+    if format_type == "mp3":
+        title = video_info.get('title', 'Unknown')
+        return await bot.send_audio(
+            chat_id=chat_id,
+            audio=media,
+            title=f"{title} ({part[0]}/{part[1]})" if part else title,
+            performer=video_info.get('uploader', 'Unknown'),
+            duration=int(video_info.get('duration', 0) or 0),
+            request_timeout=request_timeout
+        )
+    
+    caption = (
+        f"📹 {video_info.get('title', 'Unknown')}\n"
+        f"🎯 Формат: {format_type.upper()}\n"
+        f"⭐ Качество: {quality}"
+    )
+    if file_size:
+        caption += f"\n📏 Размер: {format_file_size(file_size)}"
+    if part:
+        caption += f"\n🧩 Часть {part[0]} из {part[1]}"
+    return await bot.send_video(chat_id=chat_id, video=media, caption=caption, request_timeout=request_timeout)
+
+def save_download_request(user: Optional[types.User], url: str, video_info: Dict, format_type: str,
+                          quality: str, file_path: Optional[str], file_size: Optional[int]):
+    """Queue completed download for the next batched database write"""
+    if not user:
+        return
+    write_buffer.add_download(
+        user.id,
+        youtube_url=url,
+        video_title=video_info.get('title', 'Unknown'),
+        video_duration=video_info.get('duration', 0),
+        format_type=format_type,
+        quality=quality,
+        status="completed",
+        file_path=file_path,
+        file_size=file_size,
+        completed_at=datetime.now()
+    )
+
+async def send_cached_media(chat_id: int, video_id: Optional[str], format_type: str,
+                            quality: str, video_info: Dict) -> bool:
+    """Send media by cached Telegram file_id, return False on miss or stale id"""
+    file_id = await file_id_cache.get(video_id, format_type, quality)
+    if not file_id:
+        return False
+    
+    try:
+        await send_media(chat_id, file_id, format_type, quality, video_info)
+        logger.info(f"Sent cached file_id for {video_id} ({format_type}/{quality})")
+        return True
+    except TelegramBadRequest as e:
+        logger.warning(f"Cached file_id rejected by Telegram: {e}")
+        await file_id_cache.invalidate(video_id, format_type, quality)
+        return False
+
+async def deliver_download(chat_id: int, video_id: Optional[str], video_info: Dict, format_type: str,
+                           quality: str, success: bool, file_path: Optional[str],
+                           parts: Optional[List[str]] = None) -> Optional[int]:
+    """Send downloaded file to chat and return its size, or None if nothing was delivered.
+    The file itself is cleaned up by the caller."""
+    if not (success and file_path and os.path.exists(file_path)):
+        logger.error(f"Download failed: success={success}, file_path={file_path}")
+        await bot.send_message(chat_id, "❌ Ошибка загрузки видео. Попробуйте другой формат.")
+        return None
+    
+    if parts:
+        return await deliver_parts(chat_id, video_info, format_type, quality, parts)
+    
+    file_size = os.path.getsize(file_path)
+    logger.info(f"File downloaded successfully: {file_path}, size: {file_size}")
+    
+    # Check file size limit (50MB Telegram limit)
+    if file_size > Config.MAX_FILE_SIZE:
+        await bot.send_message(
+            chat_id,
+            f"❌ Файл слишком большой: {format_file_size(file_size)}\n"
+            f"Максимальный размер: {format_file_size(Config.MAX_FILE_SIZE)}"
+        )
+        return None
+    
+    # Another request for the same video may have uploaded it already
+    if await send_cached_media(chat_id, video_id, format_type, quality, video_info):
+        await bot.send_message(chat_id, "✅ Загрузка завершена!")
+        return file_size
+    
+    # Send file to user
+    try:
+        logger.info(f"Sending file to user: {file_path}")
+        with stage_timer.time("upload"):
+            sent = await send_media(
+                chat_id, FSInputFile(file_path), format_type, quality, video_info, file_size
+            )
+        await file_id_cache.set(video_id, format_type, quality, get_sent_file_id(sent), file_size)
+        
+        await bot.send_message(chat_id, "✅ Загрузка завершена!")
+        logger.info("File sent successfully to user")
+        return file_size
+    except Exception as e:
+        logger.error(f"Error sending file: {e}")
+        await bot.send_message(chat_id, f"❌ Ошибка отправки файла: {e}")
+        return None
+
+async def deliver_stream(chat_id: int, video_id: Optional[str], video_info: Dict, format_type: str,
+                         quality: str, stream_format: Dict, progress: ProgressMessage) -> Optional[int]:
+    """Pipe selected format from its URL into the upload, return size or None to fall back to download"""
+    file_size = stream_format['filesize']
+    media = StreamingInputFile(
+        stream_format['url'],
+        file_size,
+        headers=stream_format.get('http_headers'),
+        filename=f"{video_id or 'video'}.{stream_format.get('ext', format_type)}",
+        on_progress=progress.update
+    )
+    try:
+        logger.info(f"Streaming {video_id} ({format_type}/{quality}) to chat {chat_id}")
+        with stage_timer.time("stream"):
+            sent = await send_media(
+                chat_id, media, format_type, quality, video_info, file_size,
+                request_timeout=Config.STREAMING_UPLOAD_TIMEOUT
+            )
+    except Exception as e:
+        logger.warning(f"Streaming upload failed after {media.sent} bytes, falling back to download: {e}")
+        return None
+    
+    await progress.close(remove_markup=True)
+    await file_id_cache.set(video_id, format_type, quality, get_sent_file_id(sent), file_size)
+    await bot.send_message(chat_id, "✅ Загрузка завершена!")
+    return file_size
+
+async def deliver_parts(chat_id: int, video_info: Dict, format_type: str,
+                        quality: str, parts: List[str]) -> Optional[int]:
+    """Send split file parts in order and return their total size.
+
+    With STAGING_CHAT_ID the parts are uploaded there concurrently and
+    then sent to the user by file_id in order, otherwise one by one.
+    Split results are not stored in the file_id cache.
+    """
+    total = len(parts)
+    sizes = [os.path.getsize(path) for path in parts]
+    try:
+        with stage_timer.time("upload"):
+            if Config.STAGING_CHAT_ID:
+                staged = await asyncio.gather(*(
+                    send_media(Config.STAGING_CHAT_ID, FSInputFile(path), format_type, quality,
+                               video_info, size, (number, total))
+                    for number, (path, size) in enumerate(zip(parts, sizes), start=1)
+                ))
+                for number, (message, size) in enumerate(zip(staged, sizes), start=1):
+                    await send_media(chat_id, get_sent_file_id(message), format_type, quality,
+                                     video_info, size, (number, total))
+                await asyncio.gather(
+                    *(bot.delete_message(Config.STAGING_CHAT_ID, message.message_id) for message in staged),
+                    return_exceptions=True
+                )
+            else:
+                for number, (path, size) in enumerate(zip(parts, sizes), start=1):
+                    await send_media(chat_id, FSInputFile(path), format_type, quality,
+                                     video_info, size, (number, total))
+        
+        await bot.send_message(chat_id, "✅ Загрузка завершена!")
+        logger.info(f"Sent {total} parts to user")
+        return sum(sizes)
+    except Exception as e:
+        logger.error(f"Error sending parts: {e}")
+        await bot.send_message(chat_id, f"❌ Ошибка отправки файла: {e}")
+        return None
+
+async def create_download_request(user: Optional[types.User], url: str, video_info: Dict,
+                                  format_type: str, quality: str) -> Optional[int]:
+    """Create pending DownloadRequest row for a queued job"""
+    if not user:
+        return None
+    try:
+        user_id = await user_cache.get_user_id(user)
+        async with async_db.get_session() as session:
+            download_request = DownloadRequest(
+                user_id=user_id,
+                youtube_url=url,
+                video_title=video_info.get('title', 'Unknown'),
+                video_duration=video_info.get('duration', 0),
+                format_type=format_type,
+                quality=quality,
+                status="pending"
+            )
+            session.add(download_request)
+            await session.flush()
+            return download_request.id
+    except Exception as e:
+        logger.error(f"Database error: {e}")
+        return None
+
+async def enqueue_download(callback: types.CallbackQuery, url: str, video_id: Optional[str],
+                           video_info: Dict, format_type: str, quality: str,
+                           format_id: Optional[str] = None):
+    """Hand download over to worker processes"""
+    request_id = await create_download_request(callback.from_user, url, video_info, format_type, quality)
+    job_id = await job_queue.enqueue({
+        'request_id': request_id,
+        'chat_id': callback.message.chat.id,
+        'url': url,
+        'video_id': video_id,
+        'video_info': {
+            'title': video_info.get('title', 'Unknown'),
+            'duration': video_info.get('duration', 0),
+            'uploader': video_info.get('uploader', 'Unknown')
+        },
+        'format_type': format_type,
+        'quality': quality,
+        'format_id': format_id
+    })
+    logger.info(f"Download job queued: {job_id} (request {request_id})")
+    await callback.message.answer("📋 Загрузка поставлена в очередь. Файл придёт, как только будет готов.")
+
+async def deliver_results():
+    """Deliver results published by download workers"""
+    while True:
+        try:
+            result = await job_queue.get_result()
+            if not result:
+                continue
+            try:
+                await deliver_download(
+                    result['chat_id'], result.get('video_id'), result.get('video_info', {}),
+                    result['format_type'], result['quality'], result['success'], result.get('file_path'),
+                    result.get('parts')
+                )
+            finally:
+                downloader.cleanup_download(result.get('file_path'), result)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Result delivery error: {e}")
+            await asyncio.sleep(1)
+
 @router.callback_query(lambda c: c.data.startswith('quality_'))
 async def handle_quality_selection(callback: types.CallbackQuery, state: FSMContext):
     """Handle quality selection"""
@@ -341,107 +622,180 @@ async def handle_quality_selection(callback: types.CallbackQuery, state: FSMCont
     url = data.get('url', 'Unknown URL')
     format_type = data.get('format_type', 'Unknown')
     video_info = data.get('video_info', {})
+    video_id = extract_video_id(url)
+    chat_id = callback.message.chat.id
     
-    await callback.message.answer(
+    # Answer instantly if this video was already sent to Telegram
+    if await send_cached_media(chat_id, video_id, format_type, quality, video_info):
+        save_download_request(callback.from_user, url, video_info, format_type, quality, None, None)
+        await callback.message.answer("✅ Загрузка завершена!")
+        await state.clear()
+        await callback.answer()
+        return
+    
+    # Pick a format that fits into the Telegram limit before downloading anything
+    info = await metadata_service.get_cached_info(url)
+    choice = select_format(
+        info, format_type, quality, Config.MAX_FILE_SIZE, downloader.ffmpeg_available
+    ) if info else None
+    if choice and not choice['fits']:
+        if not can_fit_oversized(info, format_type, choice):
+            await reject_oversized(callback, state, choice)
+            return
+        # Smallest format is downloaded and then re-encoded or split to fit
+        if Config.OVERSIZE_STRATEGY == "split":
+            await callback.message.answer(
+                f"✂️ Видео больше {format_file_size(Config.MAX_FILE_SIZE)}, оно придёт несколькими частями"
+            )
+        else:
+            await callback.message.answer(
+                f"🔧 Видео больше {format_file_size(Config.MAX_FILE_SIZE)}, после загрузки оно будет пережато"
+            )
+    format_id = choice['format_id'] if choice else None
+    if choice and choice['downgraded'] and choice['height']:
+        await callback.message.answer(
+            f"ℹ️ Выбранное качество больше {format_file_size(Config.MAX_FILE_SIZE)}, "
+            f"отправлю {choice['height']}p"
+        )
+    
+    if Config.DOWNLOAD_MODE == "queue":
+        await enqueue_download(callback, url, video_id, video_info, format_type, quality, format_id)
+        await state.clear()
+        await callback.answer()
+        return
+    
+    # Global cap on concurrent downloads
+    slot = await acquire_download_slot()
+    if not slot:
+        await callback.message.answer(
+            f"⚠️ Сервер загружен. Попробуй через {format_retry_after(Config.DOWNLOAD_SLOT_RETRY)} сек."
+        )
+        await state.clear()
+        await callback.answer()
+        return
+    
+    header = (
         f"🎬 Начинаю загрузку!\n\n"
         f"📹 Видео: {video_info.get('title', 'Unknown')}\n"
         f"🎯 Формат: {format_type.upper()}\n"
-        f"⭐ Качество: {quality}\n\n"
-        f"⏳ Загрузка началась..."
+        f"⭐ Качество: {quality}"
     )
+    download_id = uuid.uuid4().hex[:12]
+    cancel_keyboard = get_cancel_download_keyboard(download_id)
+    status = await callback.message.answer(f"{header}\n\n⏳ Загрузка началась...", reply_markup=cancel_keyboard)
     
     # Real download logic
-    try:
-        logger.info(f"Starting real download: {url}, format: {format_type}, quality: {quality}")
-        
-        # Download video
-        success, file_path, download_info = await downloader.download_video_async(
-            url, format_type, quality
-        )
-        
-        logger.info(f"Download result: success={success}, file_path={file_path}")
-        
-        if success and file_path and os.path.exists(file_path):
-            file_size = os.path.getsize(file_path)
-            logger.info(f"File downloaded successfully: {file_path}, size: {file_size}")
-            
-            # Check file size limit (50MB Telegram limit)
-            if file_size > Config.MAX_FILE_SIZE:
-                await callback.message.answer(
-                    f"❌ Файл слишком большой: {format_file_size(file_size)}\n"
-                    f"Максимальный размер: {format_file_size(Config.MAX_FILE_SIZE)}"
-                )
-                # Clean up large file
-                downloader.cleanup_file(file_path)
-                await state.clear()
-                await callback.answer()
-                return
-            
-            # Save to database
-            user = callback.from_user
-            if user:
-                try:
-                    with db.get_session() as session:
-                        db_user = session.query(User).filter(User.telegram_id == user.id).first()
-                        if db_user:
-                            download_request = DownloadRequest(
-                                user_id=db_user.id,
-                                youtube_url=url,
-                                video_title=video_info.get('title', 'Unknown'),
-                                video_duration=video_info.get('duration', 0),
-                                format_type=format_type,
-                                quality=quality,
-                                status="completed",
-                                file_path=file_path,
-                                file_size=file_size
-                            )
-                            session.add(download_request)
-                            session.commit()
-                            logger.info(f"Download saved to database: {download_request.id}")
-                except Exception as e:
-                    logger.error(f"Database error: {e}")
-            
-            # Send file to user
-            try:
-                logger.info(f"Sending file to user: {file_path}")
-                with open(file_path, 'rb') as file:
-                    if format_type == "mp3":
-                        await callback.message.answer_audio(
-                            audio=file,
-                            title=video_info.get('title', 'Unknown'),
-                            performer=video_info.get('uploader', 'Unknown'),
-                            duration=int(video_info.get('duration', 0))
-                        )
-                    else:
-                        await callback.message.answer_video(
-                            video=file,
-                            caption=f"📹 {video_info.get('title', 'Unknown')}\n"
-                                   f"🎯 Формат: {format_type.upper()}\n"
-                                   f"⭐ Качество: {quality}\n"
-                                   f"📏 Размер: {format_file_size(file_size)}"
-                        )
-                
-                await callback.message.answer("✅ Загрузка завершена!")
-                logger.info("File sent successfully to user")
-                
-                # Clean up file after sending
-                downloader.cleanup_file(file_path)
-                
-            except Exception as e:
-                logger.error(f"Error sending file: {e}")
-                await callback.message.answer(f"❌ Ошибка отправки файла: {e}")
-                downloader.cleanup_file(file_path)
+    progress = ProgressMessage(status, header, reply_markup=cancel_keyboard)
+    # Single-file formats of known size can skip the temp file, unless a copy is already cached
+    stream_format = None
+    if (Config.STREAMING_UPLOAD and choice and choice['fits'] and format_type != "mp3"
+            and (video_id, format_type, quality) not in media_cache):
+        stream_format = get_format(info, format_id)
+        if is_streamable(stream_format):
+            stream_format = {**stream_format, 'http_headers': stream_headers(stream_format, info)}
         else:
-            logger.error(f"Download failed: success={success}, file_path={file_path}")
-            await callback.message.answer("❌ Ошибка загрузки видео. Попробуйте другой формат.")
-            
+            stream_format = None
+    
+    download = asyncio.create_task(run_inline_download(
+        callback.from_user, chat_id, url, video_id, video_info, format_type, quality, info, format_id,
+        progress, stream_format
+    ))
+    active_downloads[download_id] = (callback.from_user.id, download)
+    try:
+        await download
+    except asyncio.CancelledError:
+        # Cancelled by the user when the cancel handler has taken it out of active_downloads
+        if download_id in active_downloads:
+            raise
+        logger.info(f"Download {download_id} cancelled by user")
+        await progress.close()
+        await status.edit_text(f"{header}\n\n❌ Загрузка отменена")
     except Exception as e:
         logger.error(f"Download error: {e}")
         await callback.message.answer(f"❌ Ошибка загрузки: {e}")
+    finally:
+        active_downloads.pop(download_id, None)
+        await progress.close()
+        await release_download_slot(slot)
     
     await state.clear()
     await callback.answer()
 
+async def run_inline_download(user: Optional[types.User], chat_id: int, url: str, video_id: Optional[str],
+                              video_info: Dict, format_type: str, quality: str, info: Optional[Dict],
+                              format_id: Optional[str], progress: ProgressMessage,
+                              stream_format: Optional[Dict] = None):
+    """Download in the bot process and deliver the result"""
+    if stream_format:
+        file_size = await deliver_stream(chat_id, video_id, video_info, format_type, quality, stream_format, progress)
+        if file_size is not None:
+            save_download_request(user, url, video_info, format_type, quality, None, file_size)
+            return
+    
+    logger.info(f"Starting real download: {url}, format: {format_type}, quality: {quality}")
+    
+    # Download video (shared with concurrent requests for the same video)
+    # Reuse the extraction made when the link was received
+    async with downloader.download_shared(
+        url, format_type, quality, info, format_id, on_progress=progress.update
+    ) as (success, file_path, download_info):
+        # Sending is not cancellable, drop the cancel button
+        await progress.close(remove_markup=True)
+        logger.info(f"Download result: success={success}, file_path={file_path}")
+        file_size = await deliver_download(
+            chat_id, video_id, video_info, format_type, quality, success, file_path,
+            (download_info or {}).get('parts')
+        )
+        if file_size is not None:
+            save_download_request(user, url, video_info, format_type, quality, file_path, file_size)
+
+@router.callback_query(lambda c: c.data.startswith('cancel_dl:'))
+async def handle_cancel_download(callback: types.CallbackQuery):
+    """Cancel a running download"""
+    download_id = callback.data.split(':', 1)[1]
+    entry = active_downloads.get(download_id)
+    if not entry:
+        await callback.answer("Загрузка не найдена или уже завершена")
+        return
+    
+    user_id, download = entry
+    if user_id != callback.from_user.id:
+        await callback.answer("Отменить загрузку может только тот, кто её начал")
+        return
+    
+    del active_downloads[download_id]
+    download.cancel()
+    await callback.answer("Отменяю загрузку...")
+
+def can_fit_oversized(info: Dict, format_type: str, choice: Dict) -> bool:
+    """Check if an oversized download may be re-encoded or split to fit"""
+    if not downloader.ffmpeg_available or not info.get('duration'):
+        return False
+    if Config.OVERSIZE_STRATEGY == "split":
+        parts = transcoder.split_parts_needed(choice['estimated_size'], Config.MAX_FILE_SIZE)
+        return parts <= Config.SPLIT_MAX_PARTS
+    if Config.OVERSIZE_STRATEGY == "transcode":
+        return transcoder.can_fit(info['duration'], Config.MAX_FILE_SIZE, audio_only=format_type == "mp3")
+    return False
+
+async def reject_oversized(callback: types.CallbackQuery, state: FSMContext, choice: Dict):
+    """Tell user the file will not fit and offer formats that do"""
+    text = (
+        f"❌ Файл будет слишком большим (~{format_file_size(choice['estimated_size'])})\n"
+        f"Максимальный размер: {format_file_size(Config.MAX_FILE_SIZE)}"
+    )
+    if choice['alternatives']:
+        # Keep url and video_info in state for the next selection
+        await callback.message.answer(
+            f"{text}\n\nМожно скачать в другом формате:",
+            reply_markup=get_alternatives_keyboard(choice['alternatives'])
+        )
+        await state.set_state(DownloadStates.waiting_for_format)
+    else:
+        await callback.message.answer(text)
+        await state.clear()
+    await callback.answer()
+
 @router.callback_query(lambda c: c.data == 'cancel')
 async def handle_cancel(callback: types.CallbackQuery, state: FSMContext):
     """Handle cancel"""
@@ -449,19 +803,74 @@ async def handle_cancel(callback: types.CallbackQuery, state: FSMContext):
     await state.clear()
     await callback.answer()
 
-async def check_rate_limit(user_id: int) -> bool:
+async def check_rate_limit(user_id: int) -> RateLimitResult:
     """Check if user has exceeded rate limit"""
-    # Simple rate limiting - can be enhanced with Redis
-    return True  # For now, allow all requests
+    try:
+        return await rate_limiter.check(user_id)
+    except Exception as e:
+        # Do not lock users out when the limiter backend is unavailable
+        logger.error(f"Rate limiter error: {e}")
+        return RateLimitResult(True)
+
+async def acquire_download_slot() -> Optional[str]:
+    """Take a global download slot"""
+    try:
+        return await rate_limiter.acquire_download_slot()
+    except Exception as e:
+        # Same policy as check_rate_limit: the limiter must not take the bot down
+        logger.error(f"Rate limiter error: {e}")
+        return "unlimited"
+
+async def release_download_slot(token: str):
+    """Give a global download slot back"""
+    try:
+        await rate_limiter.release_download_slot(token)
+    except Exception as e:
+        logger.error(f"Rate limiter error: {e}")
+
+def setup_dispatcher():
+    """Include router in dispatcher"""
+    if router.parent_router is None:
+        dp.include_router(router)
+
+def start_background_tasks() -> list:
+    """Start tasks running next to update processing"""
+    background_tasks = [write_buffer.start()]
+    # Only the process running the handlers owns the media cache
+    media_cache.open()
+    if Config.DOWNLOAD_MODE == "queue":
+        background_tasks.append(asyncio.create_task(deliver_results()))
+        if Config.JOB_QUEUE_BACKEND == "memory":
+            # No separate worker processes with the in-process queue
+            background_tasks.append(asyncio.create_task(DownloadWorker(job_queue).run()))
+    if Config.STORAGE_RECONCILE_INTERVAL > 0:
+        background_tasks.append(asyncio.create_task(storage_manager.run_reconciliation()))
+    return background_tasks
+
+async def stop_background_tasks(background_tasks: list):
+    """Stop background tasks, download workers and the storage I/O pool (polling and webhook alike)"""
+    for task in background_tasks:
+        task.cancel()
+    await asyncio.gather(*background_tasks, return_exceptions=True)
+    downloader.shutdown()
+    # Let uploads in flight finish and index themselves without blocking the loop
+    await asyncio.get_running_loop().run_in_executor(None, storage_manager.shutdown)
+    media_cache.close()
+    await write_buffer.stop()
+    await async_db.close()
 
 async def main():
     """Main function"""
     logger.info("Starting bot...")
     
-    # Include router in dispatcher
-    dp.include_router(router)
+    setup_dispatcher()
+    background_tasks = start_background_tasks()
     
-    await dp.start_polling(bot)
+    try:
+        await bot.delete_webhook()
+        await dp.start_polling(bot)
+    finally:
+        await stop_background_tasks(background_tasks)
 
 if __name__ == "__main__":
-    asyncio.run(main()) 
\ No newline at end of file
+    asyncio.run(main())
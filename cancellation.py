@@ -0,0 +1,33 @@
+import os
+import glob
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+class CancelToken:
+    """Thread-safe cancellation flag checked by download threads and worker relays"""
+
+    def __init__(self):
+        self._event = threading.Event()
+
+    def cancel(self):
+        """Request cancellation"""
+        self._event.set()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+def remove_partial_files(directory: str, stem: str) -> int:
+    """Remove leftovers of an interrupted download (.part, .ytdl, fragments) named after stem"""
+    removed = 0
+    for path in glob.glob(os.path.join(directory, f"{glob.escape(stem)}*")):
+        try:
+            os.remove(path)
+            removed += 1
+        except OSError as e:
+            logger.warning(f"Could not remove partial file {path}: {e}")
+    if removed:
+        logger.info(f"Removed {removed} partial files of {stem}")
+    return removed
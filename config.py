@@ -1,4 +1,5 @@
 import os
+import json
 from dotenv import load_dotenv
 
 # Загружаем .env файл только если он существует
@@ -29,32 +30,131 @@ class Config:
     
     TELEGRAM_WEBHOOK_URL = os.getenv("TELEGRAM_WEBHOOK_URL")
     
+    # Update delivery
+    BOT_MODE = os.getenv("BOT_MODE", "polling")  # polling, webhook
+    WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+    WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
+    WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+    WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8000"))
+    WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", "1"))  # more than 1 needs redis FSM and rate limits
+    
     # Database
     DATABASE_URL = env_vars['DATABASE_URL']
     
+    # SQLite
+    SQLITE_WAL = os.getenv("SQLITE_WAL", "True").lower() == "true"
+    SQLITE_BUSY_TIMEOUT = int(os.getenv("SQLITE_BUSY_TIMEOUT", "5000"))  # ms to wait for a lock
+    SQLITE_POOL_SIZE = int(os.getenv("SQLITE_POOL_SIZE", "5"))
+    
+    # User identity cache
+    USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "10000"))
+    
+    # Batched database writes
+    WRITE_BUFFER_INTERVAL = float(os.getenv("WRITE_BUFFER_INTERVAL", "1.0"))  # seconds between flushes
+    WRITE_BUFFER_SIZE = int(os.getenv("WRITE_BUFFER_SIZE", "100"))  # flush early at this many pending writes
+    
     # Redis
     REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379")
     
+    # FSM storage
+    FSM_STORAGE = os.getenv("FSM_STORAGE", "memory")  # memory, redis
+    FSM_TTL = int(os.getenv("FSM_TTL", "3600"))  # seconds until an abandoned conversation expires
+    
+    # Download jobs
+    DOWNLOAD_MODE = os.getenv("DOWNLOAD_MODE", "inline")  # inline, queue
+    JOB_QUEUE_BACKEND = os.getenv("JOB_QUEUE_BACKEND", "redis")  # redis, memory
+    WORKER_CONCURRENCY = int(os.getenv("WORKER_CONCURRENCY", "3"))
+    
     # File Storage
     STORAGE_TYPE = env_vars['STORAGE_TYPE']
     LOCAL_STORAGE_PATH = os.getenv("LOCAL_STORAGE_PATH", "./downloads")
+    # Stored objects live apart from in-flight downloads, on the same volume for zero-copy placement
+    # Objects kept directly in LOCAL_STORAGE_PATH by older versions are moved here once (migrations.move_local_objects)
+    LOCAL_OBJECTS_PATH = os.getenv("LOCAL_OBJECTS_PATH", os.path.join(LOCAL_STORAGE_PATH, "storage"))
     AWS_ACCESS_KEY_ID = os.getenv("AWS_ACCESS_KEY_ID")
     AWS_SECRET_ACCESS_KEY = os.getenv("AWS_SECRET_ACCESS_KEY")
     AWS_S3_BUCKET = os.getenv("AWS_S3_BUCKET")
     AWS_REGION = os.getenv("AWS_REGION", "us-east-1")
+    AWS_S3_ENDPOINT_URL = os.getenv("AWS_S3_ENDPOINT_URL")  # S3-compatible endpoint (MinIO, local stand-in)
+    S3_MULTIPART_THRESHOLD = int(os.getenv("S3_MULTIPART_THRESHOLD", str(8 * 1024 * 1024)))
+    S3_PART_SIZE = int(os.getenv("S3_PART_SIZE", str(8 * 1024 * 1024)))
+    S3_MAX_CONCURRENCY = int(os.getenv("S3_MAX_CONCURRENCY", "8"))  # parallel parts per upload
+    STORAGE_IO_WORKERS = int(os.getenv("STORAGE_IO_WORKERS", "4"))  # concurrent uploads
+    STORAGE_RECONCILE_INTERVAL = int(os.getenv("STORAGE_RECONCILE_INTERVAL", "3600"))  # seconds, 0 disables
+    STORAGE_RECONCILE_PAGE_SIZE = int(os.getenv("STORAGE_RECONCILE_PAGE_SIZE", "1000"))  # objects per listing page
+    
+    # Media cache of downloaded files, keyed by video id, format and quality
+    MEDIA_CACHE_PATH = os.getenv("MEDIA_CACHE_PATH", os.path.join(LOCAL_STORAGE_PATH, "cache"))
+    MEDIA_CACHE_SIZE = int(os.getenv("MEDIA_CACHE_SIZE", str(2 * 1024 * 1024 * 1024)))  # disk budget in bytes, 0 disables
+    MEDIA_CACHE_POLICY = os.getenv("MEDIA_CACHE_POLICY", "lru")  # lru, lfu
     
     # YouTube Download
     MAX_FILE_SIZE = 50 * 1024 * 1024  # 50MB Telegram limit
     SUPPORTED_FORMATS = ["mp4", "mp3", "webm"]
     DEFAULT_QUALITY = "best"
     
+    # Download engine
+    DOWNLOAD_ENGINE = os.getenv("DOWNLOAD_ENGINE", "thread")  # thread, process
+    DOWNLOAD_WORKERS = int(os.getenv("DOWNLOAD_WORKERS", "3"))
+    WORKER_MAX_JOBS = int(os.getenv("WORKER_MAX_JOBS", "50"))  # recycle process worker after N jobs
+    WORKER_MAX_RSS_MB = int(os.getenv("WORKER_MAX_RSS_MB", "512"))  # or above this RSS, 0 disables
+    
+    # Download tuning, applied to every download
+    DOWNLOAD_CONCURRENT_FRAGMENTS = int(os.getenv("DOWNLOAD_CONCURRENT_FRAGMENTS", "4"))  # DASH/HLS fragments in parallel
+    DOWNLOAD_HTTP_CHUNK_SIZE = int(os.getenv("DOWNLOAD_HTTP_CHUNK_SIZE", str(10 * 1024 * 1024)))  # range request size, 0 disables
+    DOWNLOAD_BUFFER_SIZE = int(os.getenv("DOWNLOAD_BUFFER_SIZE", str(64 * 1024)))
+    DOWNLOAD_RETRIES = int(os.getenv("DOWNLOAD_RETRIES", "10"))
+    DOWNLOAD_FRAGMENT_RETRIES = int(os.getenv("DOWNLOAD_FRAGMENT_RETRIES", "10"))
+    DOWNLOAD_RETRY_SLEEP_MAX = float(os.getenv("DOWNLOAD_RETRY_SLEEP_MAX", "30"))  # cap of exponential backoff, sec
+    # Per-quality overrides of the settings above ("audio" is used for mp3), JSON in DOWNLOAD_TUNING
+    DOWNLOAD_TUNING = {
+        'best': {'concurrent_fragments': 8},
+        'hd': {'concurrent_fragments': 4},
+        'medium': {'concurrent_fragments': 2},
+        'audio': {'concurrent_fragments': 1},
+        **json.loads(os.getenv("DOWNLOAD_TUNING", "{}"))
+    }
+    
+    # Streaming single-file formats from the source straight into the Telegram upload
+    STREAMING_UPLOAD = os.getenv("STREAMING_UPLOAD", "False").lower() == "true"
+    STREAMING_CHUNK_SIZE = int(os.getenv("STREAMING_CHUNK_SIZE", str(256 * 1024)))  # bytes buffered at a time
+    STREAMING_TIMEOUT = int(os.getenv("STREAMING_TIMEOUT", "120"))  # seconds per ranged source request
+    STREAMING_UPLOAD_TIMEOUT = int(os.getenv("STREAMING_UPLOAD_TIMEOUT", "900"))  # seconds for the whole upload
+    
+    # Download progress
+    PROGRESS_EDIT_INTERVAL = float(os.getenv("PROGRESS_EDIT_INTERVAL", "3"))  # seconds between edits per chat
+    PROGRESS_LOG_INTERVAL = float(os.getenv("PROGRESS_LOG_INTERVAL", "5"))  # seconds between progress log lines
+    
+    # Files above MAX_FILE_SIZE
+    OVERSIZE_STRATEGY = os.getenv("OVERSIZE_STRATEGY", "refuse")  # refuse, transcode, split
+    SPLIT_MAX_PARTS = int(os.getenv("SPLIT_MAX_PARTS", "10"))
+    STAGING_CHAT_ID = os.getenv("STAGING_CHAT_ID")  # chat for concurrent part uploads, sequential if unset
+    TRANSCODE_WORKERS = int(os.getenv("TRANSCODE_WORKERS", "1"))  # concurrent ffmpeg processes
+    TRANSCODE_THREADS = int(os.getenv("TRANSCODE_THREADS", "2"))  # threads per ffmpeg process
+    TRANSCODE_NICE = int(os.getenv("TRANSCODE_NICE", "10"))  # niceness increment of ffmpeg
+    TRANSCODE_TIMEOUT = int(os.getenv("TRANSCODE_TIMEOUT", "1800"))  # seconds
+    TRANSCODE_AUDIO_KBPS = int(os.getenv("TRANSCODE_AUDIO_KBPS", "64"))
+    TRANSCODE_MIN_AUDIO_KBPS = int(os.getenv("TRANSCODE_MIN_AUDIO_KBPS", "32"))
+    TRANSCODE_MIN_VIDEO_KBPS = int(os.getenv("TRANSCODE_MIN_VIDEO_KBPS", "50"))  # below this only refuse
+    
+    # Video metadata cache
+    METADATA_CACHE_SIZE = int(os.getenv("METADATA_CACHE_SIZE", "1024"))
+    METADATA_CACHE_TTL = int(os.getenv("METADATA_CACHE_TTL", "3600"))  # seconds, below YouTube URL expiry
+    METADATA_SHARED_CACHE = os.getenv("METADATA_SHARED_CACHE", "False").lower() == "true"  # Redis layer
+    METADATA_WORKERS = int(os.getenv("METADATA_WORKERS", "4"))
+    
     # App Settings
     DEBUG = env_vars['DEBUG'].lower() == "true"
     LOG_LEVEL = env_vars['LOG_LEVEL']
     
     # Security
     ALLOWED_USERS = os.getenv("ALLOWED_USERS", "").split(",") if os.getenv("ALLOWED_USERS") else []
-    RATE_LIMIT = int(os.getenv("RATE_LIMIT", "10"))
+    RATE_LIMIT = int(os.getenv("RATE_LIMIT", "10"))  # requests per user per window
+    RATE_LIMIT_WINDOW = int(os.getenv("RATE_LIMIT_WINDOW", "60"))  # seconds
+    RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "memory")  # memory, redis
+    MAX_CONCURRENT_DOWNLOADS = int(os.getenv("MAX_CONCURRENT_DOWNLOADS", "10"))  # global cap
+    DOWNLOAD_SLOT_TTL = int(os.getenv("DOWNLOAD_SLOT_TTL", "1800"))  # seconds before a leaked slot expires
+    DOWNLOAD_SLOT_RETRY = int(os.getenv("DOWNLOAD_SLOT_RETRY", "30"))  # retry-after shown when all slots are busy
     
     @classmethod
     def validate(cls):
@@ -64,6 +164,15 @@ class Config:
             print("ERROR: Please set TELEGRAM_BOT_TOKEN environment variable")
             raise ValueError("TELEGRAM_BOT_TOKEN is required")
         
+        if cls.BOT_MODE == "webhook" and not cls.TELEGRAM_WEBHOOK_URL:
+            raise ValueError("TELEGRAM_WEBHOOK_URL is required for webhook mode")
+        
+        # Dialog state and rate limits must be shared, or a callback landing on another worker loses them
+        if cls.BOT_MODE == "webhook" and cls.WEBHOOK_WORKERS > 1 and not (
+            cls.FSM_STORAGE == "redis" and cls.RATE_LIMIT_BACKEND == "redis"
+        ):
+            raise ValueError("WEBHOOK_WORKERS > 1 requires FSM_STORAGE=redis and RATE_LIMIT_BACKEND=redis")
+        
         if cls.STORAGE_TYPE == "s3" and not all([
             cls.AWS_ACCESS_KEY_ID, 
             cls.AWS_SECRET_ACCESS_KEY, 
@@ -1,15 +1,62 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Engine
 from sqlalchemy.orm import sessionmaker, Session
-from sqlalchemy.pool import StaticPool
-from contextlib import contextmanager
-from typing import Generator, Optional
+from sqlalchemy.pool import StaticPool, QueuePool, AsyncAdaptedQueuePool
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
+from contextlib import contextmanager, asynccontextmanager
+from typing import AsyncGenerator, Generator, Optional
 import logging
 
 from config import Config
 from models import Base
+from migrations import run_migrations
 
 logger = logging.getLogger(__name__)
 
+def is_sqlite_memory(url: str) -> bool:
+    """Check if URL points to an in-memory SQLite database"""
+    return ":memory:" in url or url.rstrip("/") in ("sqlite:", "sqlite+aiosqlite:")
+
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    """Per-connection SQLite settings for concurrent readers and writers"""
+    cursor = dbapi_connection.cursor()
+    if Config.SQLITE_WAL:
+        # Readers no longer block the writer and vice versa; persists in the file
+        cursor.execute("PRAGMA journal_mode=WAL")
+        # Durable at checkpoints only, fsync per commit is skipped in WAL mode
+        cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute(f"PRAGMA busy_timeout={Config.SQLITE_BUSY_TIMEOUT}")
+    cursor.close()
+
+def configure_sqlite(engine: Engine):
+    """Apply SQLite pragmas to every new pooled connection"""
+    event.listen(engine, "connect", set_sqlite_pragmas)
+
+def create_sqlite_engine(url: str) -> Engine:
+    """Create SQLite engine with a concurrency-safe pool"""
+    if is_sqlite_memory(url):
+        # One shared connection is the only way to see the same in-memory database
+        return create_engine(
+            url,
+            connect_args={"check_same_thread": False},
+            poolclass=StaticPool,
+            echo=Config.DEBUG
+        )
+    
+    # Each session checks out its own connection and returns it afterwards,
+    # so no connection is ever used by two threads at once
+    engine = create_engine(
+        url,
+        connect_args={"check_same_thread": False, "timeout": Config.SQLITE_BUSY_TIMEOUT / 1000},
+        poolclass=QueuePool,
+        pool_size=Config.SQLITE_POOL_SIZE,
+        max_overflow=0,
+        pool_timeout=30,
+        echo=Config.DEBUG
+    )
+    configure_sqlite(engine)
+    return engine
+
 class Database:
     def __init__(self):
         self.engine = None
@@ -23,12 +70,7 @@ class Database:
         """Setup database engine based on configuration"""
         if Config.DATABASE_URL.startswith("sqlite"):
             # SQLite configuration
-            self.engine = create_engine(
-                Config.DATABASE_URL,
-                connect_args={"check_same_thread": False},
-                poolclass=StaticPool,
-                echo=Config.DEBUG
-            )
+            self.engine = create_sqlite_engine(Config.DATABASE_URL)
         else:
             # PostgreSQL configuration
             self.engine = create_engine(
@@ -40,9 +82,10 @@ class Database:
         self.SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=self.engine)
     
     def create_tables(self):
-        """Create all tables"""
+        """Create all tables and bring existing ones up to date"""
         try:
             Base.metadata.create_all(bind=self.engine)
+            run_migrations(self.engine)
             logger.info("Database tables created successfully")
         except Exception as e:
             logger.error(f"Error creating tables: {e}")
@@ -70,9 +113,73 @@ class Database:
             raise RuntimeError("Database not initialized")
         return self.SessionLocal()
 
+def get_async_database_url(url: str) -> str:
+    """Map sync DATABASE_URL to its async driver (aiosqlite / asyncpg)"""
+    scheme, sep, rest = url.partition("://")
+    dialect = scheme.split("+")[0]
+    if dialect == "sqlite":
+        return f"sqlite+aiosqlite{sep}{rest}"
+    if dialect in ("postgresql", "postgres"):
+        return f"postgresql+asyncpg{sep}{rest}"
+    return url
+
+class AsyncDatabase:
+    """Async variant of Database for use on the event loop"""
+    
+    def __init__(self):
+        self.engine = None
+        self.SessionLocal = None
+        self._setup_engine()
+    
+    def _setup_engine(self):
+        """Setup async database engine based on configuration"""
+        url = get_async_database_url(Config.DATABASE_URL)
+        if url.startswith("sqlite"):
+            if is_sqlite_memory(url):
+                self.engine = create_async_engine(url, poolclass=StaticPool, echo=Config.DEBUG)
+            else:
+                self.engine = create_async_engine(
+                    url,
+                    connect_args={"timeout": Config.SQLITE_BUSY_TIMEOUT / 1000},
+                    poolclass=AsyncAdaptedQueuePool,
+                    pool_size=Config.SQLITE_POOL_SIZE,
+                    max_overflow=0,
+                    echo=Config.DEBUG
+                )
+                configure_sqlite(self.engine.sync_engine)
+        else:
+            self.engine = create_async_engine(url, echo=Config.DEBUG, pool_pre_ping=True)
+        
+        # Objects stay usable after commit, handlers read them after the session closes
+        self.SessionLocal = async_sessionmaker(self.engine, expire_on_commit=False, autoflush=False)
+    
+    @asynccontextmanager
+    async def get_session(self) -> AsyncGenerator[AsyncSession, None]:
+        """Get async database session with automatic cleanup"""
+        if not self.SessionLocal:
+            raise RuntimeError("Database not initialized")
+        session = self.SessionLocal()
+        try:
+            yield session
+            await session.commit()
+        except Exception as e:
+            await session.rollback()
+            logger.error(f"Database session error: {e}")
+            raise
+        finally:
+            await session.close()
+    
+    async def close(self):
+        """Dispose engine connections"""
+        if self.engine:
+            await self.engine.dispose()
+
 # Global database instance
 db = Database()
 
+# Global async database instance
+async_db = AsyncDatabase()
+
 def init_database():
     """Initialize database and create tables"""
     db.create_tables() 
\ No newline at end of file
@@ -0,0 +1,231 @@
+import os
+import time
+import logging
+import asyncio
+import resource
+import multiprocessing
+from typing import Callable, Dict, List, Optional, Tuple
+from concurrent.futures import ThreadPoolExecutor
+
+from config import Config
+from cancellation import CancelToken, remove_partial_files
+
+logger = logging.getLogger(__name__)
+
+def _current_rss_mb() -> float:
+    """Resident set size of the current process in MB"""
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, ValueError, IndexError):
+        # Peak RSS, reported in KB on Linux
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def _worker_main(conn, max_jobs: int, max_rss_mb: float):
+    """Worker process loop: run downloads until recycled"""
+    from youtube_downloader import downloader
+
+    jobs = 0
+    while True:
+        try:
+            job = conn.recv()
+        except EOFError:
+            break
+        if job is None:
+            break
+
+        # Throttled progress goes over the same pipe ahead of the result
+        result = downloader.download_video(**job, progress=lambda d: conn.send(("progress", d)))
+        jobs += 1
+        rss_mb = _current_rss_mb()
+        recycle = jobs >= max_jobs or (max_rss_mb and rss_mb > max_rss_mb)
+        conn.send(("result", result, rss_mb, recycle))
+        if recycle:
+            break
+    conn.close()
+
+class WorkerHandle:
+    """Parent-side handle of one download worker process"""
+
+    def __init__(self, ctx, index: int, max_jobs: int, max_rss_mb: float):
+        self.ctx = ctx
+        self.index = index
+        self.max_jobs = max_jobs
+        self.max_rss_mb = max_rss_mb
+        self.process = None
+        self.conn = None
+        self.jobs = 0
+        self.total_jobs = 0
+        self.recycles = 0
+        self.busy_time = 0.0
+        self.last_rss_mb = 0.0
+        self.created_at = time.monotonic()
+
+    def start(self):
+        """Start a fresh worker process"""
+        parent_conn, child_conn = self.ctx.Pipe()
+        self.process = self.ctx.Process(
+            target=_worker_main,
+            args=(child_conn, self.max_jobs, self.max_rss_mb),
+            name=f"download-worker-{self.index}",
+            daemon=True
+        )
+        self.process.start()
+        child_conn.close()
+        self.conn = parent_conn
+        self.jobs = 0
+        logger.info(f"Started download worker {self.index} (pid {self.process.pid})")
+
+    def stop(self):
+        """Stop worker process"""
+        if not self.process:
+            return
+        try:
+            if self.process.is_alive():
+                self.conn.send(None)
+            self.process.join(timeout=5)
+            if self.process.is_alive():
+                self.process.terminate()
+        except Exception as e:
+            logger.warning(f"Error stopping download worker {self.index}: {e}")
+        finally:
+            self.conn.close()
+            self.process = None
+            self.conn = None
+
+    # How often a waiting call checks its cancel token
+    CANCEL_POLL_INTERVAL = 0.5
+
+    def call(self, job: Dict, progress: Optional[Callable[[Dict], None]] = None,
+             cancel: Optional[CancelToken] = None) -> Tuple[bool, str, Optional[Dict]]:
+        """Run one download in the worker process (blocking), relaying progress messages.
+
+        A cancelled download terminates the worker process, a fresh one is
+        started for the next call.
+        """
+        if not self.process or not self.process.is_alive():
+            if self.process:
+                self.stop()
+            self.start()
+
+        started = time.monotonic()
+        try:
+            self.conn.send(job)
+            while True:
+                if cancel and cancel.cancelled:
+                    logger.info(f"Download cancelled, terminating worker {self.index}")
+                    self.kill()
+                    return False, "", None
+                if not self.conn.poll(self.CANCEL_POLL_INTERVAL):
+                    continue
+                message = self.conn.recv()
+                if message[0] != "progress":
+                    break
+                if progress:
+                    progress(message[1])
+            _, result, rss_mb, recycle = message
+        except (EOFError, OSError) as e:
+            logger.error(f"Download worker {self.index} died: {e}")
+            self.stop()
+            return False, "", None
+        finally:
+            self.busy_time += time.monotonic() - started
+
+        self.jobs += 1
+        self.total_jobs += 1
+        self.last_rss_mb = rss_mb
+        if recycle:
+            logger.info(
+                f"Recycling download worker {self.index} after {self.jobs} jobs, rss {rss_mb:.0f} MB"
+            )
+            self.recycles += 1
+            self.stop()
+        return result
+
+    def kill(self):
+        """Terminate worker process immediately"""
+        if not self.process:
+            return
+        self.process.terminate()
+        self.process.join(timeout=5)
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join()
+        self.conn.close()
+        self.process = None
+        self.conn = None
+
+    def get_stats(self) -> dict:
+        """Get worker utilization statistics"""
+        uptime = time.monotonic() - self.created_at
+        return {
+            'index': self.index,
+            'pid': self.process.pid if self.process else None,
+            'jobs': self.jobs,
+            'total_jobs': self.total_jobs,
+            'recycles': self.recycles,
+            'rss_mb': round(self.last_rss_mb, 1),
+            'utilization': self.busy_time / uptime if uptime else 0.0
+        }
+
+class ProcessDownloadEngine:
+    """Process pool for downloads with per-worker recycling by job count or RSS"""
+
+    def __init__(self, workers: int, max_jobs_per_worker: int, max_rss_mb: float):
+        self.ctx = multiprocessing.get_context("spawn")
+        self.workers: List[WorkerHandle] = [
+            WorkerHandle(self.ctx, i, max_jobs_per_worker, max_rss_mb) for i in range(workers)
+        ]
+        # Threads only wait on worker pipes, one per worker process
+        self._waiters = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="engine")
+        self._idle: Optional[asyncio.Queue] = None
+
+    def _ensure_idle_queue(self):
+        """Create idle worker queue lazily inside the running loop"""
+        if self._idle is None:
+            self._idle = asyncio.Queue()
+            for worker in self.workers:
+                self._idle.put_nowait(worker)
+
+    async def submit(self, url: str, format_type: str = "mp4", quality: str = "best",
+                     info: Optional[Dict] = None, format_id: Optional[str] = None,
+                     progress: Optional[Callable[[Dict], None]] = None, stem: Optional[str] = None,
+                     cancel: Optional[CancelToken] = None) -> Tuple[bool, str, Optional[Dict]]:
+        """Run download in the next idle worker process"""
+        self._ensure_idle_queue()
+        worker = await self._idle.get()
+        if cancel and cancel.cancelled:
+            # Cancelled while queued, do not hand the job to a healthy process only to kill it
+            self._idle.put_nowait(worker)
+            return False, "", None
+        loop = asyncio.get_running_loop()
+        job = {
+            'url': url, 'format_type': format_type, 'quality': quality,
+            'info': info, 'format_id': format_id, 'stem': stem
+        }
+        future = loop.run_in_executor(self._waiters, worker.call, job, progress, cancel)
+
+        def done(_):
+            # Return worker to the pool only when its process is really free again
+            self._idle.put_nowait(worker)
+            if cancel and cancel.cancelled and stem:
+                remove_partial_files(Config.LOCAL_STORAGE_PATH, stem)
+
+        future.add_done_callback(done)
+        return await asyncio.shield(future)
+
+    def shutdown(self):
+        """Stop all worker processes"""
+        for worker in self.workers:
+            worker.stop()
+        self._waiters.shutdown(wait=False)
+
+    def get_stats(self) -> dict:
+        """Get engine statistics"""
+        workers = [worker.get_stats() for worker in self.workers]
+        return {
+            'workers': workers,
+            'busy': len(self.workers) - (self._idle.qsize() if self._idle else len(self.workers)),
+            'utilization': sum(w['utilization'] for w in workers) / len(workers) if workers else 0.0
+        }
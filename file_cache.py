@@ -0,0 +1,99 @@
+import logging
+from typing import Optional
+
+from sqlalchemy import delete, select
+from sqlalchemy.sql import func
+
+from database import async_db
+from models import TelegramFileCache
+
+logger = logging.getLogger(__name__)
+
+class FileIdCache:
+    """Persistent cache of Telegram file_ids keyed by (video id, format, quality)"""
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    async def get(self, video_id: Optional[str], format_type: str, quality: str) -> Optional[str]:
+        """Return cached file_id or None"""
+        if not video_id:
+            return None
+        try:
+            async with async_db.get_session() as session:
+                entry = await session.scalar(select(TelegramFileCache).where(
+                    TelegramFileCache.video_id == video_id,
+                    TelegramFileCache.format_type == format_type,
+                    TelegramFileCache.quality == quality
+                ))
+                if not entry:
+                    self.misses += 1
+                    return None
+
+                entry.hits = (entry.hits or 0) + 1
+                entry.last_used = func.now()
+                self.hits += 1
+                return entry.file_id
+        except Exception as e:
+            logger.error(f"File cache lookup error: {e}")
+            self.misses += 1
+            return None
+
+    async def set(self, video_id: Optional[str], format_type: str, quality: str,
+                  file_id: str, file_size: Optional[int] = None):
+        """Store file_id returned by Telegram after the first send"""
+        if not video_id or not file_id:
+            return
+        try:
+            async with async_db.get_session() as session:
+                entry = await session.scalar(select(TelegramFileCache).where(
+                    TelegramFileCache.video_id == video_id,
+                    TelegramFileCache.format_type == format_type,
+                    TelegramFileCache.quality == quality
+                ))
+                if entry:
+                    entry.file_id = file_id
+                    entry.file_size = file_size
+                    entry.last_used = func.now()
+                else:
+                    session.add(TelegramFileCache(
+                        video_id=video_id,
+                        format_type=format_type,
+                        quality=quality,
+                        file_id=file_id,
+                        file_size=file_size
+                    ))
+            logger.info(f"Cached file_id for {video_id} ({format_type}/{quality})")
+        except Exception as e:
+            logger.error(f"File cache store error: {e}")
+
+    async def invalidate(self, video_id: Optional[str], format_type: str, quality: str):
+        """Drop a file_id that Telegram rejected"""
+        if not video_id:
+            return
+        try:
+            async with async_db.get_session() as session:
+                await session.execute(delete(TelegramFileCache).where(
+                    TelegramFileCache.video_id == video_id,
+                    TelegramFileCache.format_type == format_type,
+                    TelegramFileCache.quality == quality
+                ))
+            self.invalidations += 1
+            logger.info(f"Invalidated cached file_id for {video_id} ({format_type}/{quality})")
+        except Exception as e:
+            logger.error(f"File cache invalidation error: {e}")
+
+    def get_stats(self) -> dict:
+        """Get cache hit/miss counters"""
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'invalidations': self.invalidations,
+            'hit_ratio': self.hits / lookups if lookups else 0.0
+        }
+
+# Global file_id cache instance
+file_id_cache = FileIdCache()
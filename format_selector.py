@@ -0,0 +1,129 @@
+import logging
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Max video height per quality button, None means no limit
+QUALITY_HEIGHTS = {
+    'best': None,
+    'hd': 720,
+    'medium': 480,
+}
+
+# Bitrate of mp3 produced by FFmpegExtractAudio in YouTubeDownloader
+MP3_BITRATE_KBPS = 192
+
+# Approximate sizes and bitrate estimates can be off by a few percent
+ESTIMATE_MARGIN = 1.1
+
+def estimate_format_size(fmt: Dict, duration: Optional[float]) -> Optional[int]:
+    """Estimate format size in bytes from filesize, filesize_approx or bitrate x duration"""
+    if fmt.get('filesize'):
+        return int(fmt['filesize'])
+    if fmt.get('filesize_approx'):
+        return int(fmt['filesize_approx'] * ESTIMATE_MARGIN)
+
+    bitrate = fmt.get('tbr') or ((fmt.get('vbr') or 0) + (fmt.get('abr') or 0))
+    if bitrate and duration:
+        # Bitrates are in kbit/s
+        return int(bitrate * 1000 / 8 * duration * ESTIMATE_MARGIN)
+    return None
+
+def _is_progressive(fmt: Dict) -> bool:
+    """Format has both video and audio (what the best[...] specs download)"""
+    return fmt.get('vcodec') not in (None, 'none') and fmt.get('acodec') not in (None, 'none')
+
+def _is_audio_only(fmt: Dict) -> bool:
+    return fmt.get('vcodec') == 'none' and fmt.get('acodec') not in (None, 'none')
+
+def _video_candidates(formats: List[Dict], format_type: str, quality: str) -> List[Dict]:
+    """Progressive formats allowed for quality, best first, preferred container first"""
+    max_height = QUALITY_HEIGHTS.get(quality)
+    candidates = [
+        fmt for fmt in formats
+        if _is_progressive(fmt) and (max_height is None or (fmt.get('height') or 0) <= max_height)
+    ]
+    return sorted(
+        candidates,
+        key=lambda fmt: (fmt.get('ext') == format_type, fmt.get('height') or 0, fmt.get('tbr') or 0),
+        reverse=True
+    )
+
+def _pick(candidates: List[Dict], duration: Optional[float], max_size: int) -> Optional[Dict]:
+    """Best candidate with known size under max_size, or the smallest one if none fits.
+
+    Returns None if sizes are unknown, so the caller falls back to the
+    plain format spec and the size check after download.
+    """
+    smallest = None
+    unknown = False
+    for position, fmt in enumerate(candidates):
+        size = estimate_format_size(fmt, duration)
+        if size is None:
+            unknown = True
+            continue
+        choice = {
+            'format_id': fmt['format_id'],
+            'estimated_size': size,
+            'height': fmt.get('height'),
+            'fits': size <= max_size,
+            # A better format exists but is too large
+            'downgraded': position > 0
+        }
+        if choice['fits']:
+            return choice
+        if smallest is None or size < smallest['estimated_size']:
+            smallest = choice
+    return None if unknown else smallest
+
+def _select_audio(formats: List[Dict], duration: Optional[float], max_size: int,
+                  convert_audio: bool) -> Optional[Dict]:
+    """Best audio stream; size is that of the produced mp3 when converting"""
+    audio = [fmt for fmt in formats if _is_audio_only(fmt)]
+    if not audio:
+        return None
+    best = max(audio, key=lambda fmt: fmt.get('abr') or fmt.get('tbr') or 0)
+    if convert_audio and duration:
+        size = int(MP3_BITRATE_KBPS * 1000 / 8 * duration * ESTIMATE_MARGIN)
+    else:
+        size = estimate_format_size(best, duration)
+    if size is None:
+        return None
+    return {'format_id': best['format_id'], 'estimated_size': size, 'height': None,
+            'fits': size <= max_size, 'downgraded': False}
+
+def get_format(info: Dict, format_id: Optional[str]) -> Optional[Dict]:
+    """Format entry of info by format_id"""
+    if not format_id:
+        return None
+    return next((fmt for fmt in info.get('formats') or [] if fmt.get('format_id') == format_id), None)
+
+def select_format(info: Dict, format_type: str, quality: str, max_size: int,
+                  convert_audio: bool = True) -> Optional[Dict]:
+    """Choose the best format for the request that fits under max_size.
+
+    Returns dict with format_id, estimated_size, height, fits, downgraded
+    and, when nothing fits, the other format types that would
+    (alternatives). None means the sizes are unknown and no decision can
+    be made up front.
+    """
+    formats = info.get('formats') or []
+    duration = info.get('duration')
+
+    if format_type == "mp3":
+        choice = _select_audio(formats, duration, max_size, convert_audio)
+    else:
+        choice = _pick(_video_candidates(formats, format_type, quality), duration, max_size)
+    if choice is None:
+        return None
+
+    choice['alternatives'] = []
+    if not choice['fits'] and format_type != "mp3":
+        # Lower qualities are already covered by the pick, offer audio instead
+        audio = _select_audio(formats, duration, max_size, convert_audio)
+        if audio and audio['fits']:
+            choice['alternatives'].append("mp3")
+
+    logger.info(f"Selected format {choice['format_id']} for {format_type}/{quality}: "
+                f"~{choice['estimated_size']} bytes, fits={choice['fits']}")
+    return choice
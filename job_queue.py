@@ -0,0 +1,182 @@
+import os
+import json
+import uuid
+import socket
+import logging
+import asyncio
+from abc import ABC, abstractmethod
+from typing import Dict, List, Optional
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+class JobQueue(ABC):
+    """Download job queue interface: bot enqueues jobs, workers publish results"""
+
+    # How often a worker proves it is alive and looks for jobs of dead workers
+    HEARTBEAT_INTERVAL = 15
+
+    @abstractmethod
+    async def enqueue(self, job: Dict) -> str:
+        """Add job, return its id"""
+
+    @abstractmethod
+    async def dequeue(self, timeout: int = 5) -> Optional[Dict]:
+        """Take next job, or None after timeout seconds"""
+
+    @abstractmethod
+    async def publish_result(self, result: Dict):
+        """Hand finished job back to the bot"""
+
+    @abstractmethod
+    async def get_result(self, timeout: int = 5) -> Optional[Dict]:
+        """Take next finished job, or None after timeout seconds"""
+
+    async def ack(self, job: Dict):
+        """Forget a dequeued job once it is done with"""
+        pass
+
+    async def requeue(self, job: Dict):
+        """Put a dequeued job back in the queue"""
+        await self.enqueue(job)
+
+    async def heartbeat(self):
+        """Mark this worker alive"""
+        pass
+
+    async def recover(self) -> List[Dict]:
+        """Take over jobs dequeued by workers that died before finishing them"""
+        return []
+
+    async def close(self):
+        pass
+
+    @staticmethod
+    def _prepare(job: Dict) -> Dict:
+        """Assign job id if missing"""
+        job.setdefault('job_id', uuid.uuid4().hex)
+        return job
+
+class MemoryJobQueue(JobQueue):
+    """In-process queue for development and tests; workers run inside the bot process"""
+
+    def __init__(self):
+        self.jobs: asyncio.Queue = asyncio.Queue()
+        self.results: asyncio.Queue = asyncio.Queue()
+
+    async def enqueue(self, job: Dict) -> str:
+        job = self._prepare(job)
+        await self.jobs.put(job)
+        return job['job_id']
+
+    async def dequeue(self, timeout: int = 5) -> Optional[Dict]:
+        try:
+            return await asyncio.wait_for(self.jobs.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    async def publish_result(self, result: Dict):
+        await self.results.put(result)
+
+    async def get_result(self, timeout: int = 5) -> Optional[Dict]:
+        try:
+            return await asyncio.wait_for(self.results.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+class RedisJobQueue(JobQueue):
+    """Redis-backed queue shared by the bot and separate worker processes.
+
+    Dequeue moves a job into this worker's processing list instead of
+    removing it, and the job leaves that list only when acked. A worker
+    keeps a heartbeat key alive while running; jobs in the processing list
+    of a worker whose heartbeat expired are taken over by the next worker
+    that looks, so a crash never loses a job (it may run twice).
+    """
+
+    JOBS_KEY = "download:jobs"
+    RESULTS_KEY = "download:results"
+    PROCESSING_KEY = "download:processing:"
+    WORKER_KEY = "download:worker:"
+    # Heartbeat expiry, a worker silent for this long is taken to have died
+    WORKER_TTL = 60
+
+    def __init__(self, redis_url: str):
+        import redis.asyncio as aioredis
+        self.redis = aioredis.from_url(redis_url)
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.processing_key = self.PROCESSING_KEY + self.worker_id
+        # Raw payloads of dequeued jobs, LREM needs the exact bytes
+        self._payloads: Dict[str, bytes] = {}
+
+    async def enqueue(self, job: Dict) -> str:
+        job = self._prepare(job)
+        await self.redis.lpush(self.JOBS_KEY, json.dumps(job, default=str))
+        return job['job_id']
+
+    async def dequeue(self, timeout: int = 5) -> Optional[Dict]:
+        payload = await self.redis.blmove(self.JOBS_KEY, self.processing_key, timeout, "RIGHT", "LEFT")
+        return self._hold(payload) if payload else None
+
+    def _hold(self, payload: bytes) -> Dict:
+        """Decode job taken into the processing list and remember its payload"""
+        job = json.loads(payload)
+        self._payloads[job['job_id']] = payload
+        return job
+
+    async def publish_result(self, result: Dict):
+        await self.redis.lpush(self.RESULTS_KEY, json.dumps(result, default=str))
+
+    async def get_result(self, timeout: int = 5) -> Optional[Dict]:
+        item = await self.redis.brpop(self.RESULTS_KEY, timeout=timeout)
+        return json.loads(item[1]) if item else None
+
+    async def ack(self, job: Dict):
+        payload = self._payloads.pop(job['job_id'], None)
+        if payload is not None:
+            await self.redis.lrem(self.processing_key, 1, payload)
+
+    async def requeue(self, job: Dict):
+        payload = self._payloads.pop(job['job_id'], None)
+        async with self.redis.pipeline(transaction=True) as pipe:
+            # Right end is popped next
+            pipe.rpush(self.JOBS_KEY, json.dumps(job, default=str))
+            if payload is not None:
+                pipe.lrem(self.processing_key, 1, payload)
+            await pipe.execute()
+
+    async def heartbeat(self):
+        await self.redis.set(self.WORKER_KEY + self.worker_id, 1, ex=self.WORKER_TTL)
+
+    async def recover(self) -> List[Dict]:
+        jobs = []
+        async for key in self.redis.scan_iter(match=self.PROCESSING_KEY + "*"):
+            worker_id = key.decode()[len(self.PROCESSING_KEY):]
+            if worker_id == self.worker_id or await self.redis.exists(self.WORKER_KEY + worker_id):
+                continue
+            # Moved one by one into our own list, so a crash right here loses nothing either
+            while True:
+                payload = await self.redis.lmove(key, self.processing_key, "RIGHT", "LEFT")
+                if payload is None:
+                    break
+                job = self._hold(payload)
+                logger.warning(f"Recovered job {job['job_id']} from dead worker {worker_id}")
+                jobs.append(job)
+        return jobs
+
+    async def close(self):
+        # Jobs still in processing are recovered right away instead of after the heartbeat expires
+        await self.redis.delete(self.WORKER_KEY + self.worker_id)
+        await self.redis.close()
+
+def create_job_queue() -> JobQueue:
+    """Create job queue based on configuration"""
+    if Config.JOB_QUEUE_BACKEND == "redis":
+        return RedisJobQueue(Config.REDIS_URL)
+    elif Config.JOB_QUEUE_BACKEND == "memory":
+        return MemoryJobQueue()
+    raise ValueError(f"Unsupported job queue backend: {Config.JOB_QUEUE_BACKEND}")
+
+# Global job queue instance
+job_queue = create_job_queue()
@@ -40,6 +40,13 @@ def main():
     except Exception as e:
         logger.error(f"Database initialization error: {e}")
     
+    from config import Config
+    if Config.BOT_MODE == "webhook":
+        # Webhook mode: updates arrive through the ASGI app
+        from webhook import run_webhook
+        run_webhook()
+        return
+    
     # Import and run bot
     from bot import main as bot_main
     
@@ -0,0 +1,262 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+import logging
+from typing import Dict, Hashable, List, Optional, Tuple
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+CacheKey = Tuple[str, str, str]  # video id, format, quality
+
+META_FILE = "meta.json"
+LOCK_FILE = ".lock"
+
+class CacheEntry:
+    """Downloaded files of one (video id, format, quality)"""
+
+    def __init__(self, key: CacheKey, directory: str, files: List[str], info: Dict,
+                 size: int, hits: int = 0, last_used: Optional[float] = None):
+        self.key = key
+        self.directory = directory
+        self.files = files
+        self.info = info
+        self.size = size
+        self.hits = hits
+        self.last_used = last_used or time.time()
+        self.pins = 0
+
+class MediaCache:
+    """Content-addressed cache of downloaded media under a disk budget.
+
+    Files live in a directory named after the hash of (video id, format,
+    quality). Entries being sent are pinned and never evicted; the rest
+    are evicted least recently (lru) or least frequently (lfu) used first
+    once the cache grows over its budget.
+
+    The index and pins are kept in memory, so one process owns the
+    directory: open() takes an exclusive lock on it, and the cache stays
+    disabled in processes that never open it or lose the race (download
+    engine and queue workers, extra webhook workers).
+    """
+
+    def __init__(self, directory: str, budget: int, policy: str = "lru"):
+        if policy not in ("lru", "lfu"):
+            raise ValueError(f"Unsupported media cache policy: {policy}")
+        self.directory = directory
+        self.budget = budget
+        self.policy = policy
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.bytes_saved = 0
+        self.size = 0
+        self._entries: Dict[CacheKey, CacheEntry] = {}
+        self._lock_file = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.budget > 0 and self._lock_file is not None
+
+    def open(self) -> bool:
+        """Take ownership of the cache directory and load its entries"""
+        if self.budget <= 0 or self._lock_file is not None:
+            return self.enabled
+        os.makedirs(self.directory, exist_ok=True)
+        lock_file = open(os.path.join(self.directory, LOCK_FILE), 'w')
+        try:
+            import fcntl
+        except ImportError:
+            fcntl = None
+        if fcntl:
+            try:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                lock_file.close()
+                logger.info(f"Media cache {self.directory} is owned by another process, running without it")
+                return False
+        self._lock_file = lock_file
+        self._load()
+        return True
+
+    def close(self):
+        """Release the cache directory"""
+        if self._lock_file is not None:
+            self._lock_file.close()
+            self._lock_file = None
+
+    def _entry_dir(self, key: CacheKey) -> str:
+        digest = hashlib.sha1("/".join(key).encode()).hexdigest()[:24]
+        return os.path.join(self.directory, digest)
+
+    def _load(self):
+        """Pick up entries left from a previous run"""
+        for name in os.listdir(self.directory):
+            directory = os.path.join(self.directory, name)
+            if not os.path.isdir(directory):
+                continue
+            try:
+                with open(os.path.join(directory, META_FILE)) as f:
+                    meta = json.load(f)
+                files = [os.path.join(directory, filename) for filename in meta['files']]
+                if not all(os.path.exists(path) for path in files):
+                    raise FileNotFoundError(directory)
+                info = meta['info']
+                if meta.get('split'):
+                    info['parts'] = files
+                entry = CacheEntry(
+                    tuple(meta['key']), directory, files, info,
+                    sum(os.path.getsize(path) for path in files), meta.get('hits', 0),
+                    os.path.getmtime(os.path.join(directory, META_FILE))
+                )
+            except (OSError, ValueError, KeyError) as e:
+                logger.warning(f"Dropping unreadable cache entry {directory}: {e}")
+                shutil.rmtree(directory, ignore_errors=True)
+                continue
+            self._entries[entry.key] = entry
+            self.size += entry.size
+        logger.info(f"Media cache loaded: {len(self._entries)} entries, {self.size} bytes")
+        self._evict()
+
+    def get(self, key: Hashable) -> Optional[CacheEntry]:
+        """Return entry and count a hit, or None"""
+        entry = self._entries.get(key)
+        if entry and not all(os.path.exists(path) for path in entry.files):
+            logger.warning(f"Cached files of {key} are gone")
+            self._remove(entry)
+            entry = None
+        if not entry:
+            self.misses += 1
+            return None
+        entry.hits += 1
+        entry.last_used = time.time()
+        try:
+            # Recency survives restarts through the metadata mtime
+            os.utime(os.path.join(entry.directory, META_FILE))
+        except OSError:
+            pass
+        self.hits += 1
+        self.bytes_saved += entry.size
+        return entry
+
+    def peek(self, key: Hashable) -> Optional[CacheEntry]:
+        """Return entry without counting a lookup"""
+        return self._entries.get(key)
+
+    def put(self, key: CacheKey, file_path: str, info: Optional[Dict]) -> Optional[CacheEntry]:
+        """Move downloaded file (or its split parts) into the cache.
+
+        Returns the entry pinned for the caller, or None if it is larger than
+        the whole budget or could not be stored; the files are left where
+        they were then.
+        """
+        paths = (info or {}).get('parts') or [file_path]
+        size = sum(os.path.getsize(path) for path in paths)
+        if size > self.budget:
+            return None
+
+        old = self._entries.get(key)
+        if old:
+            if old.pins:
+                return None
+            self._remove(old)
+
+        directory = self._entry_dir(key)
+        files = []
+        try:
+            os.makedirs(directory, exist_ok=True)
+            # Same volume as the downloads, so these are renames
+            for path in paths:
+                target = os.path.join(directory, os.path.basename(path))
+                os.replace(path, target)
+                files.append(target)
+        except OSError as e:
+            logger.error(f"Could not cache {key}: {e}")
+            for target in files:
+                os.replace(target, os.path.join(os.path.dirname(file_path), os.path.basename(target)))
+            shutil.rmtree(directory, ignore_errors=True)
+            return None
+
+        info = dict(info or {})
+        if info.get('parts'):
+            info['parts'] = files
+        entry = CacheEntry(key, directory, files, info, size)
+        self._write_meta(entry)
+        self._entries[key] = entry
+        self.size += size
+        self.pin(entry)
+        self._evict()
+        logger.info(f"Cached {key}: {size} bytes, cache {self.size}/{self.budget} bytes")
+        return entry
+
+    def _write_meta(self, entry: CacheEntry):
+        """Store key and info next to the files for the next start"""
+        meta = {
+            'key': list(entry.key),
+            'files': [os.path.basename(path) for path in entry.files],
+            'info': {k: v for k, v in entry.info.items() if k != 'parts'},
+            # Parts are the files in order, paths are rebuilt on load
+            'split': bool(entry.info.get('parts')),
+            'hits': entry.hits
+        }
+        with open(os.path.join(entry.directory, META_FILE), 'w') as f:
+            json.dump(meta, f, ensure_ascii=False)
+
+    def pin(self, entry: CacheEntry):
+        """Protect entry from eviction while its files are in use"""
+        entry.pins += 1
+
+    def unpin(self, entry: CacheEntry):
+        """Release entry, evicting if the cache went over budget meanwhile"""
+        entry.pins = max(0, entry.pins - 1)
+        if entry.pins == 0:
+            self._evict()
+
+    def _evict(self):
+        """Drop unpinned entries until the cache fits its budget"""
+        if self.size <= self.budget:
+            return
+        if self.policy == "lfu":
+            order = sorted(self._entries.values(), key=lambda e: (e.hits, e.last_used))
+        else:
+            order = sorted(self._entries.values(), key=lambda e: e.last_used)
+        for entry in order:
+            if self.size <= self.budget:
+                break
+            if entry.pins:
+                continue
+            self._remove(entry)
+            self.evictions += 1
+            logger.info(f"Evicted {entry.key} from media cache ({entry.size} bytes, {entry.hits} hits)")
+
+    def _remove(self, entry: CacheEntry):
+        """Forget entry and delete its files"""
+        if self._entries.get(entry.key) is entry:
+            del self._entries[entry.key]
+            self.size -= entry.size
+        shutil.rmtree(entry.directory, ignore_errors=True)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._entries
+
+    def get_stats(self) -> dict:
+        """Get cache size and hit/miss counters"""
+        lookups = self.hits + self.misses
+        return {
+            'entries': len(self._entries),
+            'size': self.size,
+            'budget': self.budget,
+            'policy': self.policy,
+            'pinned': sum(1 for entry in self._entries.values() if entry.pins),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': self.hits / lookups if lookups else 0.0,
+            'evictions': self.evictions,
+            'bytes_saved': self.bytes_saved
+        }
+
+# Global media cache instance
+media_cache = MediaCache(Config.MEDIA_CACHE_PATH, Config.MEDIA_CACHE_SIZE, Config.MEDIA_CACHE_POLICY)
@@ -0,0 +1,128 @@
+import json
+import logging
+import asyncio
+from typing import Dict, Optional
+from concurrent.futures import ThreadPoolExecutor
+
+from config import Config
+from cache import LRUCache
+from metrics import stage_timer
+from youtube_downloader import downloader
+from utils import extract_video_id
+
+logger = logging.getLogger(__name__)
+
+class MetadataService:
+    """Resolve video metadata off the event loop with LRU/TTL and optional Redis caching.
+
+    The cache holds the full extraction so the download step can reuse it.
+    """
+
+    def __init__(self):
+        self.cache = LRUCache(maxsize=Config.METADATA_CACHE_SIZE, ttl=Config.METADATA_CACHE_TTL)
+        self.executor = ThreadPoolExecutor(max_workers=Config.METADATA_WORKERS, thread_name_prefix="metadata")
+        self.redis = None
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._setup_shared_cache()
+
+    def _setup_shared_cache(self):
+        """Setup shared Redis cache layer if enabled"""
+        if not Config.METADATA_SHARED_CACHE:
+            return
+        try:
+            import redis.asyncio as aioredis
+            self.redis = aioredis.from_url(Config.REDIS_URL)
+            logger.info("Shared metadata cache enabled")
+        except Exception as e:
+            logger.warning(f"Shared metadata cache unavailable: {e}")
+            self.redis = None
+
+    def _cache_key(self, url: str) -> str:
+        """Canonical cache key for URL"""
+        return extract_video_id(url) or url
+
+    async def _get_shared(self, key: str) -> Optional[Dict]:
+        """Get metadata from shared cache"""
+        if not self.redis:
+            return None
+        try:
+            raw = await self.redis.get(f"metadata:{key}")
+            return json.loads(raw) if raw else None
+        except Exception as e:
+            logger.warning(f"Shared metadata cache read error: {e}")
+            return None
+
+    async def _set_shared(self, key: str, info: Dict):
+        """Store metadata in shared cache"""
+        if not self.redis:
+            return
+        try:
+            await self.redis.set(
+                f"metadata:{key}",
+                json.dumps(info, default=str, separators=(',', ':')),
+                ex=Config.METADATA_CACHE_TTL
+            )
+        except Exception as e:
+            logger.warning(f"Shared metadata cache write error: {e}")
+
+    async def get_cached_info(self, url: str) -> Optional[Dict]:
+        """Get extracted info from cache only, never triggering an extraction"""
+        key = self._cache_key(url)
+        info = self.cache.get(key)
+        if info is None:
+            info = await self._get_shared(key)
+            if info is not None:
+                self.cache.set(key, info)
+        return info
+
+    async def get_info(self, url: str) -> Optional[Dict]:
+        """Get full extracted info without blocking the event loop"""
+        key = self._cache_key(url)
+
+        info = self.cache.get(key)
+        if info is not None:
+            return info
+
+        # Attach to an extraction already running for this video
+        if key in self._inflight:
+            return await asyncio.shield(self._inflight[key])
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._inflight[key] = future
+        try:
+            info = await self._get_shared(key)
+            if info is None:
+                with stage_timer.time("extract"):
+                    info = await loop.run_in_executor(self.executor, downloader.extract_info, url)
+                if info:
+                    await self._set_shared(key, info)
+            if info:
+                self.cache.set(key, info)
+            future.set_result(info)
+            return info
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        finally:
+            self._inflight.pop(key, None)
+            if not future.done():
+                future.cancel()
+            elif not future.cancelled():
+                # Avoid "exception never retrieved" warnings when nobody joined
+                future.exception()
+
+    async def get_video_info(self, url: str) -> Optional[Dict]:
+        """Get short video description without blocking the event loop"""
+        info = await self.get_info(url)
+        return downloader.summarize_info(info) if info else None
+
+    def get_stats(self) -> dict:
+        """Get metadata cache statistics"""
+        stats = self.cache.get_stats()
+        stats['shared_cache'] = self.redis is not None
+        stats['inflight'] = len(self._inflight)
+        return stats
+
+# Global metadata service instance
+metadata_service = MetadataService()
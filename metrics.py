@@ -0,0 +1,44 @@
+import time
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Dict
+
+logger = logging.getLogger(__name__)
+
+class StageTimer:
+    """Wall-clock timing per pipeline stage (extract, download, transcode, upload)"""
+
+    def __init__(self):
+        self._stages: Dict[str, Dict[str, float]] = {}
+        self._lock = threading.Lock()
+
+    def record(self, stage: str, seconds: float):
+        """Add one measurement for stage"""
+        with self._lock:
+            entry = self._stages.setdefault(stage, {'count': 0, 'total': 0.0, 'max': 0.0, 'last': 0.0})
+            entry['count'] += 1
+            entry['total'] += seconds
+            entry['max'] = max(entry['max'], seconds)
+            entry['last'] = seconds
+        logger.info(f"Stage {stage} took {seconds:.2f}s")
+
+    @contextmanager
+    def time(self, stage: str):
+        """Usage: ``with stage_timer.time("download"): ...``; works around await too"""
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.record(stage, time.monotonic() - started)
+
+    def get_stats(self) -> dict:
+        """Get count, total, average and max seconds per stage"""
+        with self._lock:
+            return {
+                stage: {**entry, 'avg': entry['total'] / entry['count'] if entry['count'] else 0.0}
+                for stage, entry in self._stages.items()
+            }
+
+# Global stage timer instance
+stage_timer = StageTimer()
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""Apply schema migrations to an existing database"""
+
+import os
+import shutil
+import logging
+
+from sqlalchemy import DateTime, Index, func, inspect, select, insert, text
+from sqlalchemy.engine import Engine
+
+from config import Config
+from models import DownloadRequest, DownloadStats, StorageTotals
+
+logger = logging.getLogger(__name__)
+
+def add_download_request_indexes(engine: Engine):
+    """Composite indexes for per-user status and history queries"""
+    for index in DownloadRequest.__table__.indexes:
+        index.create(bind=engine, checkfirst=True)
+
+def add_download_stats_user_index(engine: Engine):
+    """One stats row per user"""
+    existing = {ix['name'] for ix in inspect(engine).get_indexes(DownloadStats.__tablename__)}
+    unique_constraints = inspect(engine).get_unique_constraints(DownloadStats.__tablename__)
+    if "ix_download_stats_user_id" in existing or any(uc['column_names'] == ['user_id'] for uc in unique_constraints):
+        return
+    Index("ix_download_stats_user_id", DownloadStats.user_id, unique=True).create(bind=engine)
+
+def backfill_download_stats(engine: Engine):
+    """Build per-user totals from download history once"""
+    with engine.begin() as conn:
+        if conn.scalar(select(func.count()).select_from(DownloadStats)):
+            return
+        conn.execute(
+            insert(DownloadStats).from_select(
+                ["user_id", "total_downloads", "total_size", "last_download"],
+                select(
+                    DownloadRequest.user_id,
+                    func.count(),
+                    func.coalesce(func.sum(DownloadRequest.file_size), 0),
+                    func.max(DownloadRequest.created_at)
+                ).where(DownloadRequest.status == "completed").group_by(DownloadRequest.user_id)
+            )
+        )
+
+def add_storage_totals_lease(engine: Engine):
+    """Reconciliation lease on the storage totals row"""
+    columns = {column['name'] for column in inspect(engine).get_columns(StorageTotals.__tablename__)}
+    if "reconciling_since" in columns:
+        return
+    with engine.begin() as conn:
+        conn.execute(text(
+            f"ALTER TABLE {StorageTotals.__tablename__} "
+            f"ADD COLUMN reconciling_since {DateTime().compile(dialect=engine.dialect)}"
+        ))
+
+# Left in LOCAL_OBJECTS_PATH once stored objects have been moved there
+OBJECTS_MOVED_MARKER = ".moved-from-storage-path"
+
+def move_local_objects(engine: Engine):
+    """Move objects stored before LOCAL_OBJECTS_PATH existed out of LOCAL_STORAGE_PATH.
+
+    Local storage used to keep its objects directly in LOCAL_STORAGE_PATH,
+    next to the downloads, and treated every file there as stored. Those
+    files are moved once, under the same names, so they stay listed after
+    the next reconciliation.
+    """
+    if Config.STORAGE_TYPE != "local":
+        return
+    source = os.path.abspath(Config.LOCAL_STORAGE_PATH)
+    target = os.path.abspath(Config.LOCAL_OBJECTS_PATH)
+    marker = os.path.join(target, OBJECTS_MOVED_MARKER)
+    if source == target or os.path.exists(marker) or not os.path.isdir(source):
+        return
+
+    from storage import TEMP_SUFFIXES
+
+    os.makedirs(target, exist_ok=True)
+    moved = 0
+    with os.scandir(source) as entries:
+        for entry in entries:
+            if not entry.is_file() or entry.name.startswith('.') or entry.name.endswith(TEMP_SUFFIXES):
+                continue
+            destination = os.path.join(target, entry.name)
+            if os.path.exists(destination):
+                logger.warning(f"Not moving {entry.path}: {destination} already exists")
+                continue
+            try:
+                shutil.move(entry.path, destination)
+                moved += 1
+            except FileNotFoundError:
+                pass  # moved by another process starting at the same time
+    open(marker, 'w').close()
+    logger.info(f"Moved {moved} stored objects from {source} to {target}")
+
+MIGRATIONS = [
+    add_download_request_indexes,
+    add_download_stats_user_index,
+    backfill_download_stats,
+    add_storage_totals_lease,
+    move_local_objects,
+]
+
+def run_migrations(engine: Engine):
+    """Apply all migrations; each one is idempotent"""
+    for migration in MIGRATIONS:
+        logger.info(f"Applying migration: {migration.__name__}")
+        migration(engine)
+
+def main():
+    """Run migrations against DATABASE_URL"""
+    logging.basicConfig(level=logging.INFO)
+    from database import db
+    run_migrations(db.engine)
+    logger.info("Migrations applied successfully!")
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime, Boolean, Text, Float, BigInteger
+from sqlalchemy import Column, Integer, String, DateTime, Boolean, Text, Float, BigInteger, UniqueConstraint, Index
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.sql import func
 from datetime import datetime
@@ -22,6 +22,10 @@ class User(Base):
 
 class DownloadRequest(Base):
     __tablename__ = "download_requests"
+    __table_args__ = (
+        Index("ix_download_requests_user_status", "user_id", "status"),
+        Index("ix_download_requests_user_created", "user_id", "created_at"),
+    )
     
     id = Column(Integer, primary_key=True)
     user_id = Column(Integer, nullable=False)
@@ -45,7 +49,7 @@ class DownloadStats(Base):
     __tablename__ = "download_stats"
     
     id = Column(Integer, primary_key=True)
-    user_id = Column(Integer, nullable=False)
+    user_id = Column(Integer, nullable=False, unique=True)  # one row per user, updated on each download
     total_downloads = Column(Integer, default=0)
     total_size = Column(BigInteger, default=0)  # in bytes
     last_download = Column(DateTime)
@@ -53,4 +57,51 @@ class DownloadStats(Base):
     updated_at = Column(DateTime, default=func.now(), onupdate=func.now())
     
     def __repr__(self):
-        return f"<DownloadStats(user_id={self.user_id}, downloads={self.total_downloads})>" 
\ No newline at end of file
+        return f"<DownloadStats(user_id={self.user_id}, downloads={self.total_downloads})>"
+
+class TelegramFileCache(Base):
+    __tablename__ = "telegram_file_cache"
+    __table_args__ = (
+        UniqueConstraint("video_id", "format_type", "quality", name="uq_file_cache_key"),
+    )
+    
+    id = Column(Integer, primary_key=True)
+    video_id = Column(String(32), nullable=False)
+    format_type = Column(String(10), nullable=False)
+    quality = Column(String(20), nullable=False)
+    file_id = Column(String(200), nullable=False)  # Telegram file_id from the first send
+    file_size = Column(Integer)
+    hits = Column(Integer, default=0)
+    created_at = Column(DateTime, default=func.now())
+    last_used = Column(DateTime, default=func.now())
+    
+    def __repr__(self):
+        return f"<TelegramFileCache(video_id='{self.video_id}', format='{self.format_type}', quality='{self.quality}')>"
+
+class StoredObject(Base):
+    __tablename__ = "stored_objects"
+    __table_args__ = (
+        UniqueConstraint("backend", "key", name="uq_stored_object_key"),
+        Index("ix_stored_objects_backend_seen", "backend", "seen_at"),
+    )
+    
+    id = Column(Integer, primary_key=True)
+    backend = Column(String(10), nullable=False)  # local, s3
+    key = Column(String(500), nullable=False)
+    size = Column(BigInteger, default=0)
+    seen_at = Column(DateTime, nullable=False)  # last upload or reconciliation that found the object
+    
+    def __repr__(self):
+        return f"<StoredObject(backend='{self.backend}', key='{self.key}', size={self.size})>"
+
+class StorageTotals(Base):
+    __tablename__ = "storage_totals"
+    
+    backend = Column(String(10), primary_key=True)
+    total_size = Column(BigInteger, default=0)  # in bytes
+    file_count = Column(Integer, default=0)
+    reconciled_at = Column(DateTime)
+    reconciling_since = Column(DateTime)  # lease of the process running reconciliation
+    
+    def __repr__(self):
+        return f"<StorageTotals(backend='{self.backend}', files={self.file_count}, size={self.total_size})>"
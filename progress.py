@@ -0,0 +1,103 @@
+import time
+import asyncio
+import logging
+from typing import Dict, Optional
+
+from aiogram import types
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
+
+from config import Config
+from utils import format_file_size, format_duration
+
+logger = logging.getLogger(__name__)
+
+def format_progress(d: Dict) -> str:
+    """Progress line for status message"""
+    if d['status'] == 'finished':
+        return "📦 Загрузка завершена, обрабатываю файл..."
+
+    downloaded = d.get('downloaded_bytes') or 0
+    total = d.get('total_bytes')
+    if not total:
+        return f"⏳ Загружено {format_file_size(downloaded)}"
+
+    percent = min(100.0, downloaded / total * 100)
+    filled = int(percent // 10)
+    text = f"⏳ {'▓' * filled}{'░' * (10 - filled)} {percent:.0f}%\n{format_file_size(downloaded)} из {format_file_size(total)}"
+    if d.get('speed'):
+        text += f", {format_file_size(int(d['speed']))}/с"
+    if d.get('eta'):
+        text += f", осталось {format_duration(d['eta'])}"
+    return text
+
+class ProgressMessage:
+    """Status message edited with download progress.
+
+    Updates are coalesced: only the latest one is sent, and edits in one
+    chat are at least PROGRESS_EDIT_INTERVAL apart to stay clear of
+    Telegram flood limits.
+    """
+
+    # Last edit time per chat, shared by all downloads in the chat
+    _chat_edits: Dict[int, float] = {}
+
+    def __init__(self, message: types.Message, header: Optional[str] = None,
+                 interval: float = Config.PROGRESS_EDIT_INTERVAL,
+                 reply_markup: Optional[types.InlineKeyboardMarkup] = None):
+        self.message = message
+        self.reply_markup = reply_markup
+        self.header = header if header is not None else message.text or ""
+        self.interval = interval
+        self._latest: Optional[Dict] = None
+        self._text = self.header
+        self._pending: Optional[asyncio.Task] = None
+
+    def update(self, d: Dict):
+        """Take new progress, must be called on the event loop"""
+        self._latest = d
+        if self._pending is None:
+            self._pending = asyncio.create_task(self._flush())
+
+    async def _flush(self):
+        """Wait for the chat interval and edit message with the latest progress"""
+        try:
+            chat_id = self.message.chat.id
+            wait = self._chat_edits.get(chat_id, 0.0) + self.interval - time.monotonic()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            # Reset before the edit so updates arriving during it schedule another one
+            self._pending = None
+            text = f"{self.header}\n\n{format_progress(self._latest)}"
+            if text == self._text:
+                return
+            self._chat_edits[chat_id] = time.monotonic()
+            await self.message.edit_text(text, reply_markup=self.reply_markup)
+            self._text = text
+        except TelegramRetryAfter as e:
+            logger.warning(f"Progress edit throttled by Telegram for {e.retry_after}s")
+            self._chat_edits[self.message.chat.id] = time.monotonic() + e.retry_after
+        except TelegramBadRequest as e:
+            logger.debug(f"Progress edit skipped: {e}")
+        except Exception as e:
+            logger.error(f"Progress edit error: {e}")
+        finally:
+            if self._pending is asyncio.current_task():
+                self._pending = None
+
+    async def close(self, remove_markup: bool = False):
+        """Stop pending edits once download is over, optionally dropping the keyboard"""
+        if self._pending:
+            self._pending.cancel()
+            await asyncio.gather(self._pending, return_exceptions=True)
+            self._pending = None
+        if remove_markup and self.reply_markup:
+            self.reply_markup = None
+            try:
+                await self.message.edit_reply_markup(reply_markup=None)
+            except Exception as e:
+                logger.debug(f"Could not remove progress keyboard: {e}")
+        if len(self._chat_edits) > 10000:
+            # Forget chats edited longer ago than the interval
+            now = time.monotonic()
+            for chat_id in [c for c, at in self._chat_edits.items() if at < now - self.interval]:
+                del self._chat_edits[chat_id]
@@ -0,0 +1,149 @@
+import time
+import uuid
+import math
+import logging
+from abc import ABC, abstractmethod
+from collections import deque
+from typing import Deque, Dict, NamedTuple, Optional
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+class RateLimitResult(NamedTuple):
+    allowed: bool
+    retry_after: float = 0.0  # seconds until the next request is allowed
+
+class RateLimiter(ABC):
+    """Sliding-window per-user limit plus a global cap on concurrent downloads"""
+
+    def __init__(self, limit: int, window: float, max_downloads: int):
+        self.limit = limit
+        self.window = window
+        self.max_downloads = max_downloads
+
+    @abstractmethod
+    async def check(self, user_id: int) -> RateLimitResult:
+        """Register a request from user if it fits into the window"""
+
+    @abstractmethod
+    async def acquire_download_slot(self) -> Optional[str]:
+        """Take a global download slot, return its token or None if all are busy"""
+
+    @abstractmethod
+    async def release_download_slot(self, token: str):
+        """Give a download slot back"""
+
+class MemoryRateLimiter(RateLimiter):
+    """Process-local limiter for a single bot instance"""
+
+    # Drop idle users from memory every N checks
+    SWEEP_INTERVAL = 1000
+
+    def __init__(self, limit: int, window: float, max_downloads: int):
+        super().__init__(limit, window, max_downloads)
+        self._hits: Dict[int, Deque[float]] = {}
+        self._checks = 0
+        self._slots = set()
+
+    async def check(self, user_id: int) -> RateLimitResult:
+        now = time.monotonic()
+        hits = self._hits.setdefault(user_id, deque())
+        while hits and hits[0] <= now - self.window:
+            hits.popleft()
+
+        self._checks += 1
+        if self._checks % self.SWEEP_INTERVAL == 0:
+            self._sweep(now)
+
+        if len(hits) < self.limit:
+            hits.append(now)
+            return RateLimitResult(True)
+        return RateLimitResult(False, hits[0] + self.window - now)
+
+    def _sweep(self, now: float):
+        """Forget users without requests in the current window"""
+        for user_id in [uid for uid, hits in self._hits.items() if not hits or hits[-1] <= now - self.window]:
+            del self._hits[user_id]
+
+    async def acquire_download_slot(self) -> Optional[str]:
+        if len(self._slots) >= self.max_downloads:
+            return None
+        token = uuid.uuid4().hex
+        self._slots.add(token)
+        return token
+
+    async def release_download_slot(self, token: str):
+        self._slots.discard(token)
+
+class RedisRateLimiter(RateLimiter):
+    """Limiter shared by all bot instances through Redis"""
+
+    WINDOW_SCRIPT = """
+    local now = tonumber(ARGV[1])
+    local window = tonumber(ARGV[2])
+    local limit = tonumber(ARGV[3])
+    redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', now - window)
+    if redis.call('ZCARD', KEYS[1]) < limit then
+        redis.call('ZADD', KEYS[1], now, ARGV[4])
+        redis.call('EXPIRE', KEYS[1], math.ceil(window))
+        return {1, '0'}
+    end
+    local oldest = redis.call('ZRANGE', KEYS[1], 0, 0, 'WITHSCORES')
+    return {0, tostring(tonumber(oldest[2]) + window - now)}
+    """
+
+    # Slots of crashed instances expire after DOWNLOAD_SLOT_TTL
+    SLOT_SCRIPT = """
+    local now = tonumber(ARGV[1])
+    redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', now - tonumber(ARGV[2]))
+    if redis.call('ZCARD', KEYS[1]) < tonumber(ARGV[3]) then
+        redis.call('ZADD', KEYS[1], now, ARGV[4])
+        return 1
+    end
+    return 0
+    """
+
+    SLOTS_KEY = "ratelimit:download_slots"
+
+    def __init__(self, redis_url: str, limit: int, window: float, max_downloads: int):
+        super().__init__(limit, window, max_downloads)
+        import redis.asyncio as aioredis
+        self.redis = aioredis.from_url(redis_url)
+        self._window_script = self.redis.register_script(self.WINDOW_SCRIPT)
+        self._slot_script = self.redis.register_script(self.SLOT_SCRIPT)
+
+    async def check(self, user_id: int) -> RateLimitResult:
+        allowed, retry_after = await self._window_script(
+            keys=[f"ratelimit:user:{user_id}"],
+            args=[time.time(), self.window, self.limit, uuid.uuid4().hex]
+        )
+        return RateLimitResult(bool(allowed), float(retry_after))
+
+    async def acquire_download_slot(self) -> Optional[str]:
+        token = uuid.uuid4().hex
+        acquired = await self._slot_script(
+            keys=[self.SLOTS_KEY],
+            args=[time.time(), Config.DOWNLOAD_SLOT_TTL, self.max_downloads, token]
+        )
+        return token if acquired else None
+
+    async def release_download_slot(self, token: str):
+        await self.redis.zrem(self.SLOTS_KEY, token)
+
+def create_rate_limiter() -> RateLimiter:
+    """Create rate limiter based on configuration"""
+    if Config.RATE_LIMIT_BACKEND == "redis":
+        return RedisRateLimiter(
+            Config.REDIS_URL, Config.RATE_LIMIT, Config.RATE_LIMIT_WINDOW, Config.MAX_CONCURRENT_DOWNLOADS
+        )
+    elif Config.RATE_LIMIT_BACKEND == "memory":
+        return MemoryRateLimiter(Config.RATE_LIMIT, Config.RATE_LIMIT_WINDOW, Config.MAX_CONCURRENT_DOWNLOADS)
+    raise ValueError(f"Unsupported rate limit backend: {Config.RATE_LIMIT_BACKEND}")
+
+def format_retry_after(retry_after: float) -> int:
+    """Round retry-after up to whole seconds for users"""
+    return max(1, math.ceil(retry_after))
+
+# Global rate limiter instance
+rate_limiter = create_rate_limiter()
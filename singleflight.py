@@ -0,0 +1,86 @@
+import logging
+import asyncio
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Hashable, Optional
+
+logger = logging.getLogger(__name__)
+
+class Flight:
+    """One in-flight call shared by every caller with the same key"""
+
+    def __init__(self, key: Hashable, task: asyncio.Future):
+        self.key = key
+        self.task = task
+        self.refs = 0
+
+class SingleFlight:
+    """Collapse concurrent calls with the same key into a single execution.
+
+    Callers hold the shared result inside ``join()``; the flight stays
+    registered until the last holder leaves, so callers arriving while
+    others are still using the result get it too. ``on_release`` runs once
+    with the result after the last holder has left. With
+    ``cancel_abandoned`` the call itself is cancelled once every caller
+    waiting for it has been cancelled.
+    """
+
+    def __init__(self, on_release: Optional[Callable[[Any], None]] = None, cancel_abandoned: bool = False):
+        self.on_release = on_release
+        self.cancel_abandoned = cancel_abandoned
+        self.started = 0
+        self.joined = 0
+        self.abandoned = 0
+        self._flights: Dict[Hashable, Flight] = {}
+
+    @asynccontextmanager
+    async def join(self, key: Hashable, factory: Callable[[], Awaitable[Any]]) -> AsyncIterator[Any]:
+        """Run factory() once per key and yield its result to every caller"""
+        flight = self._flights.get(key)
+        if flight is None:
+            flight = Flight(key, asyncio.ensure_future(factory()))
+            self._flights[key] = flight
+            self.started += 1
+        else:
+            self.joined += 1
+            logger.info(f"Joined in-flight call: {key}")
+
+        flight.refs += 1
+        try:
+            yield await asyncio.shield(flight.task)
+        finally:
+            flight.refs -= 1
+            if flight.refs == 0:
+                if flight.task.done():
+                    self._finish(flight)
+                else:
+                    # Every caller left early; release once the call completes
+                    flight.task.add_done_callback(lambda _: self._finish(flight))
+                    if self.cancel_abandoned:
+                        self.abandoned += 1
+                        logger.info(f"Cancelling abandoned call: {flight.key}")
+                        # New callers start a fresh call instead of joining the cancelled one
+                        del self._flights[flight.key]
+                        flight.task.cancel()
+
+    def _finish(self, flight: Flight):
+        """Unregister flight and release its result"""
+        if flight.refs > 0 or self._flights.get(flight.key) is not flight:
+            return
+        del self._flights[flight.key]
+
+        if flight.task.cancelled() or flight.task.exception() is not None:
+            return
+        if self.on_release:
+            try:
+                self.on_release(flight.task.result())
+            except Exception as e:
+                logger.error(f"Error releasing flight {flight.key}: {e}")
+
+    def get_stats(self) -> dict:
+        """Get deduplication statistics"""
+        return {
+            'in_flight': len(self._flights),
+            'started': self.started,
+            'joined': self.joined,
+            'abandoned': self.abandoned
+        }
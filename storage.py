@@ -1,45 +1,101 @@
 import os
+import json
+import errno
+import shutil
 import logging
-from typing import Optional, Tuple
+from collections import Counter
+from functools import partial
+from typing import BinaryIO, Iterator, Optional, Tuple
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
 import boto3
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config as BotoConfig
 from botocore.exceptions import ClientError
 import aiofiles
 import asyncio
 from aiogram.fsm.storage.memory import MemoryStorage
 
 from config import Config
+from storage_index import Page, StorageIndex
 
 logger = logging.getLogger(__name__)
 
+def create_fsm_storage():
+    """Create FSM storage for aiogram based on configuration"""
+    if Config.FSM_STORAGE == "redis":
+        from aiogram.fsm.storage.redis import RedisStorage
+        
+        # Abandoned conversations expire instead of piling up
+        return RedisStorage.from_url(
+            Config.REDIS_URL,
+            state_ttl=Config.FSM_TTL,
+            data_ttl=Config.FSM_TTL,
+            json_dumps=partial(json.dumps, separators=(',', ':'), ensure_ascii=False)
+        )
+    elif Config.FSM_STORAGE == "memory":
+        return MemoryStorage()
+    raise ValueError(f"Unsupported FSM storage: {Config.FSM_STORAGE}")
+
 # FSM Storage for aiogram
-storage = MemoryStorage()
+storage = create_fsm_storage()
+
+# ioctl of Linux filesystems with copy-on-write extents (btrfs, XFS)
+FICLONE = 0x40049409
+
+# Unfinished downloads and in-progress placements, never stored objects
+TEMP_SUFFIXES = ('.part', '.ytdl', '.tmp', '.link')
 
 class StorageManager:
+    # Buffer for streaming file objects into local storage
+    COPY_BUFFER_SIZE = 1024 * 1024
+    
     def __init__(self):
         self.storage_type = Config.STORAGE_TYPE
+        # How local files were placed: same, rename, hardlink, reflink, copy
+        self.placements = Counter()
+        # Manifest of stored objects, answers listings and stats without scanning
+        self.index = StorageIndex(self.storage_type)
+        # Dedicated pool, so uploads do not compete with the loop's default executor
+        self.io_executor = ThreadPoolExecutor(max_workers=Config.STORAGE_IO_WORKERS, thread_name_prefix="storage-io")
         self._setup_storage()
     
     def _setup_storage(self):
         """Setup storage based on configuration"""
         if self.storage_type == "s3":
+            # Every upload may run S3_MAX_CONCURRENCY part requests at once
             self.s3_client = boto3.client(
                 's3',
                 aws_access_key_id=Config.AWS_ACCESS_KEY_ID,
                 aws_secret_access_key=Config.AWS_SECRET_ACCESS_KEY,
-                region_name=Config.AWS_REGION
+                region_name=Config.AWS_REGION,
+                endpoint_url=Config.AWS_S3_ENDPOINT_URL,
+                config=BotoConfig(
+                    max_pool_connections=Config.STORAGE_IO_WORKERS * Config.S3_MAX_CONCURRENCY,
+                    retries={'max_attempts': 5, 'mode': 'adaptive'}
+                )
+            )
+            self.transfer_config = TransferConfig(
+                multipart_threshold=Config.S3_MULTIPART_THRESHOLD,
+                multipart_chunksize=Config.S3_PART_SIZE,
+                max_concurrency=Config.S3_MAX_CONCURRENCY,
+                use_threads=True
             )
             self.bucket_name = Config.AWS_S3_BUCKET
         elif self.storage_type == "local":
-            Path(Config.LOCAL_STORAGE_PATH).mkdir(parents=True, exist_ok=True)
+            Path(Config.LOCAL_OBJECTS_PATH).mkdir(parents=True, exist_ok=True)
     
-    def upload_file(self, local_path: str, remote_filename: str) -> Tuple[bool, Optional[str]]:
-        """Upload file to storage and return success status and URL"""
+    def upload_file(self, local_path: str, remote_filename: str,
+                    move: bool = False) -> Tuple[bool, Optional[str]]:
+        """Upload file to storage and return success status and URL.
+        
+        With move=True the local file may be taken over instead of copied.
+        """
         try:
             if self.storage_type == "s3":
                 return self._upload_to_s3(local_path, remote_filename)
             elif self.storage_type == "local":
-                return self._upload_to_local(local_path, remote_filename)
+                return self._upload_to_local(local_path, remote_filename, move)
             else:
                 logger.error(f"Unsupported storage type: {self.storage_type}")
                 return False, None
@@ -50,51 +106,163 @@ class StorageManager:
     def _upload_to_s3(self, local_path: str, remote_filename: str) -> Tuple[bool, Optional[str]]:
         """Upload file to S3"""
         try:
-            self.s3_client.upload_file(local_path, self.bucket_name, remote_filename)
-            
-            # Generate presigned URL for download (expires in 1 hour)
-            url = self.s3_client.generate_presigned_url(
-                'get_object',
-                Params={'Bucket': self.bucket_name, 'Key': remote_filename},
-                ExpiresIn=3600
+            self.s3_client.upload_file(
+                local_path, self.bucket_name, remote_filename,
+                ExtraArgs={'ContentType': self._get_content_type(remote_filename)},
+                Config=self.transfer_config
             )
             
+            self.index.record(remote_filename, os.path.getsize(local_path))
             logger.info(f"File uploaded to S3: {remote_filename}")
-            return True, url
+            return True, self._presigned_url(remote_filename)
             
         except ClientError as e:
             logger.error(f"S3 upload error: {e}")
             return False, None
     
-    def _upload_to_local(self, local_path: str, remote_filename: str) -> Tuple[bool, Optional[str]]:
-        """Copy file to local storage"""
+    def _presigned_url(self, remote_filename: str) -> str:
+        """Generate presigned URL for download (expires in 1 hour)"""
+        return self.s3_client.generate_presigned_url(
+            'get_object',
+            Params={'Bucket': self.bucket_name, 'Key': remote_filename},
+            ExpiresIn=3600
+        )
+    
+    def upload_fileobj(self, fileobj: BinaryIO, remote_filename: str) -> Tuple[bool, Optional[str]]:
+        """Stream readable file object to storage without a local copy first"""
+        try:
+            if self.storage_type == "s3":
+                # Parts are read from fileobj and uploaded as they fill up
+                self.s3_client.upload_fileobj(
+                    fileobj, self.bucket_name, remote_filename,
+                    ExtraArgs={'ContentType': self._get_content_type(remote_filename)},
+                    Config=self.transfer_config
+                )
+                size = self.s3_client.head_object(Bucket=self.bucket_name, Key=remote_filename)['ContentLength']
+                self.index.record(remote_filename, size)
+                logger.info(f"Stream uploaded to S3: {remote_filename}")
+                return True, self._presigned_url(remote_filename)
+            elif self.storage_type == "local":
+                remote_path = os.path.join(Config.LOCAL_OBJECTS_PATH, remote_filename)
+                with open(remote_path, 'wb') as target:
+                    shutil.copyfileobj(fileobj, target, self.COPY_BUFFER_SIZE)
+                self.index.record(remote_filename, os.path.getsize(remote_path))
+                logger.info(f"Stream written to local storage: {remote_path}")
+                return True, f"file://{os.path.abspath(remote_path)}"
+            else:
+                logger.error(f"Unsupported storage type: {self.storage_type}")
+                return False, None
+        except Exception as e:
+            logger.error(f"Error uploading stream: {e}")
+            return False, None
+    
+    def _upload_to_local(self, local_path: str, remote_filename: str,
+                         move: bool = False) -> Tuple[bool, Optional[str]]:
+        """Place file into local storage, without copying data when possible"""
         try:
-            remote_path = os.path.join(Config.LOCAL_STORAGE_PATH, remote_filename)
+            remote_path = os.path.join(Config.LOCAL_OBJECTS_PATH, remote_filename)
             
-            # Copy file
-            import shutil
-            shutil.copy2(local_path, remote_path)
+            method = self._place_local(local_path, remote_path, move)
+            self.placements[method] += 1
+            self.index.record(remote_filename, os.path.getsize(remote_path))
             
             # Generate local URL (for development)
             url = f"file://{os.path.abspath(remote_path)}"
             
-            logger.info(f"File copied to local storage: {remote_path}")
+            logger.info(f"File placed in local storage by {method}: {remote_path}")
             return True, url
             
         except Exception as e:
             logger.error(f"Local upload error: {e}")
             return False, None
     
-    async def upload_file_async(self, local_path: str, remote_filename: str) -> Tuple[bool, Optional[str]]:
+    def _place_local(self, source: str, target: str, move: bool) -> str:
+        """Put source at target and return the method used.
+        
+        Downloads are written to the same volume, so rename (move) or a
+        hardlink only add a directory entry, and reflink shares extents.
+        Data is copied only when source and target are on different devices.
+        """
+        if os.path.exists(target) and os.path.samefile(source, target):
+            return "same"
+        
+        if move:
+            try:
+                os.replace(source, target)
+                return "rename"
+            except OSError as e:
+                if e.errno != errno.EXDEV:
+                    raise
+        
+        try:
+            self._replace_with_link(source, target)
+            return "hardlink"
+        except OSError as e:
+            logger.debug(f"Hardlink not possible for {target}: {e}")
+        
+        if self._reflink(source, target):
+            method = "reflink"
+        else:
+            self._chunked_copy(source, target)
+            method = "copy"
+        if move:
+            os.remove(source)
+        return method
+    
+    def _replace_with_link(self, source: str, target: str):
+        """Hardlink source to target, replacing target like a copy would"""
+        temp_path = f"{target}.{os.getpid()}.link"
+        os.link(source, temp_path)
+        try:
+            os.replace(temp_path, target)
+        except OSError:
+            os.remove(temp_path)
+            raise
+    
+    def _reflink(self, source: str, target: str) -> bool:
+        """Clone file extents (copy-on-write), False if the filesystem cannot"""
+        try:
+            import fcntl
+        except ImportError:
+            return False
+        try:
+            with open(source, 'rb') as src, open(target, 'wb') as dst:
+                fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+            shutil.copystat(source, target)
+            return True
+        except OSError as e:
+            logger.debug(f"Reflink not possible for {target}: {e}")
+            if os.path.exists(target):
+                os.remove(target)
+            return False
+    
+    def _chunked_copy(self, source: str, target: str):
+        """Copy data through a bounded buffer, used across devices"""
+        with open(source, 'rb') as src, open(target, 'wb') as dst:
+            shutil.copyfileobj(src, dst, self.COPY_BUFFER_SIZE)
+        shutil.copystat(source, target)
+    
+    async def upload_file_async(self, local_path: str, remote_filename: str,
+                                move: bool = False) -> Tuple[bool, Optional[str]]:
         """Async wrapper for file upload"""
         loop = asyncio.get_event_loop()
         return await loop.run_in_executor(
-            None, 
+            self.io_executor, 
             self.upload_file, 
             local_path, 
-            remote_filename
+            remote_filename,
+            move
         )
     
+    async def upload_fileobj_async(self, fileobj: BinaryIO, remote_filename: str) -> Tuple[bool, Optional[str]]:
+        """Async wrapper for streaming upload"""
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(self.io_executor, self.upload_fileobj, fileobj, remote_filename)
+    
+    def shutdown(self):
+        """Wait for running uploads and stop the I/O pool"""
+        self.io_executor.shutdown(wait=True)
+    
     def delete_file(self, filename: str) -> bool:
         """Delete file from storage"""
         try:
@@ -102,11 +270,12 @@ class StorageManager:
                 self.s3_client.delete_object(Bucket=self.bucket_name, Key=filename)
                 logger.info(f"File deleted from S3: {filename}")
             elif self.storage_type == "local":
-                file_path = os.path.join(Config.LOCAL_STORAGE_PATH, filename)
+                file_path = os.path.join(Config.LOCAL_OBJECTS_PATH, filename)
                 if os.path.exists(file_path):
                     os.remove(file_path)
                     logger.info(f"File deleted from local storage: {filename}")
             
+            self.index.remove(filename)
             return True
             
         except Exception as e:
@@ -124,7 +293,7 @@ class StorageManager:
                     'last_modified': response['LastModified']
                 }
             elif self.storage_type == "local":
-                file_path = os.path.join(Config.LOCAL_STORAGE_PATH, filename)
+                file_path = os.path.join(Config.LOCAL_OBJECTS_PATH, filename)
                 if os.path.exists(file_path):
                     stat = os.stat(file_path)
                     return {
@@ -152,52 +321,63 @@ class StorageManager:
         return content_types.get(ext, 'application/octet-stream')
     
     def list_files(self, prefix: str = "") -> list:
-        """List files in storage"""
+        """List files in storage, from the manifest"""
         try:
-            if self.storage_type == "s3":
-                response = self.s3_client.list_objects_v2(
-                    Bucket=self.bucket_name,
-                    Prefix=prefix
-                )
-                return [obj['Key'] for obj in response.get('Contents', [])]
-            elif self.storage_type == "local":
-                storage_path = Path(Config.LOCAL_STORAGE_PATH)
-                if prefix:
-                    files = list(storage_path.glob(f"{prefix}*"))
-                else:
-                    files = list(storage_path.iterdir())
-                return [f.name for f in files if f.is_file()]
-            
-            return []
-            
+            return self.index.list_keys(prefix)
         except Exception as e:
             logger.error(f"Error listing files: {e}")
             return []
     
     def get_storage_stats(self) -> dict:
-        """Get storage statistics"""
+        """Get storage statistics from running totals, without listing the backend"""
         try:
-            if self.storage_type == "s3":
-                response = self.s3_client.list_objects_v2(Bucket=self.bucket_name)
-                total_size = sum(obj['Size'] for obj in response.get('Contents', []))
-                file_count = len(response.get('Contents', []))
-            elif self.storage_type == "local":
-                storage_path = Path(Config.LOCAL_STORAGE_PATH)
-                files = list(storage_path.iterdir())
-                total_size = sum(f.stat().st_size for f in files if f.is_file())
-                file_count = len([f for f in files if f.is_file()])
-            else:
-                return {'total_size': 0, 'file_count': 0}
-            
             return {
-                'total_size': total_size,
-                'file_count': file_count,
-                'storage_type': self.storage_type
+                **self.index.get_totals(),
+                'storage_type': self.storage_type,
+                'placements': dict(self.placements)
             }
-            
         except Exception as e:
             logger.error(f"Error getting storage stats: {e}")
             return {'total_size': 0, 'file_count': 0}
+    
+    def _iter_backend_pages(self, page_size: int) -> Iterator[Page]:
+        """Walk the whole backend in pages of (key, size)"""
+        if self.storage_type == "s3":
+            # list_objects_v2 stops at 1000 keys per call, the paginator follows continuation tokens
+            paginator = self.s3_client.get_paginator('list_objects_v2')
+            for response in paginator.paginate(Bucket=self.bucket_name, PaginationConfig={'PageSize': page_size}):
+                yield [(obj['Key'], obj['Size']) for obj in response.get('Contents', [])]
+        elif self.storage_type == "local":
+            page = []
+            # scandir gives file type without a stat call per entry
+            with os.scandir(Config.LOCAL_OBJECTS_PATH) as entries:
+                for entry in entries:
+                    if not entry.is_file() or entry.name.startswith('.') or entry.name.endswith(TEMP_SUFFIXES):
+                        continue
+                    page.append((entry.name, entry.stat().st_size))
+                    if len(page) >= page_size:
+                        yield page
+                        page = []
+            yield page
+    
+    def reconcile_index(self) -> Optional[dict]:
+        """Rebuild manifest entries and totals from a full backend listing"""
+        try:
+            # Every bot process runs this loop, the index lets only one pass through per half interval
+            return self.index.reconcile(
+                self._iter_backend_pages(Config.STORAGE_RECONCILE_PAGE_SIZE),
+                min_interval=Config.STORAGE_RECONCILE_INTERVAL / 2
+            )
+        except Exception as e:
+            logger.error(f"Storage reconciliation error: {e}")
+            return None
+    
+    async def run_reconciliation(self, interval: float = Config.STORAGE_RECONCILE_INTERVAL):
+        """Reconcile manifest on start and then every interval seconds"""
+        loop = asyncio.get_event_loop()
+        while True:
+            await loop.run_in_executor(self.io_executor, self.reconcile_index)
+            await asyncio.sleep(interval)
 
 # Global storage manager instance
 storage_manager = StorageManager() 
\ No newline at end of file
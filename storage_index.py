@@ -0,0 +1,225 @@
+import logging
+import threading
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import delete, func, or_, select, update
+from sqlalchemy.exc import IntegrityError
+
+from database import db
+from models import StorageTotals, StoredObject
+
+logger = logging.getLogger(__name__)
+
+# Page of (key, size) pairs from a backend listing
+Page = List[Tuple[str, int]]
+
+class StorageIndex:
+    """Persistent manifest of stored objects with running totals.
+
+    Uploads and deletes update the manifest and the totals row in one
+    transaction, so stats are a single row lookup. Reconciliation walks
+    the backend page by page and fixes whatever changed behind our back.
+    """
+
+    # A pass holding the lease longer than this is taken to have died
+    RECONCILE_LEASE = timedelta(hours=1)
+
+    def __init__(self, backend: str):
+        self.backend = backend
+        self.reconciliations = 0
+        self._ready = False
+        self._lock = threading.Lock()
+
+    def _ensure_totals(self):
+        """Create totals row for the backend once"""
+        if self._ready:
+            return
+        with self._lock:
+            if self._ready:
+                return
+            try:
+                with db.get_session() as session:
+                    if not session.get(StorageTotals, self.backend):
+                        session.add(StorageTotals(backend=self.backend, total_size=0, file_count=0))
+            except IntegrityError:
+                pass  # created by another process
+            self._ready = True
+
+    def _adjust(self, session, size_delta: int, count_delta: int):
+        """Move running totals, atomic in the database"""
+        if not size_delta and not count_delta:
+            return
+        session.execute(
+            update(StorageTotals)
+            .where(StorageTotals.backend == self.backend)
+            .values(
+                total_size=StorageTotals.total_size + size_delta,
+                file_count=StorageTotals.file_count + count_delta
+            )
+        )
+
+    def _entry(self, session, key: str) -> Optional[StoredObject]:
+        return session.scalar(select(StoredObject).where(
+            StoredObject.backend == self.backend,
+            StoredObject.key == key
+        ))
+
+    def record(self, key: str, size: int):
+        """Add or update object after upload"""
+        try:
+            self._ensure_totals()
+            with db.get_session() as session:
+                entry = self._entry(session, key)
+                if entry:
+                    self._adjust(session, size - (entry.size or 0), 0)
+                    entry.size = size
+                    entry.seen_at = datetime.now()
+                else:
+                    session.add(StoredObject(backend=self.backend, key=key, size=size, seen_at=datetime.now()))
+                    self._adjust(session, size, 1)
+        except Exception as e:
+            logger.error(f"Storage index update error for {key}: {e}")
+
+    def remove(self, key: str):
+        """Drop object after delete"""
+        try:
+            self._ensure_totals()
+            with db.get_session() as session:
+                entry = self._entry(session, key)
+                if entry:
+                    self._adjust(session, -(entry.size or 0), -1)
+                    session.delete(entry)
+        except Exception as e:
+            logger.error(f"Storage index removal error for {key}: {e}")
+
+    def list_keys(self, prefix: str = "") -> List[str]:
+        """Keys starting with prefix, from the manifest"""
+        with db.get_session() as session:
+            query = select(StoredObject.key).where(StoredObject.backend == self.backend)
+            if prefix:
+                query = query.where(StoredObject.key.startswith(prefix, autoescape=True))
+            return list(session.scalars(query.order_by(StoredObject.key)))
+
+    def get_totals(self) -> dict:
+        """Running totals, one primary key lookup"""
+        with db.get_session() as session:
+            totals = session.get(StorageTotals, self.backend)
+            if not totals:
+                return {'total_size': 0, 'file_count': 0, 'reconciled_at': None}
+            return {
+                'total_size': totals.total_size or 0,
+                'file_count': totals.file_count or 0,
+                'reconciled_at': totals.reconciled_at.isoformat() if totals.reconciled_at else None
+            }
+
+    def _claim(self, started: datetime, min_interval: float) -> bool:
+        """Take the reconciliation lease unless another process holds it or a pass ran recently"""
+        with db.get_session() as session:
+            return session.execute(
+                update(StorageTotals)
+                .where(
+                    StorageTotals.backend == self.backend,
+                    or_(StorageTotals.reconciling_since.is_(None),
+                        StorageTotals.reconciling_since < started - self.RECONCILE_LEASE),
+                    or_(StorageTotals.reconciled_at.is_(None),
+                        StorageTotals.reconciled_at < started - timedelta(seconds=min_interval))
+                )
+                .values(reconciling_since=started)
+            ).rowcount == 1
+
+    def _release(self):
+        """Give up the lease after a failed pass"""
+        with db.get_session() as session:
+            session.execute(
+                update(StorageTotals)
+                .where(StorageTotals.backend == self.backend)
+                .values(reconciling_since=None)
+            )
+
+    def reconcile(self, pages: Iterable[Page], min_interval: float = 0) -> Optional[dict]:
+        """Bring manifest in line with a full backend listing.
+
+        Only one process reconciles at a time: the pass is skipped (None) if
+        another one holds the lease or finished less than min_interval
+        seconds ago. Each page is applied in its own transaction. Objects
+        not seen by this pass and not uploaded since it started are removed,
+        then the totals are recounted from the manifest.
+        """
+        self._ensure_totals()
+        started = datetime.now()
+        if not self._claim(started, min_interval):
+            logger.debug("Storage reconciliation skipped, running elsewhere or done recently")
+            return None
+        try:
+            return self._reconcile(pages, started)
+        except Exception:
+            self._release()
+            raise
+
+    def _apply_page(self, sizes: Dict[str, int], started: datetime) -> Tuple[int, int]:
+        """Add missing and resized objects of one page and mark the page as seen"""
+        added = changed = 0
+        with db.get_session() as session:
+            known = dict(session.execute(
+                select(StoredObject.key, StoredObject.size).where(
+                    StoredObject.backend == self.backend,
+                    StoredObject.key.in_(sizes)
+                )
+            ).all())
+            for key, size in sizes.items():
+                if key not in known:
+                    session.add(StoredObject(backend=self.backend, key=key, size=size, seen_at=started))
+                    added += 1
+                elif known[key] != size:
+                    session.execute(
+                        update(StoredObject)
+                        .where(StoredObject.backend == self.backend, StoredObject.key == key)
+                        .values(size=size)
+                    )
+                    changed += 1
+            # Uploads during the pass already have a newer seen_at
+            session.execute(
+                update(StoredObject)
+                .where(
+                    StoredObject.backend == self.backend,
+                    StoredObject.key.in_(list(known)),
+                    StoredObject.seen_at < started
+                )
+                .values(seen_at=started)
+            )
+        return added, changed
+
+    def _reconcile(self, pages: Iterable[Page], started: datetime) -> dict:
+        """Apply listing pages, drop unseen objects and recount totals"""
+        added = changed = 0
+        for page in pages:
+            if not page:
+                continue
+            try:
+                page_added, page_changed = self._apply_page(dict(page), started)
+            except IntegrityError:
+                # An upload indexed one of the keys meanwhile, it is known on the second try
+                page_added, page_changed = self._apply_page(dict(page), started)
+            added += page_added
+            changed += page_changed
+
+        with db.get_session() as session:
+            removed = session.execute(delete(StoredObject).where(
+                StoredObject.backend == self.backend,
+                StoredObject.seen_at < started
+            )).rowcount
+            count, total = session.execute(
+                select(func.count(), func.coalesce(func.sum(StoredObject.size), 0))
+                .where(StoredObject.backend == self.backend)
+            ).one()
+            session.execute(
+                update(StorageTotals)
+                .where(StorageTotals.backend == self.backend)
+                .values(total_size=total, file_count=count, reconciled_at=datetime.now(), reconciling_since=None)
+            )
+
+        self.reconciliations += 1
+        logger.info(f"Storage index reconciled: {count} objects, {added} added, "
+                    f"{changed} resized, {removed} removed")
+        return {'added': added, 'changed': changed, 'removed': removed, 'file_count': count, 'total_size': total}
@@ -0,0 +1,92 @@
+import time
+import logging
+import collections
+from typing import AsyncGenerator, Callable, Dict, Optional
+
+from aiogram import Bot
+from aiogram.types import InputFile
+from yt_dlp.utils import determine_protocol
+from yt_dlp.utils.networking import HTTPHeaderDict, clean_headers, std_headers
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+def is_streamable(fmt: Optional[Dict]) -> bool:
+    """Single-file format that can be piped from its URL straight into an upload.
+
+    Unprocessed extractor formats usually carry no protocol, it is derived
+    from the URL the same way yt-dlp does when processing them.
+    """
+    return bool(
+        fmt
+        and fmt.get('url')
+        and (fmt.get('protocol') or determine_protocol(fmt)) in ('http', 'https')
+        and fmt.get('filesize')
+    )
+
+def stream_headers(fmt: Dict, info: Optional[Dict] = None) -> Dict[str, str]:
+    """Request headers yt-dlp would send for format: its defaults plus format and video headers"""
+    headers = HTTPHeaderDict(std_headers, collections.ChainMap(fmt, info or {}).get('http_headers'))
+    clean_headers(headers)
+    # No cookies are configured for extraction, and yt-dlp never sends a raw Cookie header
+    headers.pop('Cookie', None)
+    return dict(headers)
+
+class StreamingInputFile(InputFile):
+    """Remote media streamed into the outgoing upload without a temp file.
+
+    The source is read in ranged requests of range_size bytes (like
+    yt-dlp's http_chunk_size), and each response is read in chunk_size
+    pieces, so at most one chunk is buffered.
+    """
+
+    def __init__(self, url: str, file_size: int, headers: Optional[Dict] = None,
+                 filename: Optional[str] = None,
+                 chunk_size: int = Config.STREAMING_CHUNK_SIZE,
+                 range_size: int = Config.DOWNLOAD_HTTP_CHUNK_SIZE,
+                 timeout: int = Config.STREAMING_TIMEOUT,
+                 on_progress: Optional[Callable[[Dict], None]] = None):
+        super().__init__(filename=filename, chunk_size=chunk_size)
+        self.url = url
+        self.file_size = file_size
+        self.headers = headers or {}
+        self.range_size = range_size or file_size
+        self.timeout = timeout
+        self.on_progress = on_progress
+        self.sent = 0
+
+    async def read(self, bot: Bot) -> AsyncGenerator[bytes, None]:
+        self.sent = 0
+        started = time.monotonic()
+        for start in range(0, self.file_size, self.range_size):
+            end = min(start + self.range_size, self.file_size) - 1
+            stream = bot.session.stream_content(
+                url=self.url,
+                headers={**self.headers, 'Range': f'bytes={start}-{end}'},
+                timeout=self.timeout,
+                chunk_size=self.chunk_size,
+                raise_for_status=True
+            )
+            async for chunk in stream:
+                self.sent += len(chunk)
+                self._report(started)
+                yield chunk
+
+        if self.sent != self.file_size:
+            # Abort the upload instead of sending a truncated file
+            raise IOError(f"Stream ended at {self.sent} of {self.file_size} bytes")
+
+    def _report(self, started: float):
+        """Pass progress in the same shape as the yt-dlp hook"""
+        if not self.on_progress:
+            return
+        elapsed = time.monotonic() - started
+        speed = self.sent / elapsed if elapsed else None
+        self.on_progress({
+            'status': 'finished' if self.sent >= self.file_size else 'downloading',
+            'downloaded_bytes': self.sent,
+            'total_bytes': self.file_size,
+            'speed': speed,
+            'eta': (self.file_size - self.sent) / speed if speed else None
+        })
@@ -0,0 +1,58 @@
+import copy
+import json
+import os
+
+import pytest
+import yt_dlp
+
+from format_selector import get_format
+from streaming import is_streamable, stream_headers
+
+FIXTURE = os.path.join(os.path.dirname(__file__), "fixtures", "youtube_unprocessed.json")
+
+@pytest.fixture
+def info():
+    """Extractor result as cached by metadata_service: process=False, then sanitize_info"""
+    with open(FIXTURE) as f:
+        return json.load(f)
+
+@pytest.fixture
+def processed(info):
+    """The same result after yt-dlp's own processing, without any network access"""
+    with yt_dlp.YoutubeDL({'quiet': True, 'no_warnings': True, 'format': '18'}) as ydl:
+        result = ydl.process_ie_result(copy.deepcopy(info), download=False)
+    return {fmt['format_id']: fmt for fmt in result['formats']}
+
+def test_fixture_formats_are_unprocessed(info):
+    progressive = get_format(info, "18")
+    assert 'protocol' not in progressive
+    assert 'http_headers' not in progressive
+
+def test_progressive_format_is_streamable(info, processed):
+    assert is_streamable(get_format(info, "18"))
+    assert processed["18"]['protocol'] == 'https'
+
+def test_audio_format_is_streamable(info):
+    assert is_streamable(get_format(info, "251"))
+
+def test_manifest_format_is_not_streamable(info):
+    assert not is_streamable(get_format(info, "233"))
+
+def test_format_without_size_is_not_streamable(info):
+    fmt = dict(get_format(info, "18"))
+    del fmt['filesize']
+    assert not is_streamable(fmt)
+
+def test_missing_format_is_not_streamable(info):
+    assert not is_streamable(get_format(info, "22"))
+
+def test_headers_match_yt_dlp(info, processed):
+    assert stream_headers(get_format(info, "18"), info) == dict(processed["18"]['http_headers'])
+
+def test_format_headers_override_defaults(info, processed):
+    info['http_headers'] = {'Referer': 'https://www.youtube.com/'}
+    fmt = dict(get_format(info, "18"), http_headers={'User-Agent': 'test-agent'})
+    headers = stream_headers(fmt, info)
+    assert headers['User-Agent'] == 'test-agent'
+    assert 'Referer' not in headers
+    assert headers['Accept'] == dict(processed["18"]['http_headers'])['Accept']
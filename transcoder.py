@@ -0,0 +1,217 @@
+import os
+import glob
+import math
+import uuid
+import asyncio
+import logging
+from typing import List, Optional
+
+from config import Config
+from metrics import stage_timer
+
+logger = logging.getLogger(__name__)
+
+class Transcoder:
+    """Re-encode or split oversized downloads with ffmpeg so they fit under a size budget.
+
+    ffmpeg runs as a separate niced process with a thread cap, and a
+    semaphore bounds how many re-encodes run at once, so transcoding never
+    takes CPU from the download workers. Splitting is stream copy and
+    does not wait for that semaphore.
+    """
+
+    # Muxing overhead and bitrate overshoot of single-pass encoding
+    SIZE_HEADROOM = 0.92
+
+    # Output height by available video bitrate in kbit/s
+    HEIGHT_STEPS = [(1500, 720), (700, 480), (300, 360), (0, 240)]
+
+    # Share of the budget audio may take when it is tight (long lectures)
+    AUDIO_SHARE = 0.35
+
+    # Parts are cut on keyframes, so aim below the limit and retry smaller if needed
+    SPLIT_HEADROOM = 0.9
+    SPLIT_ATTEMPTS = 3
+
+    def __init__(self, workers: int, threads: int, niceness: int, timeout: int):
+        self.workers = workers
+        self.threads = threads
+        self.niceness = niceness
+        self.timeout = timeout
+        self.succeeded = 0
+        self.failed = 0
+        self.splits = 0
+        self.split_failures = 0
+        self._semaphore: Optional[asyncio.Semaphore] = None
+
+    def target_bitrates(self, duration: Optional[float], max_size: int,
+                        audio_only: bool = False) -> Optional[dict]:
+        """Split size budget into video/audio bitrates in kbit/s, None if it cannot fit"""
+        if not duration or duration <= 0:
+            return None
+        total_kbps = max_size * 8 * self.SIZE_HEADROOM / duration / 1000
+
+        if audio_only:
+            audio_kbps = min(int(total_kbps), Config.TRANSCODE_AUDIO_KBPS * 3)
+            if audio_kbps < Config.TRANSCODE_MIN_AUDIO_KBPS:
+                return None
+            return {'video': 0, 'audio': audio_kbps}
+
+        audio_kbps = int(min(Config.TRANSCODE_AUDIO_KBPS,
+                             max(Config.TRANSCODE_MIN_AUDIO_KBPS, total_kbps * self.AUDIO_SHARE)))
+        video_kbps = int(total_kbps - audio_kbps)
+        if video_kbps < Config.TRANSCODE_MIN_VIDEO_KBPS:
+            return None
+        return {'video': video_kbps, 'audio': audio_kbps}
+
+    def can_fit(self, duration: Optional[float], max_size: int, audio_only: bool = False) -> bool:
+        """Check if a re-encode of this duration can get under max_size"""
+        return self.target_bitrates(duration, max_size, audio_only) is not None
+
+    def _build_command(self, source: str, target: str, bitrates: dict, audio_only: bool) -> List[str]:
+        """ffmpeg arguments for a single-pass bitrate-capped encode"""
+        command = ['ffmpeg', '-y', '-hide_banner', '-loglevel', 'error', '-i', source,
+                   '-threads', str(self.threads)]
+        if audio_only:
+            command += ['-vn', '-c:a', 'libmp3lame', '-b:a', f"{bitrates['audio']}k"]
+        else:
+            video_kbps = bitrates['video']
+            height = next(height for floor, height in self.HEIGHT_STEPS if video_kbps >= floor)
+            command += [
+                '-vf', f"scale=-2:'min({height},ih)'",
+                '-c:v', 'libx264', '-preset', 'veryfast',
+                '-b:v', f'{video_kbps}k', '-maxrate', f'{video_kbps}k', '-bufsize', f'{video_kbps * 2}k',
+                '-c:a', 'aac', '-b:a', f"{bitrates['audio']}k",
+                '-movflags', '+faststart'
+            ]
+        return command + [target]
+
+    def _lower_priority(self):
+        """Runs in the ffmpeg child before exec"""
+        os.nice(self.niceness)
+
+    async def transcode(self, source: str, duration: Optional[float], max_size: int,
+                        audio_only: bool = False) -> Optional[str]:
+        """Re-encode source to fit max_size, return new file path or None"""
+        bitrates = self.target_bitrates(duration, max_size, audio_only)
+        if bitrates is None:
+            logger.info(f"Transcode skipped, {duration}s does not fit into {max_size} bytes")
+            return None
+
+        extension = "mp3" if audio_only else "mp4"
+        target = os.path.join(os.path.dirname(source), f"{uuid.uuid4().hex}.{extension}")
+        command = self._build_command(source, target, bitrates, audio_only)
+
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.workers)
+
+        async with self._semaphore:
+            logger.info(f"Transcoding {source} at {bitrates} kbit/s")
+            with stage_timer.time("transcode"):
+                try:
+                    ok = await self._run(command)
+                except asyncio.CancelledError:
+                    if os.path.exists(target):
+                        os.remove(target)
+                    raise
+
+        if ok and os.path.exists(target) and os.path.getsize(target) <= max_size:
+            self.succeeded += 1
+            logger.info(f"Transcoded {source} -> {target} ({os.path.getsize(target)} bytes)")
+            return target
+
+        self.failed += 1
+        logger.warning(f"Transcode of {source} did not produce a file under {max_size} bytes")
+        if os.path.exists(target):
+            os.remove(target)
+        return None
+
+    def split_parts_needed(self, file_size: int, max_size: int) -> int:
+        """Number of parts a file of file_size is cut into"""
+        return max(2, math.ceil(file_size / (max_size * self.SPLIT_HEADROOM)))
+
+    async def split(self, source: str, duration: Optional[float], max_size: int,
+                    max_parts: int) -> Optional[List[str]]:
+        """Cut source into ordered parts under max_size with stream copy, None if it cannot"""
+        if not duration or duration <= 0:
+            return None
+        parts_needed = self.split_parts_needed(os.path.getsize(source), max_size)
+        directory = os.path.dirname(source)
+        extension = os.path.splitext(source)[1]
+
+        for attempt in range(self.SPLIT_ATTEMPTS):
+            if parts_needed > max_parts:
+                break
+            prefix = uuid.uuid4().hex
+            command = [
+                'ffmpeg', '-y', '-hide_banner', '-loglevel', 'error', '-i', source,
+                '-map', '0', '-c', 'copy',
+                '-f', 'segment', '-segment_time', f'{duration / parts_needed:.3f}', '-reset_timestamps', '1',
+                os.path.join(directory, f'{prefix}_%03d{extension}')
+            ]
+            logger.info(f"Splitting {source} into {parts_needed} parts (attempt {attempt + 1})")
+            pattern = os.path.join(directory, f'{prefix}_*{extension}')
+            with stage_timer.time("split"):
+                try:
+                    ok = await self._run(command)
+                except asyncio.CancelledError:
+                    for part in glob.glob(pattern):
+                        os.remove(part)
+                    raise
+            parts = sorted(glob.glob(pattern))
+
+            if ok and parts and len(parts) <= max_parts and all(os.path.getsize(p) <= max_size for p in parts):
+                self.splits += 1
+                logger.info(f"Split {source} into {len(parts)} parts")
+                return parts
+
+            for part in parts:
+                os.remove(part)
+            if not ok:
+                break
+            # A long GOP made a part too large, cut more often
+            parts_needed = max(parts_needed + 1, math.ceil(parts_needed * 1.25))
+
+        self.split_failures += 1
+        logger.warning(f"Could not split {source} into at most {max_parts} parts under {max_size} bytes")
+        return None
+
+    async def _run(self, command: List[str]) -> bool:
+        """Run ffmpeg, killing it on timeout or cancellation"""
+        process = await asyncio.create_subprocess_exec(
+            *command,
+            stdout=asyncio.subprocess.DEVNULL,
+            stderr=asyncio.subprocess.PIPE,
+            preexec_fn=self._lower_priority if self.niceness else None
+        )
+        try:
+            _, stderr = await asyncio.wait_for(process.communicate(), timeout=self.timeout)
+        except asyncio.TimeoutError:
+            process.kill()
+            await process.wait()
+            logger.error(f"ffmpeg timed out after {self.timeout}s")
+            return False
+        except asyncio.CancelledError:
+            process.kill()
+            await process.wait()
+            raise
+
+        if process.returncode != 0:
+            logger.error(f"ffmpeg failed ({process.returncode}): {stderr.decode(errors='replace')[-500:]}")
+            return False
+        return True
+
+    def get_stats(self) -> dict:
+        """Get transcode counters"""
+        return {
+            'workers': self.workers,
+            'succeeded': self.succeeded,
+            'failed': self.failed,
+            'splits': self.splits,
+            'split_failures': self.split_failures
+        }
+
+# Global transcoder instance
+transcoder = Transcoder(
+    Config.TRANSCODE_WORKERS, Config.TRANSCODE_THREADS, Config.TRANSCODE_NICE, Config.TRANSCODE_TIMEOUT
+)
@@ -0,0 +1,79 @@
+import logging
+from typing import Dict, Iterable, Optional
+
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
+
+from config import Config
+from cache import LRUCache
+from database import async_db
+from models import User
+
+logger = logging.getLogger(__name__)
+
+class UserIdentityCache:
+    """Bounded LRU from Telegram id to users.id; the mapping never changes once registered"""
+
+    def __init__(self, maxsize: int):
+        self.cache = LRUCache(maxsize=maxsize)
+
+    async def get_user_id(self, tg_user, create: bool = True) -> Optional[int]:
+        """Get users.id for a Telegram user, registering them on first sight"""
+        user_id = self.cache.get(tg_user.id)
+        if user_id is not None:
+            return user_id
+
+        try:
+            user_id = await self._upsert(tg_user, create)
+        except IntegrityError:
+            # Registered concurrently by another handler or instance
+            user_id = await self._upsert(tg_user, create=False)
+
+        if user_id is not None:
+            self.cache.set(tg_user.id, user_id)
+        return user_id
+
+    async def _upsert(self, tg_user, create: bool) -> Optional[int]:
+        """Look user up and insert if missing"""
+        async with async_db.get_session() as session:
+            user_id = await session.scalar(select(User.id).where(User.telegram_id == tg_user.id))
+            if user_id is None and create:
+                db_user = User(
+                    telegram_id=tg_user.id,
+                    username=tg_user.username,
+                    first_name=tg_user.first_name,
+                    last_name=tg_user.last_name
+                )
+                session.add(db_user)
+                await session.flush()
+                user_id = db_user.id
+                logger.info(f"Registered user {tg_user.id}")
+            return user_id
+
+    async def resolve(self, telegram_ids: Iterable[int]) -> Dict[int, int]:
+        """Map many Telegram ids to users.id, querying only cache misses"""
+        resolved = {}
+        missing = []
+        for telegram_id in set(telegram_ids):
+            user_id = self.cache.get(telegram_id)
+            if user_id is None:
+                missing.append(telegram_id)
+            else:
+                resolved[telegram_id] = user_id
+
+        if missing:
+            async with async_db.get_session() as session:
+                rows = await session.execute(
+                    select(User.telegram_id, User.id).where(User.telegram_id.in_(missing))
+                )
+                for telegram_id, user_id in rows.all():
+                    self.cache.set(telegram_id, user_id)
+                    resolved[telegram_id] = user_id
+        return resolved
+
+    def get_stats(self) -> dict:
+        """Get cache hit ratio"""
+        return self.cache.get_stats()
+
+# Global user identity cache instance
+user_cache = UserIdentityCache(Config.USER_CACHE_SIZE)
@@ -0,0 +1,34 @@
+import logging
+from typing import Optional
+
+from sqlalchemy import select, update
+from sqlalchemy.sql import func
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from models import DownloadStats
+
+logger = logging.getLogger(__name__)
+
+async def record_completed_download(session: AsyncSession, user_id: int, file_size: Optional[int],
+                                    count: int = 1):
+    """Add completed downloads to the user's running totals"""
+    result = await session.execute(
+        update(DownloadStats)
+        .where(DownloadStats.user_id == user_id)
+        .values(
+            total_downloads=DownloadStats.total_downloads + count,
+            total_size=DownloadStats.total_size + (file_size or 0),
+            last_download=func.now()
+        )
+    )
+    if result.rowcount == 0:
+        session.add(DownloadStats(
+            user_id=user_id,
+            total_downloads=count,
+            total_size=file_size or 0,
+            last_download=func.now()
+        ))
+
+async def get_user_stats(session: AsyncSession, user_id: int) -> Optional[DownloadStats]:
+    """Get user's running totals"""
+    return await session.scalar(select(DownloadStats).where(DownloadStats.user_id == user_id))
@@ -23,12 +23,15 @@ def validate_youtube_url(url: str) -> bool:
 def extract_video_id(url: str) -> Optional[str]:
     """Extract YouTube video ID from URL"""
     try:
+        url = url.strip()
+        if not re.match(r'^https?://', url):
+            url = f"https://{url}"
         parsed_url = urlparse(url)
         
         if parsed_url.hostname in ['youtu.be', 'www.youtu.be']:
             return parsed_url.path[1:]  # Remove leading slash
         
-        if parsed_url.hostname in ['youtube.com', 'www.youtube.com']:
+        if parsed_url.hostname in ['youtube.com', 'www.youtube.com', 'm.youtube.com']:
             if parsed_url.path == '/watch':
                 query_params = parse_qs(parsed_url.query)
                 return query_params.get('v', [None])[0]
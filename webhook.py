@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""ASGI app receiving Telegram updates via webhook"""
+
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+
+import uvicorn
+from fastapi import FastAPI, Request, Response
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.types import Update
+
+from config import Config
+from bot import bot, dp, setup_dispatcher, start_background_tasks, stop_background_tasks
+from file_cache import file_id_cache
+from media_cache import media_cache
+from metadata import metadata_service
+from metrics import stage_timer
+from storage import storage_manager
+from transcoder import transcoder
+from user_cache import user_cache
+from write_buffer import write_buffer
+from youtube_downloader import downloader
+
+logger = logging.getLogger(__name__)
+
+# Keep references to update tasks so they are not garbage collected mid-flight
+update_tasks = set()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Run background tasks for the lifetime of the worker"""
+    setup_dispatcher()
+    background_tasks = start_background_tasks()
+    
+    try:
+        yield
+    finally:
+        if update_tasks:
+            await asyncio.gather(*update_tasks, return_exceptions=True)
+        await stop_background_tasks(background_tasks)
+        await bot.session.close()
+
+app = FastAPI(lifespan=lifespan)
+
+@app.post(Config.WEBHOOK_PATH)
+async def telegram_webhook(request: Request) -> Response:
+    """Accept update and process it in background"""
+    if Config.WEBHOOK_SECRET and request.headers.get("X-Telegram-Bot-Api-Secret-Token") != Config.WEBHOOK_SECRET:
+        return Response(status_code=403)
+    
+    update = Update.model_validate(await request.json(), context={"bot": bot})
+    
+    # Answer Telegram immediately; downloads can take minutes
+    task = asyncio.create_task(dp.feed_update(bot, update))
+    update_tasks.add(task)
+    task.add_done_callback(update_tasks.discard)
+    return Response()
+
+@app.get("/health")
+async def health() -> dict:
+    """Health check for load balancer"""
+    return {"status": "ok"}
+
+@app.get("/metrics")
+async def metrics() -> dict:
+    """Per-stage timings, worker pool counters, cache counters and storage totals"""
+    loop = asyncio.get_event_loop()
+    return {
+        "stages": stage_timer.get_stats(),
+        "transcoder": transcoder.get_stats(),
+        "download_engine": downloader.get_engine_stats(),
+        "file_id_cache": file_id_cache.get_stats(),
+        "user_cache": user_cache.get_stats(),
+        "metadata": metadata_service.get_stats(),
+        "media_cache": media_cache.get_stats(),
+        "write_buffer": write_buffer.get_stats(),
+        "storage": await loop.run_in_executor(storage_manager.io_executor, storage_manager.get_storage_stats)
+    }
+
+async def register_webhook(attempts: int = 5):
+    """Set webhook once before workers start, waiting out flood control"""
+    setup_dispatcher()
+    try:
+        for attempt in range(1, attempts + 1):
+            try:
+                await bot.set_webhook(
+                    Config.TELEGRAM_WEBHOOK_URL,
+                    secret_token=Config.WEBHOOK_SECRET,
+                    allowed_updates=dp.resolve_used_update_types()
+                )
+                logger.info(f"Webhook set: {Config.TELEGRAM_WEBHOOK_URL}")
+                return
+            except TelegramRetryAfter as e:
+                if attempt == attempts:
+                    raise
+                logger.warning(f"Setting webhook throttled, retrying in {e.retry_after}s")
+                await asyncio.sleep(e.retry_after)
+    finally:
+        # Workers open their own sessions on their own event loops
+        await bot.session.close()
+
+def run_webhook():
+    """Register webhook and serve the app with uvicorn workers"""
+    asyncio.run(register_webhook())
+    logger.info(f"Starting webhook server on {Config.WEBHOOK_HOST}:{Config.WEBHOOK_PORT} "
+                f"with {Config.WEBHOOK_WORKERS} workers")
+    uvicorn.run(
+        "webhook:app",
+        host=Config.WEBHOOK_HOST,
+        port=Config.WEBHOOK_PORT,
+        workers=Config.WEBHOOK_WORKERS
+    )
+
+if __name__ == "__main__":
+    run_webhook()
@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+"""Download worker: consumes jobs from the job queue and updates DownloadRequest rows"""
+
+import os
+import asyncio
+import logging
+import argparse
+from datetime import datetime
+from typing import Dict, Optional
+
+from config import Config
+from database import async_db
+from models import DownloadRequest
+from user_stats import record_completed_download
+from job_queue import JobQueue, job_queue
+from youtube_downloader import downloader
+from metadata import metadata_service
+
+logger = logging.getLogger(__name__)
+
+async def update_request_status(request_id: Optional[int], status: str, **fields):
+    """Move DownloadRequest row to a new status"""
+    if not request_id:
+        return
+    try:
+        async with async_db.get_session() as session:
+            download_request = await session.get(DownloadRequest, request_id)
+            if not download_request:
+                logger.warning(f"Download request not found: {request_id}")
+                return
+            download_request.status = status
+            for name, value in fields.items():
+                setattr(download_request, name, value)
+            if status == "completed":
+                await record_completed_download(session, download_request.user_id, download_request.file_size)
+    except Exception as e:
+        logger.error(f"Database error updating request {request_id}: {e}")
+
+class DownloadWorker:
+    """Consume download jobs and publish results for the bot to deliver"""
+
+    # Jobs whose worker died this many times are failed instead of retried
+    MAX_JOB_ATTEMPTS = 3
+
+    def __init__(self, queue: JobQueue, concurrency: int = Config.WORKER_CONCURRENCY):
+        self.queue = queue
+        self.concurrency = concurrency
+        self._running = False
+
+    async def process_job(self, job: Dict) -> Dict:
+        """Download one job and return result for delivery"""
+        request_id = job.get('request_id')
+        logger.info(f"Processing job {job['job_id']}: {job['url']}")
+        await update_request_status(request_id, "processing")
+
+        try:
+            # Extraction made by the bot is reused when the shared metadata cache is enabled
+            info = await metadata_service.get_cached_info(job['url'])
+            success, file_path, download_info = await downloader.download_fitting_async(
+                job['url'], job['format_type'], job['quality'], info, job.get('format_id')
+            )
+        except Exception as e:
+            logger.error(f"Job {job['job_id']} failed: {e}")
+            success, file_path, download_info = False, "", None
+
+        if success and file_path and os.path.exists(file_path):
+            parts = (download_info or {}).get('parts')
+            file_size = sum(os.path.getsize(path) for path in parts or [file_path])
+            await update_request_status(
+                request_id, "completed",
+                file_path=file_path, file_size=file_size, completed_at=datetime.now()
+            )
+            return {**job, 'success': True, 'file_path': file_path, 'file_size': file_size, 'parts': parts}
+
+        await update_request_status(request_id, "failed", error_message="Download failed", completed_at=datetime.now())
+        return {**job, 'success': False, 'file_path': None, 'file_size': None}
+
+    async def retry_or_fail(self, job: Dict, reason: str):
+        """Put an unfinished job back in the queue, or fail it after MAX_JOB_ATTEMPTS"""
+        attempts = job.get('attempts', 0) + 1
+        if attempts < self.MAX_JOB_ATTEMPTS:
+            logger.warning(f"Requeueing job {job['job_id']} (attempt {attempts}): {reason}")
+            await self.queue.requeue({**job, 'attempts': attempts})
+            return
+        logger.error(f"Job {job['job_id']} failed after {attempts} attempts: {reason}")
+        await update_request_status(
+            job.get('request_id'), "failed", error_message=reason, completed_at=datetime.now()
+        )
+        await self.queue.publish_result({**job, 'success': False, 'file_path': None, 'file_size': None})
+        await self.queue.ack(job)
+
+    async def recover_jobs(self):
+        """Take over jobs of workers that died mid-download"""
+        for job in await self.queue.recover():
+            await self.retry_or_fail(job, "Download worker died")
+
+    async def _heartbeat(self):
+        """Keep this worker marked alive and pick up jobs of dead ones"""
+        while self._running:
+            await asyncio.sleep(self.queue.HEARTBEAT_INTERVAL)
+            try:
+                await self.queue.heartbeat()
+                await self.recover_jobs()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Worker heartbeat error: {e}")
+
+    async def _consume(self, index: int):
+        """Single consumer loop"""
+        while self._running:
+            job = None
+            try:
+                job = await self.queue.dequeue()
+                if job is None:
+                    continue
+                result = await self.process_job(job)
+                await self.queue.publish_result(result)
+                await self.queue.ack(job)
+            except asyncio.CancelledError:
+                # Left in the processing list, recovered once this worker is gone
+                raise
+            except Exception as e:
+                logger.error(f"Worker {index} error: {e}")
+                if job is not None:
+                    try:
+                        await self.retry_or_fail(job, str(e))
+                    except Exception as e:
+                        logger.error(f"Worker {index} could not requeue job {job['job_id']}: {e}")
+                await asyncio.sleep(1)
+
+    async def run(self):
+        """Run consumers until cancelled"""
+        self._running = True
+        logger.info(f"Download worker started with concurrency {self.concurrency}")
+        try:
+            # Alive before the first dequeue, so no other worker takes our jobs
+            await self.queue.heartbeat()
+            await self.recover_jobs()
+            await asyncio.gather(
+                self._heartbeat(),
+                *(self._consume(i) for i in range(self.concurrency))
+            )
+        finally:
+            self._running = False
+
+    def stop(self):
+        """Stop consuming after current jobs"""
+        self._running = False
+
+async def run_worker(concurrency: int):
+    """Run worker on the shared queue, releasing its jobs for recovery on exit"""
+    try:
+        await DownloadWorker(job_queue, concurrency).run()
+    finally:
+        await job_queue.close()
+
+def main():
+    """Run a standalone download worker process"""
+    parser = argparse.ArgumentParser(description="YouTube bot download worker")
+    parser.add_argument("--concurrency", type=int, default=Config.WORKER_CONCURRENCY)
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level=getattr(logging, Config.LOG_LEVEL),
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+
+    if Config.JOB_QUEUE_BACKEND == "memory":
+        logger.error("Memory job queue cannot be shared with a separate worker process, use JOB_QUEUE_BACKEND=redis")
+        return
+
+    try:
+        asyncio.run(run_worker(args.concurrency))
+    except KeyboardInterrupt:
+        logger.info("Worker stopped by user")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,220 @@
+import logging
+import asyncio
+from datetime import datetime
+from collections import defaultdict
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import select, update, bindparam
+
+from config import Config
+from database import async_db
+from models import User, DownloadRequest
+from user_stats import record_completed_download
+from user_cache import user_cache
+
+logger = logging.getLogger(__name__)
+
+class WriteBehindBuffer:
+    """Collect completed downloads and activity updates and write them in batched transactions"""
+
+    # A row that keeps failing on its own while others go through is dropped after this many flushes
+    MAX_ROW_ATTEMPTS = 3
+
+    def __init__(self, flush_interval: float, max_size: int):
+        self.flush_interval = flush_interval
+        self.max_size = max_size
+        self.flushes = 0
+        self.written = 0
+        # Rows of users missing from the users table, nothing to write them to
+        self.skipped = 0
+        self.dropped = 0
+        self._downloads: List[Dict] = []
+        self._activity: Dict[int, datetime] = {}
+        self._activity_attempts: Dict[int, int] = {}
+        self._full = asyncio.Event()
+        self._lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+
+    def __len__(self) -> int:
+        return len(self._downloads) + len(self._activity)
+
+    def add_download(self, telegram_id: int, **fields):
+        """Queue completed DownloadRequest row for the user"""
+        self._downloads.append({'telegram_id': telegram_id, **fields})
+        self._activity[telegram_id] = datetime.now()
+        self._check_size()
+
+    def touch_user(self, telegram_id: int):
+        """Queue last_activity update; repeated touches collapse into one"""
+        self._activity[telegram_id] = datetime.now()
+        self._check_size()
+
+    def _check_size(self):
+        """Flush early once the buffer is full"""
+        if len(self) >= self.max_size:
+            self._full.set()
+
+    async def flush(self):
+        """Write everything buffered in one transaction"""
+        async with self._lock:
+            downloads, self._downloads = self._downloads, []
+            activity, self._activity = self._activity, {}
+            if not downloads and not activity:
+                return
+
+            try:
+                self._count(*await self._write(downloads, activity))
+                self.flushes += 1
+                for telegram_id in activity:
+                    self._activity_attempts.pop(telegram_id, None)
+            except Exception as e:
+                logger.error(f"Write buffer flush error, retrying rows one by one: {e}")
+                await self._write_rows(downloads, activity)
+    
+    async def _write_rows(self, downloads: List[Dict], activity: Dict[int, datetime]):
+        """Write failed batch row by row so one bad row does not hold back the rest.
+        
+        If no row goes through and the database does not answer either, the
+        batch is put back as a whole. Otherwise failing rows are retried on
+        later flushes and dropped after MAX_ROW_ATTEMPTS.
+        """
+        failed_downloads, failed_activity = [], {}
+        for download in downloads:
+            try:
+                self._count(*await self._write([download], {}))
+            except Exception:
+                failed_downloads.append(download)
+        for telegram_id, at in activity.items():
+            try:
+                self._count(*await self._write([], {telegram_id: at}))
+                self._activity_attempts.pop(telegram_id, None)
+            except Exception:
+                failed_activity[telegram_id] = at
+        
+        succeeded = len(downloads) - len(failed_downloads) + len(activity) - len(failed_activity)
+        if not succeeded and not await self._database_alive():
+            self._restore(downloads, activity)
+            return
+        
+        retry_downloads = []
+        for download in failed_downloads:
+            download['attempts'] = download.get('attempts', 0) + 1
+            if download['attempts'] >= self.MAX_ROW_ATTEMPTS:
+                self.dropped += 1
+                logger.error(f"Dropping download row of user {download['telegram_id']} "
+                             f"after {download['attempts']} failed writes")
+            else:
+                retry_downloads.append(download)
+        retry_activity = {}
+        for telegram_id, at in failed_activity.items():
+            attempts = self._activity_attempts.get(telegram_id, 0) + 1
+            if attempts >= self.MAX_ROW_ATTEMPTS:
+                self.dropped += 1
+                self._activity_attempts.pop(telegram_id, None)
+                logger.error(f"Dropping activity update of user {telegram_id} after {attempts} failed writes")
+            else:
+                self._activity_attempts[telegram_id] = attempts
+                retry_activity[telegram_id] = at
+        self._restore(retry_downloads, retry_activity)
+
+    def _count(self, written: int, skipped: int):
+        """Add the outcome of a successful write to the counters"""
+        self.written += written
+        self.skipped += skipped
+
+    async def _write(self, downloads: List[Dict], activity: Dict[int, datetime]) -> Tuple[int, int]:
+        """Insert downloads, bump stats and last_activity.
+
+        Returns the number of rows written and of rows skipped because their
+        user is unknown.
+        """
+        user_ids = await user_cache.resolve(set(activity) | {d['telegram_id'] for d in downloads})
+        async with async_db.get_session() as session:
+            totals = defaultdict(lambda: [0, 0])
+            for download in downloads:
+                user_id = user_ids.get(download['telegram_id'])
+                if not user_id:
+                    continue
+                fields = {k: v for k, v in download.items() if k not in ('telegram_id', 'attempts')}
+                session.add(DownloadRequest(user_id=user_id, **fields))
+                totals[user_id][0] += 1
+                totals[user_id][1] += fields.get('file_size') or 0
+
+            for user_id, (count, size) in totals.items():
+                await record_completed_download(session, user_id, size, count)
+
+            known = [
+                {'tg_id': telegram_id, 'activity': at}
+                for telegram_id, at in activity.items() if telegram_id in user_ids
+            ]
+            if known:
+                # Core table statement: one executemany instead of ORM bulk update by primary key
+                users = User.__table__
+                await session.execute(
+                    update(users)
+                    .where(users.c.telegram_id == bindparam('tg_id'))
+                    .values(last_activity=bindparam('activity')),
+                    known
+                )
+        written = sum(count for count, _ in totals.values()) + len(known)
+        skipped = len(downloads) + len(activity) - written
+        if skipped:
+            logger.warning(f"Skipped {skipped} buffered rows of unknown users")
+        logger.debug(f"Flushed {written} of {len(downloads)} downloads and {len(activity)} activity updates")
+        return written, skipped
+
+    async def _database_alive(self) -> bool:
+        """Tell a database outage from rows that fail on their own"""
+        try:
+            async with async_db.get_session() as session:
+                await session.execute(select(1))
+            return True
+        except Exception:
+            return False
+    
+    def _restore(self, downloads: List[Dict], activity: Dict[int, datetime]):
+        """Put failed batch back unless the buffer has grown too large"""
+        if len(self) + len(downloads) > self.max_size * 10:
+            logger.error(f"Write buffer overflow, dropping {len(downloads)} downloads")
+            self.dropped += len(downloads)
+            return
+        self._downloads[:0] = downloads
+        for telegram_id, at in activity.items():
+            self._activity.setdefault(telegram_id, at)
+
+    async def _run(self):
+        """Flush on interval or when the buffer is full"""
+        while True:
+            try:
+                await asyncio.wait_for(self._full.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._full.clear()
+            # Shielded so stop() never cancels a batch halfway through
+            await asyncio.shield(self.flush())
+
+    def start(self) -> asyncio.Task:
+        """Start background flushing"""
+        self._task = asyncio.create_task(self._run())
+        return self._task
+
+    async def stop(self):
+        """Stop background flushing and write what is left"""
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self.flush()
+
+    def get_stats(self) -> dict:
+        """Get buffer statistics"""
+        return {
+            'pending': len(self),
+            'flushes': self.flushes,
+            'written': self.written,
+            'skipped': self.skipped,
+            'dropped': self.dropped
+        }
+
+# Global write-behind buffer instance
+write_buffer = WriteBehindBuffer(Config.WRITE_BUFFER_INTERVAL, Config.WRITE_BUFFER_SIZE)
@@ -1,18 +1,41 @@
 import yt_dlp
 import os
+import copy
+import time
+import uuid
 import logging
-from typing import Dict, Optional, Tuple
+from contextlib import asynccontextmanager
+from typing import Callable, Dict, Optional, Set, Tuple
 from pathlib import Path
 import asyncio
 from concurrent.futures import ThreadPoolExecutor
 
 from config import Config
+from download_engine import ProcessDownloadEngine
+from singleflight import SingleFlight
+from transcoder import transcoder
+from metrics import stage_timer
+from media_cache import media_cache
+from cancellation import CancelToken, remove_partial_files
+from utils import extract_video_id
 
 logger = logging.getLogger(__name__)
 
+ProgressCallback = Callable[[Dict], None]
+
 class YouTubeDownloader:
+    # Progress is forwarded out of the download thread at most this often
+    PROGRESS_FORWARD_INTERVAL = 1.0
+    
     def __init__(self):
-        self.executor = ThreadPoolExecutor(max_workers=3)
+        self.executor = ThreadPoolExecutor(max_workers=Config.DOWNLOAD_WORKERS)
+        self.engine = None
+        if Config.DOWNLOAD_ENGINE == "process":
+            self.engine = ProcessDownloadEngine(
+                Config.DOWNLOAD_WORKERS, Config.WORKER_MAX_JOBS, Config.WORKER_MAX_RSS_MB
+            )
+        self.flights = SingleFlight(on_release=self._release_download, cancel_abandoned=True)
+        self._progress_listeners: Dict[Tuple, Set[ProgressCallback]] = {}
         self._ensure_download_dir()
         self._check_ffmpeg()
     
@@ -35,37 +58,63 @@ class YouTubeDownloader:
             logger.warning(f"Could not check ffmpeg: {e}")
             self.ffmpeg_available = False
     
-    def get_video_info(self, url: str) -> Optional[Dict]:
-        """Get video information without downloading"""
+    def extract_info(self, url: str) -> Optional[Dict]:
+        """Extract raw video info once so it can be reused for formats and download"""
         try:
             ydl_opts = {
                 'quiet': True,
                 'no_warnings': True,
-                'extract_flat': True,
             }
             
             with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                info = ydl.extract_info(url, download=False)
+                # process=False keeps the extractor result unresolved, so the
+                # download step can still apply its own format selection
+                info = ydl.extract_info(url, download=False, process=False)
                 if info is None:
                     return None
-                return {
-                    'title': info.get('title', 'Unknown'),
-                    'duration': info.get('duration', 0),
-                    'uploader': info.get('uploader', 'Unknown'),
-                    'view_count': info.get('view_count', 0),
-                    'thumbnail': info.get('thumbnail'),
-                    'formats': info.get('formats', [])
-                }
+                return ydl.sanitize_info(info)
         except Exception as e:
-            logger.error(f"Error getting video info: {e}")
+            logger.error(f"Error extracting video info: {e}")
+            return None
+    
+    def summarize_info(self, info: Dict) -> Dict:
+        """Build short video description from extracted info"""
+        return {
+            'id': info.get('id'),
+            'title': info.get('title', 'Unknown'),
+            'duration': info.get('duration', 0),
+            'uploader': info.get('uploader', 'Unknown'),
+            'view_count': info.get('view_count', 0),
+            'thumbnail': info.get('thumbnail')
+        }
+    
+    def get_video_info(self, url: str, info: Optional[Dict] = None) -> Optional[Dict]:
+        """Get video information without downloading"""
+        if info is None:
+            info = self.extract_info(url)
+        if info is None:
             return None
+        return self.summarize_info(info)
     
-    def download_video(self, url: str, format_type: str = "mp4", quality: str = "best") -> Tuple[bool, str, Optional[Dict]]:
-        """Download video and return success status, file path, and info"""
+    def download_video(self, url: str, format_type: str = "mp4", quality: str = "best",
+                       info: Optional[Dict] = None, format_id: Optional[str] = None,
+                       progress: Optional[ProgressCallback] = None, stem: Optional[str] = None,
+                       cancel: Optional[CancelToken] = None) -> Tuple[bool, str, Optional[Dict]]:
+        """Download video and return success status, file path, and info.
+        
+        If info from extract_info() is given, the page is not extracted again.
+        format_id from select_format() takes priority over the quality spec.
+        progress is called from the download thread with throttled progress dicts.
+        stem names the output files; once cancel is set the download stops
+        at the next progress callback and its partial files are removed.
+        """
+        stem = stem or uuid.uuid4().hex
         try:
+            if cancel and cancel.cancelled:
+                return False, "", None
+            
             # Generate unique filename
-            import uuid
-            filename = f"{uuid.uuid4().hex}.{format_type}"
+            filename = f"{stem}.{format_type}"
             filepath = os.path.join(Config.LOCAL_STORAGE_PATH, filename)
             
             logger.info(f"Download path: {filepath}")
@@ -74,11 +123,12 @@ class YouTubeDownloader:
             if format_type == "mp3":
                 # Audio only
                 ydl_opts = {
-                    'format': 'bestaudio[ext=mp3]/bestaudio',
+                    'format': self._with_format_id('bestaudio[ext=mp3]/bestaudio', format_id),
                     'outtmpl': filepath,
                     'quiet': False,  # Enable output for debugging
                     'no_warnings': False,  # Show warnings
-                    'progress_hooks': [self._progress_hook],
+                    'progress_hooks': [self._make_progress_hook(progress, cancel)],
+                    **self.get_tuning_options(format_type, quality),
                 }
                 
                 # Add post-processor only if ffmpeg is available
@@ -103,19 +153,19 @@ class YouTubeDownloader:
                     format_spec = f'best[ext={format_type}]/best'
                 
                 ydl_opts = {
-                    'format': format_spec,
+                    'format': self._with_format_id(format_spec, format_id),
                     'outtmpl': filepath,
                     'quiet': False,  # Enable output for debugging
                     'no_warnings': False,  # Show warnings
-                    'progress_hooks': [self._progress_hook],
+                    'progress_hooks': [self._make_progress_hook(progress, cancel)],
+                    **self.get_tuning_options(format_type, quality),
                 }
             
             logger.info(f"Starting download: {url}, format: {format_type}, quality: {quality}")
             logger.info(f"yt-dlp options: {ydl_opts}")
             
             with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                logger.info("yt-dlp instance created, extracting info...")
-                info = ydl.extract_info(url, download=True)
+                info = self._run_download(ydl, url, info, cancel)
                 logger.info(f"Download completed, info: {info.get('title') if info else 'None'}")
                 
                 # Get actual file path (might be different for audio)
@@ -145,74 +195,327 @@ class YouTubeDownloader:
                     logger.info(f"Files in download directory: {files}")
                     return False, "", None
                     
+        except yt_dlp.utils.DownloadCancelled:
+            logger.info(f"Download cancelled: {url}")
+            remove_partial_files(Config.LOCAL_STORAGE_PATH, stem)
+            return False, "", None
         except Exception as e:
             logger.error(f"Error downloading video: {e}")
             import traceback
             logger.error(f"Traceback: {traceback.format_exc()}")
             return False, "", None
     
-    def _progress_hook(self, d):
-        """Progress hook for download monitoring"""
-        if d['status'] == 'downloading':
-            if 'total_bytes' in d and d['total_bytes']:
-                percent = (d['downloaded_bytes'] / d['total_bytes']) * 100
-                logger.info(f"Download progress: {percent:.1f}%")
-        elif d['status'] == 'finished':
-            logger.info("Download finished")
-    
-    async def download_video_async(self, url: str, format_type: str = "mp4", quality: str = "best") -> Tuple[bool, str, Optional[Dict]]:
-        """Async wrapper for video download"""
-        loop = asyncio.get_event_loop()
-        return await loop.run_in_executor(
-            self.executor, 
-            self.download_video, 
-            url, 
-            format_type, 
-            quality
+    def get_tuning_options(self, format_type: str, quality: str) -> Dict:
+        """yt-dlp network options for format/quality, see Config.DOWNLOAD_TUNING"""
+        tuning = {
+            'concurrent_fragments': Config.DOWNLOAD_CONCURRENT_FRAGMENTS,
+            'http_chunk_size': Config.DOWNLOAD_HTTP_CHUNK_SIZE,
+            'buffer_size': Config.DOWNLOAD_BUFFER_SIZE,
+            'retries': Config.DOWNLOAD_RETRIES,
+            'fragment_retries': Config.DOWNLOAD_FRAGMENT_RETRIES,
+            **Config.DOWNLOAD_TUNING.get("audio" if format_type == "mp3" else quality, {})
+        }
+        options = {
+            'concurrent_fragment_downloads': tuning['concurrent_fragments'],
+            'buffersize': tuning['buffer_size'],
+            'retries': tuning['retries'],
+            'fragment_retries': tuning['fragment_retries'],
+            'retry_sleep_functions': {'http': self._retry_sleep, 'fragment': self._retry_sleep},
+        }
+        if tuning['http_chunk_size']:
+            # Ranged requests avoid per-connection throttling of long single streams
+            options['http_chunk_size'] = tuning['http_chunk_size']
+        return options
+    
+    @staticmethod
+    def _retry_sleep(attempt: int) -> float:
+        """Exponential backoff between retries"""
+        return min(2 ** attempt, Config.DOWNLOAD_RETRY_SLEEP_MAX)
+    
+    def _with_format_id(self, format_spec: str, format_id: Optional[str]) -> str:
+        """Prefer selected format, keep quality spec as fallback"""
+        return f'{format_id}/{format_spec}' if format_id else format_spec
+    
+    def _run_download(self, ydl, url: str, info: Optional[Dict],
+                      cancel: Optional[CancelToken] = None) -> Optional[Dict]:
+        """Download from previously extracted info, re-extracting only if it is stale"""
+        if info is not None:
+            logger.info("Downloading from cached extraction")
+            try:
+                return ydl.process_ie_result(copy.deepcopy(info), download=True)
+            except yt_dlp.utils.DownloadCancelled:
+                raise
+            except Exception as e:
+                if cancel and cancel.cancelled:
+                    raise yt_dlp.utils.DownloadCancelled()
+                # Media URLs may have expired, or a field did not survive sanitize_info
+                logger.warning(f"Cached extraction failed, extracting again: {e}")
+        
+        logger.info("yt-dlp instance created, extracting info...")
+        return ydl.extract_info(url, download=True)
+    
+    def _make_progress_hook(self, progress: Optional[ProgressCallback] = None,
+                            cancel: Optional[CancelToken] = None):
+        """Progress hook with sampled logging and throttled forwarding to progress.
+        
+        yt-dlp calls hooks for every received chunk, so both logging and
+        forwarding are limited by time instead of running per callback.
+        The hook is also where a cancelled download is stopped.
+        """
+        last_log = last_forward = 0.0
+        
+        def hook(d):
+            nonlocal last_log, last_forward
+            if cancel and cancel.cancelled:
+                raise yt_dlp.utils.DownloadCancelled()
+            now = time.monotonic()
+            finished = d['status'] == 'finished'
+            if finished:
+                logger.info("Download finished")
+            elif d['status'] == 'downloading' and now - last_log >= Config.PROGRESS_LOG_INTERVAL:
+                last_log = now
+                total = d.get('total_bytes') or d.get('total_bytes_estimate')
+                if total:
+                    logger.info(f"Download progress: {d.get('downloaded_bytes', 0) / total * 100:.1f}%")
+            
+            if progress and (finished or now - last_forward >= self.PROGRESS_FORWARD_INTERVAL):
+                last_forward = now
+                progress({
+                    'status': d['status'],
+                    'downloaded_bytes': d.get('downloaded_bytes') or 0,
+                    'total_bytes': d.get('total_bytes') or d.get('total_bytes_estimate'),
+                    'speed': d.get('speed'),
+                    'eta': d.get('eta')
+                })
+        
+        return hook
+    
+    async def download_video_async(self, url: str, format_type: str = "mp4", quality: str = "best",
+                                   info: Optional[Dict] = None, format_id: Optional[str] = None,
+                                   progress: Optional[ProgressCallback] = None) -> Tuple[bool, str, Optional[Dict]]:
+        """Async wrapper for video download; progress is called from a worker thread.
+        
+        Cancelling the awaiting task stops the download in the worker too.
+        """
+        stem = uuid.uuid4().hex
+        cancel = CancelToken()
+        if self.engine:
+            future = asyncio.ensure_future(
+                self.engine.submit(url, format_type, quality, info, format_id, progress, stem, cancel)
+            )
+        else:
+            loop = asyncio.get_event_loop()
+            future = loop.run_in_executor(
+                self.executor, 
+                self.download_video, 
+                url, 
+                format_type, 
+                quality,
+                info,
+                format_id,
+                progress,
+                stem,
+                cancel
+            )
+        try:
+            return await asyncio.shield(future)
+        except asyncio.CancelledError:
+            cancel.cancel()
+            # The download may still finish before it sees the token
+            future.add_done_callback(self._discard_result)
+            raise
+    
+    def _discard_result(self, future: asyncio.Future):
+        """Clean up a download that completed after its caller was cancelled"""
+        if future.cancelled() or future.exception() is not None:
+            return
+        success, file_path, download_info = future.result()
+        if success:
+            self.cleanup_download(file_path, download_info)
+    
+    async def download_fitting_async(self, url: str, format_type: str = "mp4", quality: str = "best",
+                                     info: Optional[Dict] = None, format_id: Optional[str] = None,
+                                     progress: Optional[ProgressCallback] = None) -> Tuple[bool, str, Optional[Dict]]:
+        """Download video and re-encode or split it if it exceeds MAX_FILE_SIZE.
+
+        Split parts are listed in order in info['parts'], file_path is the first one.
+        """
+        with stage_timer.time("download"):
+            success, file_path, download_info = await self.download_video_async(
+                url, format_type, quality, info, format_id, progress
+            )
+        if not (success and file_path and os.path.getsize(file_path) > Config.MAX_FILE_SIZE):
+            return success, file_path, download_info
+        if not self.ffmpeg_available:
+            return success, file_path, download_info
+        
+        try:
+            return await self._fit_download(format_type, file_path, download_info)
+        except asyncio.CancelledError:
+            self.cleanup_file(file_path)
+            raise
+    
+    async def _fit_download(self, format_type: str, file_path: str,
+                            download_info: Dict) -> Tuple[bool, str, Optional[Dict]]:
+        """Re-encode or split oversized file according to OVERSIZE_STRATEGY"""
+        success = True
+        if Config.OVERSIZE_STRATEGY == "split":
+            parts = await transcoder.split(
+                file_path, download_info.get('duration'), Config.MAX_FILE_SIZE, Config.SPLIT_MAX_PARTS
+            )
+            if not parts:
+                return success, file_path, download_info
+            self.cleanup_file(file_path)
+            return True, parts[0], {**download_info, 'parts': parts}
+        
+        if Config.OVERSIZE_STRATEGY != "transcode":
+            return success, file_path, download_info
+        
+        transcoded = await transcoder.transcode(
+            file_path, download_info.get('duration'), Config.MAX_FILE_SIZE, audio_only=format_type == "mp3"
+        )
+        if not transcoded:
+            return success, file_path, download_info
+        
+        self.cleanup_file(file_path)
+        return True, transcoded, {**download_info, 'file_size': os.path.getsize(transcoded), 'transcoded': True}
+    
+    @asynccontextmanager
+    async def download_shared(self, url: str, format_type: str = "mp4", quality: str = "best",
+                              info: Optional[Dict] = None, format_id: Optional[str] = None,
+                              on_progress: Optional[ProgressCallback] = None):
+        """Download video once for all concurrent identical requests.
+
+        Usage: ``async with downloader.download_shared(url, fmt, q) as result``.
+        The downloaded file is cleaned up, or unpinned if it went into the
+        media cache, after the last caller leaves the block.
+        on_progress is called on the event loop for every caller sharing the download.
+        """
+        video_id = extract_video_id(url)
+        key = (video_id or url, format_type, quality)
+        cached = media_cache.get(key) if video_id and media_cache.enabled else None
+        if cached:
+            logger.info(f"Serving {key} from media cache")
+            media_cache.pin(cached)
+            try:
+                yield True, cached.files[0], {**cached.info, 'cache_key': key}
+            finally:
+                media_cache.unpin(cached)
+            return
+        
+        listeners = self._progress_listeners.setdefault(key, set())
+        if on_progress:
+            listeners.add(on_progress)
+        
+        loop = asyncio.get_running_loop()
+        
+        def progress(d: Dict):
+            # Runs in the download thread, hand over to the event loop
+            loop.call_soon_threadsafe(self._publish_progress, key, d)
+        
+        try:
+            async with self.flights.join(
+                key, lambda: self._download_to_cache(
+                    key if video_id and media_cache.enabled else None,
+                    url, format_type, quality, info, format_id, progress
+                )
+            ) as result:
+                yield result
+        finally:
+            listeners.discard(on_progress)
+            if not listeners and self._progress_listeners.get(key) is listeners:
+                del self._progress_listeners[key]
+    
+    async def _download_to_cache(self, cache_key: Optional[Tuple], url: str, format_type: str, quality: str,
+                                 info: Optional[Dict], format_id: Optional[str],
+                                 progress: ProgressCallback) -> Tuple[bool, str, Optional[Dict]]:
+        """Download and move the result into the media cache, pinned until the flight is released"""
+        success, file_path, download_info = await self.download_fitting_async(
+            url, format_type, quality, info, format_id, progress
         )
+        if not (success and file_path and cache_key):
+            return success, file_path, download_info
+        
+        entry = media_cache.put(cache_key, file_path, download_info)
+        if not entry:
+            return success, file_path, download_info
+        return True, entry.files[0], {**entry.info, 'cache_key': cache_key}
+    
+    def _publish_progress(self, key: Tuple, d: Dict):
+        """Deliver progress to everyone waiting for the download"""
+        for listener in list(self._progress_listeners.get(key, ())):
+            try:
+                listener(d)
+            except Exception as e:
+                logger.error(f"Progress listener error: {e}")
+    
+    def _release_download(self, result: Tuple[bool, str, Optional[Dict]]):
+        """Clean up shared download, or unpin its cache entry, once nobody uses it"""
+        success, file_path, download_info = result
+        if not success:
+            return
+        cache_key = (download_info or {}).get('cache_key')
+        if cache_key:
+            entry = media_cache.peek(cache_key)
+            if entry:
+                media_cache.unpin(entry)
+            return
+        self.cleanup_download(file_path, download_info)
     
-    def get_available_formats(self, url: str) -> Dict:
+    def cleanup_download(self, file_path: Optional[str], download_info: Optional[Dict] = None):
+        """Clean up downloaded file together with its split parts"""
+        for path in (download_info or {}).get('parts') or [file_path]:
+            if path:
+                self.cleanup_file(path)
+    
+    def get_available_formats(self, url: str, info: Optional[Dict] = None) -> Dict:
         """Get available formats for a video"""
         try:
-            ydl_opts = {
-                'quiet': True,
-                'no_warnings': True,
+            if info is None:
+                info = self.extract_info(url)
+            if info is None:
+                return {'video': [], 'audio': []}
+            
+            formats = info.get('formats', [])
+            
+            available_formats = {
+                'video': [],
+                'audio': []
             }
             
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                info = ydl.extract_info(url, download=False)
-                if info is None:
-                    return {'video': [], 'audio': []}
-                formats = info.get('formats', [])
-                
-                available_formats = {
-                    'video': [],
-                    'audio': []
-                }
-                
-                for fmt in formats:
-                    if fmt.get('vcodec') != 'none' and fmt.get('acodec') != 'none':
-                        available_formats['video'].append({
-                            'format_id': fmt.get('format_id'),
-                            'ext': fmt.get('ext'),
-                            'quality': fmt.get('format_note', 'Unknown'),
-                            'filesize': fmt.get('filesize'),
-                            'height': fmt.get('height')
-                        })
-                    elif fmt.get('acodec') != 'none':
-                        available_formats['audio'].append({
-                            'format_id': fmt.get('format_id'),
-                            'ext': fmt.get('ext'),
-                            'quality': fmt.get('format_note', 'Unknown'),
-                            'filesize': fmt.get('filesize')
-                        })
-                
-                return available_formats
-                
+            for fmt in formats:
+                if fmt.get('vcodec') != 'none' and fmt.get('acodec') != 'none':
+                    available_formats['video'].append({
+                        'format_id': fmt.get('format_id'),
+                        'ext': fmt.get('ext'),
+                        'quality': fmt.get('format_note', 'Unknown'),
+                        'filesize': fmt.get('filesize'),
+                        'height': fmt.get('height')
+                    })
+                elif fmt.get('acodec') != 'none':
+                    available_formats['audio'].append({
+                        'format_id': fmt.get('format_id'),
+                        'ext': fmt.get('ext'),
+                        'quality': fmt.get('format_note', 'Unknown'),
+                        'filesize': fmt.get('filesize')
+                    })
+            
+            return available_formats
+            
         except Exception as e:
             logger.error(f"Error getting available formats: {e}")
             return {'video': [], 'audio': []}
     
+    def get_engine_stats(self) -> Optional[dict]:
+        """Get process engine utilization statistics"""
+        return self.engine.get_stats() if self.engine else None
+    
+    def shutdown(self):
+        """Stop download workers"""
+        if self.engine:
+            self.engine.shutdown()
+        self.executor.shutdown(wait=False)
+    
     def cleanup_file(self, filepath: str):
         """Clean up downloaded file"""
         try: